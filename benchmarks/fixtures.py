@@ -0,0 +1,159 @@
+"""
+基准测试夹具 - Benchmark Fixtures
+
+本地 aiohttp 夹具服务器，回放录制的页面，不访问真实站点：
+- 内置合成页面：搜索 JSON、大型 HTML 目录、GBK 编码的章节
+- 也可加载录制目录中的页面（相对路径即URL路径）
+- 可配置的响应延迟和抖动，模拟真实站点的响应时间
+- 可同时监听多个回环地址（127.0.0.x），让每个书源对应独立的主机
+"""
+
+import json
+import random
+import asyncio
+import mimetypes
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+
+Page = Tuple[bytes, str]  # (响应体, Content-Type)
+
+
+def build_search_page(books: int = 20) -> Page:
+    """搜索接口的 JSON 响应"""
+    data = {
+        "code": 0,
+        "data": {
+            "books": [
+                {
+                    "name": f"基准测试小说{i}",
+                    "author": f"作者{i % 7}",
+                    "intro": "一段用于基准测试的简介。" * 5,
+                    "kind": "玄幻",
+                    "book_url": f"/book/{i}",
+                    "last_chapter": f"第{1000 + i}章 终章",
+                }
+                for i in range(books)
+            ]
+        },
+    }
+    return json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+
+
+def build_toc_page(chapters: int = 3000) -> Page:
+    """大型 HTML 目录页"""
+    items = "\n".join(
+        f'<li class="chapter"><a href="/chapter/{i}.html" title="第{i + 1}章">第{i + 1}章 标题{i}</a></li>'
+        for i in range(chapters)
+    )
+    html = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>目录</title></head>
+<body>
+<div id="info"><h1>基准测试小说</h1><p class="author">作者：测试</p></div>
+<ul id="list">
+{items}
+</ul>
+</body></html>"""
+    return html.encode("utf-8"), "text/html; charset=utf-8"
+
+
+def build_gbk_chapter_page(index: int = 0, paragraphs: int = 60) -> Page:
+    """GBK 编码的章节页，响应头不声明编码，需要检测"""
+    body = "\n".join(f"<p>　　第{index + 1}章的第{i + 1}段，鑫淼燚垚等较少见的汉字也要正确解码。</p>" for i in range(paragraphs))
+    html = f"""<html><head><title>第{index + 1}章</title></head>
+<body><h1>第{index + 1}章</h1><div id="content">
+{body}
+</div></body></html>"""
+    return html.encode("gbk"), "text/html"
+
+
+def build_default_pages(books: int = 20, chapters: int = 3000, gbk_chapters: int = 50) -> Dict[str, Page]:
+    """内置的合成页面"""
+    pages = {
+        "/search": build_search_page(books),
+        "/toc.html": build_toc_page(chapters),
+    }
+    for index in range(gbk_chapters):
+        pages[f"/gbk/{index}.html"] = build_gbk_chapter_page(index)
+    return pages
+
+
+def load_recorded_pages(directory: str) -> Dict[str, Page]:
+    """加载录制目录中的页面，文件相对路径即URL路径"""
+    pages = {}
+    root = Path(directory)
+    for path in sorted(root.rglob("*")):
+        if not path.is_file():
+            continue
+        content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        pages["/" + path.relative_to(root).as_posix()] = (path.read_bytes(), content_type)
+    return pages
+
+
+class FixtureServer:
+    """回放页面的本地HTTP服务器"""
+
+    def __init__(self, pages: Dict[str, Page], latency: float = 0.0, jitter: float = 0.0,
+                 hosts: int = 1, seed: Optional[int] = 0):
+        self.pages = pages
+        self.latency = latency
+        self.jitter = jitter
+        self.hosts = max(hosts, 1)
+        self.random = random.Random(seed)
+
+        self.port = 0
+        self.addresses: List[str] = []
+        self.requests = 0
+        self.bytes_sent = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        page = self.pages.get(request.path)
+        if page is None:
+            return web.Response(status=404)
+        body, content_type = page
+        self.bytes_sent += len(body)
+        return web.Response(body=body, headers={"Content-Type": content_type})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.addresses = ["127.0.0.1"]
+
+        # Linux 上整个 127.0.0.0/8 都是回环地址，其他系统绑定失败时只用 127.0.0.1
+        for index in range(2, self.hosts + 1):
+            address = f"127.0.0.{index}"
+            try:
+                await web.TCPSite(self._runner, address, self.port).start()
+            except OSError:
+                break
+            self.addresses.append(address)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def url(self, path: str, host_index: int = 0) -> str:
+        """第 host_index 个主机上的页面地址"""
+        address = self.addresses[host_index % len(self.addresses)]
+        return f"http://{address}:{self.port}{path}"
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
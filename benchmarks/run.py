@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+性能基准 - Benchmarks
+
+离线基准测试，所有请求都发往本地夹具服务器：
+- search_fanout: 全局搜索并发扇出吞吐量
+- chapter_fetch: GBK 章节抓取与编码检测吞吐量
+- toc_parse: 大型 HTML 目录的规则解析耗时
+- rule_eval: 各类规则的每秒解析次数
+- purify: 正文净化逐条执行与合并单次扫描的对比
+- cache: 缓存各层级 get/set 延迟与内存占用
+- replay_load: 指定 --cassette 时按录制的到达时间回放生产流量
+
+结果以 JSON 输出；指定 --baseline 时与基线比较，性能下降超过阈值则以退出码 1 结束。
+
+用法:
+  python benchmarks/run.py --output bench.json
+  python benchmarks/run.py --baseline bench.json --threshold 0.2
+  python benchmarks/run.py --only replay_load --cassette data/cassettes/traffic.cassette
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import asyncio
+import argparse
+import logging
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from src.core.engine import BookSourceEngine, BaseSource, BookInfo, ChapterInfo, ContentInfo
+from src.core.network import NetworkManager
+from src.core.rules import RuleEngine
+from src.core.cache import CacheManager
+from src.core.purifier import ContentPurifier
+from src.core.cassette import replay_load
+from fixtures import FixtureServer, build_default_pages, load_recorded_pages
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """分位数（最近秩法）"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def rss_mb() -> float:
+    """当前进程常驻内存（MB）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage / 1024 / 1024 if sys.platform == "darwin" else usage / 1024
+
+
+def latency_stats(samples: List[float], unit: str = "ms") -> Dict[str, float]:
+    """延迟样本的 p50/p99/平均值"""
+    scale = 1e3 if unit == "ms" else 1e6
+    return {
+        f"p50_{unit}": percentile(samples, 0.5) * scale,
+        f"p99_{unit}": percentile(samples, 0.99) * scale,
+        f"mean_{unit}": statistics.fmean(samples) * scale if samples else 0.0,
+    }
+
+
+class FixtureSource(BaseSource):
+    """请求夹具服务器的书源"""
+
+    def __init__(self, name: str, base_url: str, rules: RuleEngine):
+        super().__init__({"bookSourceName": name, "bookSourceUrl": base_url})
+        self.rules = rules
+
+    async def search(self, keyword: str, page: int = 1) -> List[BookInfo]:
+        text = await self.network.get_text(f"{self.url}/search", params={"q": keyword, "page": page})
+        names = self.rules.parse_rule("$.data.books[*].name", text)
+        authors = self.rules.parse_rule("$.data.books[*].author", text)
+        return [BookInfo(name=name, author=author) for name, author in zip(names, authors)]
+
+    async def get_book_info(self, book_url: str) -> BookInfo:
+        return BookInfo(book_url=book_url, toc_url=f"{self.url}/toc.html")
+
+    async def get_toc(self, toc_url: str) -> List[ChapterInfo]:
+        text = await self.network.get_text(toc_url)
+        names = self.rules.parse_rule("#list a@text", text)
+        urls = self.rules.parse_rule("#list a@href", text, toc_url)
+        return [ChapterInfo(name=name, url=url) for name, url in zip(names, urls)]
+
+    async def get_content(self, chapter_url: str) -> ContentInfo:
+        text = await self.network.get_text(chapter_url)
+        return ContentInfo(content=self.rules.parse_rule("#content@text", text))
+
+
+def _quiet_engine() -> BookSourceEngine:
+    """创建引擎并关闭日志和HTTP缓存，避免干扰计时"""
+    engine = BookSourceEngine()
+    logging.getLogger().setLevel(logging.WARNING)
+    engine.network.http_cache.enabled = False
+    return engine
+
+
+async def bench_search_fanout(server: FixtureServer, args) -> Dict[str, Any]:
+    """全局搜索扇出：每次搜索并发请求全部书源"""
+    engine = _quiet_engine()
+    for index in range(args.sources):
+        base_url = server.url("", index).rstrip("/")
+        engine.register_source(f"bench{index}", FixtureSource(f"bench{index}", base_url, engine.rules))
+
+    durations = []
+    requests_before = server.requests
+    results = 0
+    try:
+        await engine.search_all("预热")
+        requests_before = server.requests
+        start = time.perf_counter()
+        for iteration in range(args.iterations):
+            began = time.perf_counter()
+            found = await engine.search_all(f"关键词{iteration}")
+            durations.append(time.perf_counter() - began)
+            results += sum(len(books) for books in found.values())
+        elapsed = time.perf_counter() - start
+    finally:
+        await engine.network.close_session()
+
+    source_requests = server.requests - requests_before
+    return {
+        "sources": args.sources,
+        "hosts": len(server.addresses),
+        "searches": args.iterations,
+        "searches_per_sec": args.iterations / elapsed,
+        "source_requests_per_sec": source_requests / elapsed,
+        "results_per_search": results / max(args.iterations, 1),
+        **latency_stats(durations),
+    }
+
+
+async def bench_chapter_fetch(server: FixtureServer, args) -> Dict[str, Any]:
+    """并发抓取 GBK 章节并自动检测编码"""
+    network = NetworkManager({"http_cache": {"enabled": False}})
+    logging.getLogger().setLevel(logging.WARNING)
+    paths = [path for path in server.pages if path.startswith("/gbk/")]
+    urls = [server.url(path, index) for index, path in enumerate(paths)]
+    durations = []
+
+    async def fetch(url: str) -> int:
+        began = time.perf_counter()
+        text = await network.get_text(url)
+        durations.append(time.perf_counter() - began)
+        return len(text)
+
+    try:
+        await fetch(urls[0])
+        durations.clear()
+        start = time.perf_counter()
+        characters = 0
+        for _ in range(args.iterations):
+            characters += sum(await asyncio.gather(*(fetch(url) for url in urls)))
+        elapsed = time.perf_counter() - start
+        charset = network.charset.get_stats()
+    finally:
+        await network.close_session()
+
+    chapters = len(urls) * args.iterations
+    return {
+        "chapters": chapters,
+        "chapters_per_sec": chapters / elapsed,
+        "characters_per_sec": characters / elapsed,
+        "charset_sources": charset["sources"],
+        **latency_stats(durations),
+    }
+
+
+def _timed(func: Callable[[], Any], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - began)
+    return samples
+
+
+def bench_toc_parse(server: FixtureServer, args) -> Dict[str, Any]:
+    """大型目录页的章节名和链接解析"""
+    rules = RuleEngine()
+    html = server.pages["/toc.html"][0].decode("utf-8")
+    chapters = len(rules.parse_rule("#list a@href", html))
+    results = {"chapters": chapters, "page_kb": len(html.encode("utf-8")) / 1024}
+    for name, rule in (("css", "#list a@text"), ("xpath", "//ul[@id='list']/li/a/@href")):
+        samples = _timed(lambda: rules.parse_rule(rule, html), max(args.iterations // 2, 3))
+        results[name] = {
+            **latency_stats(samples),
+            "chapters_per_sec": chapters / statistics.fmean(samples),
+        }
+    return results
+
+
+def bench_rule_eval(server: FixtureServer, args) -> Dict[str, Any]:
+    """各类规则的每秒解析次数（小页面，主要反映单次解析的固定开销）"""
+    rules = RuleEngine()
+    json_text = server.pages["/search"][0].decode("utf-8")
+    html = '<div id="info"><h1>书名</h1><p class="author">作者：测试</p><a href="/book/1">详情</a></div>'
+    cases = {
+        "json": ("$.data.books[0].name", json_text),
+        "css": ("class.author@text", html),
+        "xpath": ("//h1/text()", html),
+        "regex": ("##作者：(.*?)<", html),
+        "text": ("书名", html),
+    }
+    results = {}
+    for rule_type, (rule, content) in cases.items():
+        count = 0
+        deadline = time.perf_counter() + args.duration
+        began = time.perf_counter()
+        while time.perf_counter() < deadline:
+            rules.parse_rule(rule, content)
+            count += 1
+        results[rule_type] = {"ops_per_sec": count / (time.perf_counter() - began)}
+    return results
+
+
+def bench_purify(server: FixtureServer, args) -> Dict[str, Any]:
+    """一章正文按多条 replaceRegex 规则净化：逐条扫描 vs 合并后单次扫描"""
+    rules = [
+        "##番茄小说.*?最新章节|www\\.fanqienovel\\.com|字节跳动.*?版权所有",
+        "##请记住本书首发域名[:：].*",
+        "##手机版阅读网址[:：].*",
+        "##本章未完，请点击下一页继续阅读",
+        "##天才一秒记住.*?地址",
+        "##求月票|求推荐票|求收藏",
+        "##[（(]?[wW]{3}\\.[a-z0-9]+\\.(?:com|net|cc)[)）]?",
+        "##&nbsp;|<br\\s*/?>",
+    ]
+    clean = "　　他推开门，屋里一片寂静。\n" * 400
+    dirty = clean[:len(clean) // 2] + "www.fanqienovel.com\n本章未完，请点击下一页继续阅读\n" + clean[len(clean) // 2:]
+    results = {"rules": len(rules), "chapter_kb": len(dirty.encode("utf-8")) / 1024}
+    for mode, merge in (("sequential", False), ("merged", True)):
+        purifier = ContentPurifier("\n".join(rules), {"purify_merge": merge})
+        for name, text in (("dirty", dirty), ("clean", clean)):
+            samples = _timed(lambda: purifier.purify(text), args.iterations)
+            results[f"{mode}_{name}"] = {
+                **latency_stats(samples, "us"),
+                "chapters_per_sec": 1 / statistics.fmean(samples),
+            }
+    return results
+
+
+def bench_cache(server: FixtureServer, args) -> Dict[str, Any]:
+    """缓存各层级的读写延迟和内存占用"""
+    value = {"title": "第1章", "content": "正文内容。" * 600}
+    entries = args.cache_entries
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for tier, config in (
+            ("memory", {"file_cache": False, "db_cache": False}),
+            ("db", {"file_cache": False, "db_cache": True}),
+        ):
+            gc.collect()
+            rss_before = rss_mb()
+            tier_dir = os.path.join(cache_dir, tier)
+            os.makedirs(tier_dir)
+            cache = CacheManager({
+                "cache_dir": tier_dir, "max_size": entries + 1,
+                "cleanup_interval": 3600, **config
+            })
+            logging.getLogger().setLevel(logging.WARNING)
+            set_samples = _timed_keys(lambda key: cache.set(key, value), entries)
+            if tier == "db":
+                # 清空内存层，读取时必须命中数据库
+                cache.memory_cache.clear()
+            get_samples = _timed_keys(lambda key: cache.get(key), entries)
+            results[tier] = {
+                "entries": entries,
+                "set": latency_stats(set_samples, "us"),
+                "get": latency_stats(get_samples, "us"),
+                "rss_delta_mb": rss_mb() - rss_before,
+            }
+    return results
+
+
+async def bench_replay_load(server: FixtureServer, args) -> Dict[str, Any]:
+    """回放录制的上游流量：保持原始到达间隔和响应耗时（按 --time-scale 缩放）"""
+    if not args.cassette:
+        return {"skipped": "未指定 --cassette"}
+    network = NetworkManager({
+        "http_cache": {"enabled": False},
+        "cassette": {"mode": "replay", "path": args.cassette, "time_scale": args.time_scale},
+    })
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        return await replay_load(network, args.time_scale)
+    finally:
+        await network.close_session()
+
+
+def _timed_keys(func: Callable[[str], Any], entries: int) -> List[float]:
+    samples = []
+    for index in range(entries):
+        key = f"content:bench:https://bench.test/chapter/{index}"
+        began = time.perf_counter()
+        func(key)
+        samples.append(time.perf_counter() - began)
+    return samples
+
+
+BENCHMARKS = {
+    "search_fanout": bench_search_fanout,
+    "chapter_fetch": bench_chapter_fetch,
+    "toc_parse": bench_toc_parse,
+    "rule_eval": bench_rule_eval,
+    "purify": bench_purify,
+    "cache": bench_cache,
+    "replay_load": bench_replay_load,
+}
+
+
+async def run_benchmarks(args) -> Dict[str, Any]:
+    pages = load_recorded_pages(args.fixtures) if args.fixtures else {}
+    pages = {**build_default_pages(chapters=args.toc_chapters), **pages}
+    names = args.only or [name for name in BENCHMARKS if name != "replay_load" or args.cassette]
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "commit": _git_commit(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        },
+        "results": {},
+    }
+    async with FixtureServer(pages, args.latency, args.jitter, hosts=args.sources) as server:
+        for name in names:
+            func = BENCHMARKS[name]
+            print(f"运行 {name} ...", file=sys.stderr)
+            gc.collect()
+            rss_before = rss_mb()
+            result = func(server, args)
+            if asyncio.iscoroutine(result):
+                result = await result
+            result["rss_mb"] = rss_mb()
+            result["rss_growth_mb"] = result["rss_mb"] - rss_before
+            report["results"][name] = result
+    report["meta"]["peak_rss_mb"] = max(result["rss_mb"] for result in report["results"].values())
+    return report
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).parent, timeout=5
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def _flatten(data: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """与基线比较：*_per_sec 越大越好，延迟（_ms/_us）越小越好，其他指标不比较"""
+    current = _flatten(report["results"])
+    previous = _flatten(baseline.get("results", {}))
+    regressions = []
+    for metric, old in previous.items():
+        new = current.get(metric)
+        if new is None or not old:
+            continue
+        if metric.endswith("_per_sec"):
+            change = (old - new) / old
+        elif metric.endswith(("_ms", "_us")):
+            change = (new - old) / old
+        else:
+            continue
+        if change > threshold:
+            regressions.append({"metric": metric, "baseline": old, "current": new, "regression": change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="书源系统离线性能基准")
+    parser.add_argument("--output", help="结果JSON文件（默认输出到标准输出）")
+    parser.add_argument("--baseline", help="基线结果JSON文件，用于检测性能回退")
+    parser.add_argument("--threshold", type=float, default=0.2, help="允许的性能下降比例 (默认: 0.2)")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="只运行指定的基准")
+    parser.add_argument("--fixtures", help="录制页面目录，覆盖同路径的内置页面")
+    parser.add_argument("--sources", type=int, default=20, help="搜索扇出的书源数量 (默认: 20)")
+    parser.add_argument("--iterations", type=int, default=20, help="网络类基准的轮数 (默认: 20)")
+    parser.add_argument("--duration", type=float, default=1.0, help="每种规则的计时秒数 (默认: 1.0)")
+    parser.add_argument("--latency", type=float, default=0.02, help="夹具服务器响应延迟秒数 (默认: 0.02)")
+    parser.add_argument("--jitter", type=float, default=0.01, help="延迟抖动秒数 (默认: 0.01)")
+    parser.add_argument("--cassette", help="录制的上游流量归档，用于 replay_load")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="回放时间倍率 (默认: 1.0)")
+    parser.add_argument("--toc-chapters", type=int, default=3000, help="目录页章节数 (默认: 3000)")
+    parser.add_argument("--cache-entries", type=int, default=2000, help="缓存基准的条目数 (默认: 2000)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmarks(args))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"结果已写入: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if report.get("regressions"):
+        for item in report["regressions"]:
+            print(f"性能回退: {item['metric']} {item['baseline']:.4g} -> {item['current']:.4g} "
+                  f"({item['regression']:.0%})", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
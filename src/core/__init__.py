@@ -6,16 +6,76 @@
 - NetworkManager: 网络请求管理器
 - RuleEngine: 规则引擎
 - CacheManager: 缓存管理器
+- Bookshelf: 书架更新检查
+- BookDownloader: 整书下载器
+- ReadAheadPrefetcher: 章节预读器
+- RequestScheduler: 优先级请求调度器
+- CircuitBreakerRegistry: 按主机熔断
+- MirrorRegistry: 镜像站点与对冲请求
+- RetryBudget: 重试预算
+- HttpCache: HTTP条件请求缓存
+- CookieStore: 书源Cookie持久化
+- ProxyPool: 代理池
+- MetricsRegistry: 指标注册表（Prometheus 文本格式）
+- tracing: 链路追踪（默认关闭）
+- Cassette: 上游流量录制回放
+- Profiler: 单次运行的性能剖析（cProfile / 采样）
+- RuleCostTracker: 按书源和规则字段的解析耗时统计
+- RegexGuard: 正则规则的编译缓存、ReDoS 检查与超时停用
+- ContentPurifier: 按 replaceRegex 合并规则、单次扫描净化正文
 """
 
 from .engine import BookSourceEngine
 from .network import NetworkManager
 from .rules import RuleEngine
 from .cache import CacheManager
+from .bookshelf import Bookshelf
+from .downloader import BookDownloader
+from .prefetch import ReadAheadPrefetcher
+from .scheduler import RequestScheduler, Priority, request_priority
+from .breaker import CircuitBreakerRegistry, CircuitOpenError
+from .mirrors import MirrorRegistry
+from .retry import RetryBudget
+from .httpcache import HttpCache
+from .cookies import CookieStore
+from .proxy import ProxyPool
+from .metrics import MetricsRegistry, REGISTRY
+from . import tracing
+from .cassette import Cassette, CassetteMissError, replay_load
+from .profiling import Profiler
+from .rulecost import RuleCostTracker, RULE_COSTS
+from .regexguard import RegexGuard, REGEX_GUARD, check_pattern
+from .purifier import ContentPurifier
 
 __all__ = [
     "BookSourceEngine",
     "NetworkManager",
     "RuleEngine", 
-    "CacheManager"
+    "CacheManager",
+    "Bookshelf",
+    "BookDownloader",
+    "ReadAheadPrefetcher",
+    "RequestScheduler",
+    "Priority",
+    "request_priority",
+    "CircuitBreakerRegistry",
+    "CircuitOpenError",
+    "MirrorRegistry",
+    "RetryBudget",
+    "HttpCache",
+    "CookieStore",
+    "ProxyPool",
+    "MetricsRegistry",
+    "REGISTRY",
+    "tracing",
+    "Cassette",
+    "CassetteMissError",
+    "replay_load",
+    "Profiler",
+    "RuleCostTracker",
+    "RULE_COSTS",
+    "RegexGuard",
+    "REGEX_GUARD",
+    "check_pattern",
+    "ContentPurifier"
 ]
@@ -0,0 +1,342 @@
+"""
+书架更新检查 - Bookshelf Update Checker
+
+负责管理追更书籍并批量检查更新：
+- 追更书籍存储（SQLite）
+- 分批、限速、按优先级的更新扫描
+- 条件请求（ETag / Last-Modified）跳过未变化的书籍
+- 最新章节（lastChapter）比对
+- 吞吐量与各书源滞后统计
+"""
+
+import time
+import asyncio
+import logging
+import sqlite3
+from typing import Dict, List, Optional, Any
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+from .scheduler import Priority, request_priority
+
+
+@dataclass
+class TrackedBook:
+    """追更书籍"""
+    source: str
+    book_url: str
+    name: str = ""
+    author: str = ""
+    last_chapter: str = ""
+    toc_url: str = ""
+    priority: int = 0
+    etag: str = ""
+    last_modified: str = ""
+    last_check: float = 0
+    last_update: float = 0
+    check_count: int = 0
+    error_count: int = 0
+
+
+@dataclass
+class SweepReport:
+    """更新扫描报告"""
+    total: int = 0
+    checked: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    not_modified: int = 0
+    failed: int = 0
+    skipped: int = 0
+    elapsed: float = 0
+    throughput: float = 0
+    source_lag: Dict[str, Optional[float]] = field(default_factory=dict)
+    updated_books: List[TrackedBook] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return asdict(self)
+
+
+class _SourceLimiter:
+    """单书源限速器：并发上限 + 最小请求间隔"""
+
+    def __init__(self, concurrency: int, interval: float):
+        self.semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self.interval = interval
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        if self.interval > 0:
+            async with self.lock:
+                now = time.monotonic()
+                wait = self.next_time - now
+                self.next_time = max(now, self.next_time) + self.interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.semaphore.release()
+
+
+class Bookshelf:
+    """书架管理器"""
+
+    COLUMNS = [
+        "source", "book_url", "name", "author", "last_chapter", "toc_url",
+        "priority", "etag", "last_modified", "last_check", "last_update",
+        "check_count", "error_count"
+    ]
+
+    def __init__(self, engine, config: Dict[str, Any] = None):
+        self.engine = engine
+        self.config = config or {}
+        self.db_path = self.config.get("db_path", "data/bookshelf.db")
+        self.batch_size = self.config.get("batch_size", 50)
+        self.concurrent_requests = self.config.get("concurrent_requests", 10)
+        self.per_source_concurrency = self.config.get("per_source_concurrency", 2)
+        self.request_delay = self.config.get("request_delay", 0.5)
+        self.check_interval = self.config.get("check_interval", 0)
+
+        self.logger = logging.getLogger("bookshelf")
+
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._init_db()
+
+    def _init_db(self):
+        """初始化数据库"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS books (
+                    source TEXT,
+                    book_url TEXT,
+                    name TEXT DEFAULT '',
+                    author TEXT DEFAULT '',
+                    last_chapter TEXT DEFAULT '',
+                    toc_url TEXT DEFAULT '',
+                    priority INTEGER DEFAULT 0,
+                    etag TEXT DEFAULT '',
+                    last_modified TEXT DEFAULT '',
+                    last_check REAL DEFAULT 0,
+                    last_update REAL DEFAULT 0,
+                    check_count INTEGER DEFAULT 0,
+                    error_count INTEGER DEFAULT 0,
+                    PRIMARY KEY (source, book_url)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_books_check ON books(priority, last_check)")
+            conn.commit()
+
+    def add_book(self, source: str, book_url: str, name: str = "", author: str = "",
+                 last_chapter: str = "", toc_url: str = "", priority: int = 0) -> TrackedBook:
+        """添加追更书籍"""
+        book = TrackedBook(
+            source=source,
+            book_url=book_url,
+            name=name,
+            author=author,
+            last_chapter=last_chapter,
+            toc_url=toc_url,
+            priority=priority
+        )
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO books ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in self.COLUMNS)})",
+                self._to_row(book)
+            )
+            conn.commit()
+        self.logger.info(f"添加追更书籍: {source} {book_url}")
+        return book
+
+    def remove_book(self, source: str, book_url: str) -> bool:
+        """移除追更书籍"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.execute(
+                "DELETE FROM books WHERE source = ? AND book_url = ?",
+                (source, book_url)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def get_book(self, source: str, book_url: str) -> Optional[TrackedBook]:
+        """获取追更书籍"""
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM books WHERE source = ? AND book_url = ?",
+                (source, book_url)
+            ).fetchone()
+        return TrackedBook(*row) if row else None
+
+    def list_books(self, source: str = None) -> List[TrackedBook]:
+        """列出追更书籍"""
+        sql = f"SELECT {', '.join(self.COLUMNS)} FROM books"
+        params = ()
+        if source:
+            sql += " WHERE source = ?"
+            params = (source,)
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [TrackedBook(*row) for row in rows]
+
+    def count(self) -> int:
+        """追更书籍数量"""
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+    def _to_row(self, book: TrackedBook) -> tuple:
+        """书籍转换为数据库行"""
+        return tuple(getattr(book, column) for column in self.COLUMNS)
+
+    def _save_batch(self, books: List[TrackedBook]):
+        """批量保存检查结果"""
+        if not books:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO books ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in self.COLUMNS)})",
+                [self._to_row(book) for book in books]
+            )
+            conn.commit()
+
+    def _schedule(self, books: List[TrackedBook], now: float) -> List[TrackedBook]:
+        """按优先级排序：优先级高的在前，同优先级下最久未检查的在前"""
+        if self.check_interval > 0:
+            books = [book for book in books if now - book.last_check >= self.check_interval]
+        return sorted(books, key=lambda book: (-book.priority, book.last_check))
+
+    async def _probe(self, source, book: TrackedBook) -> bool:
+        """条件请求探测，返回True表示书籍页面未变化
+
+        用 HEAD 请求只取响应头，页面有变化时由 get_book_info 抓取一次正文，不重复下载。
+        """
+        # 首次检查时探测一次以获取校验值，站点不支持时不再探测
+        if not (book.etag or book.last_modified or book.check_count == 0):
+            return False
+
+        headers = {}
+        if book.etag:
+            headers["If-None-Match"] = book.etag
+        if book.last_modified:
+            headers["If-Modified-Since"] = book.last_modified
+
+        response = await source.network.head(book.book_url, headers=headers)
+        try:
+            if response.status == 304:
+                return True
+            if response.status >= 400:
+                # 站点不支持 HEAD，清空校验值，之后不再探测
+                book.etag = book.last_modified = ""
+                return False
+            book.etag = response.headers.get("ETag", "")
+            book.last_modified = response.headers.get("Last-Modified", "")
+            return False
+        finally:
+            response.close()
+
+    async def check_book(self, book: TrackedBook) -> str:
+        """检查单本书籍更新，返回 updated / unchanged / not_modified / failed / skipped"""
+        source = self.engine.get_source(book.source)
+        if source is None or not source.enabled:
+            return "skipped"
+
+        try:
+            try:
+                not_modified = await self._probe(source, book)
+            except Exception as e:
+                not_modified = False
+                self.logger.debug(f"条件请求探测失败: {book.book_url}, {e}")
+
+            book.check_count += 1
+            if not_modified:
+                book.last_check = time.time()
+                return "not_modified"
+
+            info = await source.get_book_info(book.book_url)
+            book.last_check = time.time()
+            if not info.last_chapter:
+                book.error_count += 1
+                return "failed"
+
+            if info.toc_url:
+                book.toc_url = info.toc_url
+            if not book.name:
+                book.name = info.name
+            if not book.author:
+                book.author = info.author
+
+            if info.last_chapter != book.last_chapter:
+                book.last_chapter = info.last_chapter
+                book.last_update = book.last_check
+                return "updated"
+            return "unchanged"
+
+        except Exception as e:
+            book.last_check = time.time()
+            book.error_count += 1
+            self.logger.error(f"检查更新失败: {book.source} {book.book_url}, {e}")
+            return "failed"
+
+    async def sweep(self, sources: List[str] = None) -> SweepReport:
+        """执行一次更新扫描"""
+        start = time.monotonic()
+        now = time.time()
+
+        books = self.list_books()
+        if sources:
+            books = [book for book in books if book.source in sources]
+        queue = self._schedule(books, now)
+
+        report = SweepReport(total=len(books), skipped=len(books) - len(queue))
+        global_limit = asyncio.Semaphore(max(self.concurrent_requests, 1))
+        limiters: Dict[str, _SourceLimiter] = {}
+
+        async def run(book: TrackedBook) -> str:
+            limiter = limiters.setdefault(
+                book.source,
+                _SourceLimiter(self.per_source_concurrency, self.request_delay)
+            )
+            # 先过书源限速（可能要等请求间隔），再占用全局并发，等待中的任务不占全局名额
+            async with limiter:
+                async with global_limit:
+                    with request_priority(Priority.BULK):
+                        return await self.check_book(book)
+
+        for offset in range(0, len(queue), self.batch_size):
+            batch = queue[offset:offset + self.batch_size]
+            results = await asyncio.gather(*(run(book) for book in batch))
+
+            for book, status in zip(batch, results):
+                if status == "skipped":
+                    report.skipped += 1
+                    continue
+                report.checked += 1
+                setattr(report, status, getattr(report, status) + 1)
+                if status == "updated":
+                    report.updated_books.append(book)
+
+            self._save_batch([book for book, status in zip(batch, results) if status != "skipped"])
+
+        report.elapsed = time.monotonic() - start
+        report.throughput = report.checked / report.elapsed if report.elapsed > 0 else 0
+        report.source_lag = self.get_source_lag()
+
+        self.logger.info(
+            f"更新扫描完成: 检查 {report.checked} 本, 更新 {report.updated} 本, "
+            f"失败 {report.failed} 本, 吞吐 {report.throughput:.1f} 本/秒"
+        )
+        return report
+
+    def get_source_lag(self) -> Dict[str, Optional[float]]:
+        """各书源滞后时间（秒）：书源下最久未检查书籍距今的时间，有书籍从未检查过时为None"""
+        now = time.time()
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute("SELECT source, MIN(last_check) FROM books GROUP BY source").fetchall()
+        return {
+            source: (now - last_check) if last_check else None
+            for source, last_check in rows
+        }
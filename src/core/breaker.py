@@ -0,0 +1,218 @@
+"""
+熔断器 - Circuit Breaker
+
+按主机统计请求结果，站点不可用时快速失败：
+- 关闭（closed）：正常放行，滚动窗口内统计错误率
+- 打开（open）：错误率超过阈值后直接拒绝请求，冷却时间按次数翻倍
+- 半开（half-open）：冷却结束后放行一个探测请求，成功则关闭，失败则重新打开
+"""
+
+import time
+import logging
+from enum import Enum
+from collections import deque
+from typing import Dict, List, Any
+
+
+class CircuitState(str, Enum):
+    """熔断器状态"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求被拒绝"""
+
+    def __init__(self, host: str, retry_after: float):
+        self.host = host
+        self.retry_after = retry_after
+        super().__init__(f"主机已熔断: {host}，{retry_after:.0f} 秒后重试")
+
+
+class CircuitBreaker:
+    """单主机熔断器"""
+
+    def __init__(self, host: str, window: float = 60, min_requests: int = 5,
+                 error_threshold: float = 0.5, open_timeout: float = 30,
+                 max_open_timeout: float = 600):
+        self.host = host
+        self.window = window
+        self.min_requests = min_requests
+        self.error_threshold = error_threshold
+        self.open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+
+        self.state = CircuitState.CLOSED
+        self.results = deque()  # (时间, 是否成功)
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_count = 0
+        self.probing = False
+        self.probe_started = 0.0
+
+    def _trim(self, now: float):
+        """移除滚动窗口外的记录"""
+        while self.results and self.results[0][0] < now - self.window:
+            _, ok = self.results.popleft()
+            if not ok:
+                self.failures -= 1
+
+    @property
+    def cooldown(self) -> float:
+        """当前冷却时间，连续打开时翻倍"""
+        return min(self.open_timeout * (2 ** max(self.open_count - 1, 0)), self.max_open_timeout)
+
+    def retry_after(self, now: float = None) -> float:
+        """距离允许探测还有多少秒"""
+        now = time.monotonic() if now is None else now
+        return max(self.opened_at + self.cooldown - now, 0.0)
+
+    def is_open(self, now: float = None) -> bool:
+        """是否处于打开且仍在冷却中"""
+        return self.state == CircuitState.OPEN and self.retry_after(now) > 0
+
+    def allow_request(self) -> bool:
+        """是否放行请求"""
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state = CircuitState.HALF_OPEN
+            self.probing = False
+        # 半开状态只放行一个探测请求，探测请求迟迟没有结果时允许重新探测
+        now = time.monotonic()
+        if self.probing and now - self.probe_started < self.cooldown:
+            return False
+        self.probing = True
+        self.probe_started = now
+        return True
+
+    def record_success(self):
+        """记录成功"""
+        if self.state == CircuitState.HALF_OPEN:
+            self.state = CircuitState.CLOSED
+            self.open_count = 0
+            self.probing = False
+            self.results.clear()
+            self.failures = 0
+            return
+        if self.state == CircuitState.OPEN:
+            return  # 打开前发出的请求，结果不再计入
+        now = time.monotonic()
+        self.results.append((now, True))
+        self._trim(now)
+
+    def record_failure(self):
+        """记录失败"""
+        if self.state == CircuitState.OPEN:
+            # 打开前已发出的请求陆续失败，不能重新填满窗口、再次打开并翻倍冷却时间
+            return
+        now = time.monotonic()
+        if self.state == CircuitState.HALF_OPEN:
+            self._open(now)
+            return
+        self.results.append((now, False))
+        self.failures += 1
+        self._trim(now)
+
+        total = len(self.results)
+        if total >= self.min_requests and self.failures / total >= self.error_threshold:
+            self._open(now)
+
+    def _open(self, now: float):
+        """打开熔断器"""
+        self.state = CircuitState.OPEN
+        self.opened_at = now
+        self.open_count += 1
+        self.probing = False
+        self.results.clear()
+        self.failures = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取熔断器状态"""
+        total = len(self.results)
+        return {
+            "state": self.state.value,
+            "requests": total,
+            "error_rate": self.failures / total if total else 0.0,
+            "retry_after": self.retry_after() if self.state == CircuitState.OPEN else 0.0,
+            "open_count": self.open_count,
+        }
+
+
+class CircuitBreakerRegistry:
+    """按主机管理熔断器"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.enabled = self.config.get("enabled", True)
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.logger = logging.getLogger("breaker")
+
+    def get(self, host: str) -> CircuitBreaker:
+        """获取主机的熔断器"""
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                host,
+                window=self.config.get("window", 60),
+                min_requests=self.config.get("min_requests", 5),
+                error_threshold=self.config.get("error_threshold", 0.5),
+                open_timeout=self.config.get("open_timeout", 30),
+                max_open_timeout=self.config.get("max_open_timeout", 600),
+            )
+            self.breakers[host] = breaker
+        return breaker
+
+    def before_request(self, host: str):
+        """请求前检查，熔断时抛出 CircuitOpenError"""
+        if not self.enabled:
+            return
+        breaker = self.get(host)
+        if not breaker.allow_request():
+            raise CircuitOpenError(host, breaker.retry_after())
+
+    def record_success(self, host: str):
+        """记录请求成功"""
+        if self.enabled:
+            breaker = self.get(host)
+            if breaker.state == CircuitState.HALF_OPEN:
+                self.logger.info(f"探测成功，恢复主机: {host}")
+            breaker.record_success()
+
+    def record_failure(self, host: str):
+        """记录请求失败"""
+        if self.enabled:
+            breaker = self.get(host)
+            opened = breaker.open_count
+            breaker.record_failure()
+            if breaker.open_count > opened:
+                self.logger.warning(f"主机熔断: {host}，冷却 {breaker.cooldown:.0f} 秒")
+
+    def trip(self, host: str):
+        """直接打开主机的熔断器（如预热时发现域名无法解析）"""
+        if self.enabled:
+            breaker = self.get(host)
+            if not breaker.is_open():
+                breaker._open(time.monotonic())
+                self.logger.warning(f"主机熔断: {host}，冷却 {breaker.cooldown:.0f} 秒")
+
+    def is_open(self, host: str) -> bool:
+        """主机是否处于熔断冷却中"""
+        if not self.enabled or host not in self.breakers:
+            return False
+        return self.breakers[host].is_open()
+
+    def open_hosts(self) -> List[str]:
+        """所有处于熔断冷却中的主机"""
+        return [host for host, breaker in self.breakers.items() if breaker.is_open()]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取熔断统计"""
+        return {
+            host: breaker.get_stats()
+            for host, breaker in self.breakers.items()
+            if breaker.state != CircuitState.CLOSED or breaker.failures
+        }
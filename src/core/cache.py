@@ -6,19 +6,24 @@
 - 文件缓存
 - 数据库缓存
 - 缓存过期管理
+- 多进程共享：各进程共用数据库和文件缓存，内存缓存通过失效日志跨进程失效
 """
 
 import os
 import json
 import time
+import uuid
 import hashlib
 import logging
 import sqlite3
 import threading
-from typing import Dict, Any, Optional, Union
+from typing import Dict, Any, Optional, Tuple, Union
 from dataclasses import dataclass
 from pathlib import Path
 
+from . import tracing
+from .metrics import CACHE_LOOKUPS
+
 
 @dataclass
 class CacheItem:
@@ -53,9 +58,20 @@ class CacheManager:
         # 数据库缓存
         self.db_cache_enabled = self.config.get("db_cache", True)
         self.db_path = os.path.join(self.cache_dir, "cache.db")
+        self.busy_timeout = self.config.get("busy_timeout", 10)
         if self.db_cache_enabled:
             self._init_db()
         
+        # 多进程共享（多 worker 服务模式）
+        self.shared = False
+        self.origin = ""
+        self.sync_interval = self.config.get("sync_interval", 1.0)
+        self.last_sync = 0.0
+        self.last_seq = 0
+        
+        # 各层级命中统计
+        self.tier_stats = {tier: {"hits": 0, "misses": 0} for tier in ("memory", "db", "file")}
+        
         # 清理任务
         self.cleanup_interval = self.config.get("cleanup_interval", 300)  # 5分钟
         self._start_cleanup_task()
@@ -66,7 +82,7 @@ class CacheManager:
     def _init_db(self):
         """初始化数据库"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 conn.execute("""
                     CREATE TABLE IF NOT EXISTS cache (
                         key TEXT PRIMARY KEY,
@@ -83,6 +99,78 @@ class CacheManager:
             self.logger.error(f"数据库初始化失败: {e}")
             self.db_cache_enabled = False
     
+    def _connect(self) -> sqlite3.Connection:
+        """打开缓存数据库，其他进程写入时等待锁而不是立即报错"""
+        return sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+    
+    def enable_shared(self):
+        """启用多进程共享模式
+        
+        数据库切换为 WAL 以便多个进程并发读写；每次写入和删除记录一条失效日志，
+        其他进程读取时（最多每 sync_interval 秒一次）据此淘汰自己内存中的旧值。
+        需要在 fork 之后、在各 worker 进程中调用。
+        """
+        if not self.db_cache_enabled:
+            self.logger.warning("未启用数据库缓存，无法跨进程共享内存缓存失效")
+            return
+        try:
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS invalidations (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        key TEXT,
+                        origin TEXT,
+                        time REAL
+                    )
+                """)
+                self.last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM invalidations").fetchone()[0]
+        except Exception as e:
+            self.logger.error(f"共享缓存初始化失败: {e}")
+            return
+        self.shared = True
+        self.origin = uuid.uuid4().hex
+        self.last_sync = time.monotonic()
+    
+    def _publish_invalidation(self, conn: sqlite3.Connection, cache_key: str):
+        """记录失效日志，"*" 表示全部失效"""
+        if self.shared:
+            conn.execute(
+                "INSERT INTO invalidations (key, origin, time) VALUES (?, ?, ?)",
+                (cache_key, self.origin, time.time())
+            )
+    
+    def _sync_invalidations(self):
+        """按其他进程的失效日志淘汰内存缓存"""
+        now = time.monotonic()
+        if not self.shared or now - self.last_sync < self.sync_interval:
+            return
+        self.last_sync = now
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT seq, key, origin FROM invalidations WHERE seq > ? ORDER BY seq",
+                    (self.last_seq,)
+                ).fetchall()
+        except Exception as e:
+            self.logger.error(f"读取缓存失效日志失败: {e}")
+            return
+        with self.cache_lock:
+            for seq, cache_key, origin in rows:
+                self.last_seq = seq
+                if origin == self.origin:
+                    continue
+                if cache_key == "*":
+                    self.memory_cache.clear()
+                else:
+                    self.memory_cache.pop(cache_key, None)
+    
+    def _record_lookup(self, tier: str, hit: bool):
+        """记录各层级的命中情况"""
+        stats = self.tier_stats[tier]
+        stats["hits" if hit else "misses"] += 1
+        CACHE_LOOKUPS.inc(tier=tier, result="hit" if hit else "miss")
+    
     def _start_cleanup_task(self):
         """启动清理任务"""
         def cleanup_worker():
@@ -103,80 +191,100 @@ class CacheManager:
         return str(key)
     
     def get(self, key: str, default: Any = None) -> Any:
-        """获取缓存"""
+        """获取缓存（依次查内存、数据库、文件）"""
         if not self.enabled:
             return default
         
+        self._sync_invalidations()
         cache_key = self._generate_key(key)
         current_time = time.time()
         
-        # 先从内存缓存获取
+        tiers = (
+            ("memory", True, self._get_memory),
+            ("db", self.db_cache_enabled, self._get_db),
+            ("file", self.file_cache_enabled, self._get_file),
+        )
+        for tier, enabled, lookup in tiers:
+            if not enabled:
+                continue
+            with tracing.span(f"cache.{tier}", key=key[:100]) as tier_span:
+                found, value = lookup(cache_key, current_time)
+                tier_span.set_attribute("hit", found)
+            self._record_lookup(tier, found)
+            if found:
+                return value
+        
+        return default
+    
+    def _get_memory(self, cache_key: str, current_time: float) -> Tuple[bool, Any]:
+        """从内存缓存获取"""
         with self.cache_lock:
             if cache_key in self.memory_cache:
                 item = self.memory_cache[cache_key]
                 if item.expire_time > current_time:
                     item.access_count += 1
                     item.last_access = current_time
-                    return item.value
+                    return True, item.value
                 else:
                     # 过期，删除
                     del self.memory_cache[cache_key]
-        
-        # 从数据库缓存获取
-        if self.db_cache_enabled:
+        return False, None
+    
+    def _get_db(self, cache_key: str, current_time: float) -> Tuple[bool, Any]:
+        """从数据库缓存获取"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.execute(
+                    "SELECT value, expire_time, access_count FROM cache WHERE key = ?",
+                    (cache_key,)
+                )
+                row = cursor.fetchone()
+                
+                if row:
+                    value_str, expire_time, access_count = row
+                    if expire_time > current_time:
+                        # 更新访问统计
+                        conn.execute(
+                            "UPDATE cache SET access_count = ?, last_access = ? WHERE key = ?",
+                            (access_count + 1, current_time, cache_key)
+                        )
+                        conn.commit()
+                        
+                        # 反序列化值
+                        try:
+                            value = json.loads(value_str)
+                            # 加入内存缓存
+                            self._set_memory_cache(cache_key, value, expire_time)
+                            return True, value
+                        except json.JSONDecodeError:
+                            return True, value_str
+                    else:
+                        # 过期，删除
+                        conn.execute("DELETE FROM cache WHERE key = ?", (cache_key,))
+                        conn.commit()
+        except Exception as e:
+            self.logger.error(f"数据库缓存读取失败: {e}")
+        return False, None
+    
+    def _get_file(self, cache_key: str, current_time: float) -> Tuple[bool, Any]:
+        """从文件缓存获取"""
+        file_path = os.path.join(self.cache_dir, f"{cache_key}.json")
+        if os.path.exists(file_path):
             try:
-                with sqlite3.connect(self.db_path) as conn:
-                    cursor = conn.execute(
-                        "SELECT value, expire_time, access_count FROM cache WHERE key = ?",
-                        (cache_key,)
-                    )
-                    row = cursor.fetchone()
-                    
-                    if row:
-                        value_str, expire_time, access_count = row
-                        if expire_time > current_time:
-                            # 更新访问统计
-                            conn.execute(
-                                "UPDATE cache SET access_count = ?, last_access = ? WHERE key = ?",
-                                (access_count + 1, current_time, cache_key)
-                            )
-                            conn.commit()
-                            
-                            # 反序列化值
-                            try:
-                                value = json.loads(value_str)
-                                # 加入内存缓存
-                                self._set_memory_cache(cache_key, value, expire_time)
-                                return value
-                            except json.JSONDecodeError:
-                                return value_str
-                        else:
-                            # 过期，删除
-                            conn.execute("DELETE FROM cache WHERE key = ?", (cache_key,))
-                            conn.commit()
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    cache_data = json.load(f)
+                
+                if cache_data.get("expire_time", 0) > current_time:
+                    value = cache_data.get("value")
+                    # 加入内存缓存
+                    self._set_memory_cache(cache_key, value, cache_data["expire_time"])
+                    return True, value
+                else:
+                    # 过期，删除文件
+                    os.remove(file_path)
             except Exception as e:
-                self.logger.error(f"数据库缓存读取失败: {e}")
-        
-        # 从文件缓存获取
-        if self.file_cache_enabled:
-            file_path = os.path.join(self.cache_dir, f"{cache_key}.json")
-            if os.path.exists(file_path):
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        cache_data = json.load(f)
-                    
-                    if cache_data.get("expire_time", 0) > current_time:
-                        value = cache_data.get("value")
-                        # 加入内存缓存
-                        self._set_memory_cache(cache_key, value, cache_data["expire_time"])
-                        return value
-                    else:
-                        # 过期，删除文件
-                        os.remove(file_path)
-                except Exception as e:
-                    self.logger.error(f"文件缓存读取失败: {e}")
-        
-        return default
+                self.logger.error(f"文件缓存读取失败: {e}")
+        return False, None
     
     def set(self, key: str, value: Any, expire_time: Optional[float] = None) -> bool:
         """设置缓存"""
@@ -200,11 +308,12 @@ class CacheManager:
         if self.db_cache_enabled:
             try:
                 value_str = json.dumps(value, ensure_ascii=False) if not isinstance(value, str) else value
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connect() as conn:
                     conn.execute(
                         "INSERT OR REPLACE INTO cache (key, value, expire_time, create_time, access_count, last_access) VALUES (?, ?, ?, ?, ?, ?)",
                         (cache_key, value_str, expire_time, current_time, 0, current_time)
                     )
+                    self._publish_invalidation(conn, cache_key)
                     conn.commit()
             except Exception as e:
                 self.logger.error(f"数据库缓存写入失败: {e}")
@@ -219,8 +328,11 @@ class CacheManager:
                     "expire_time": expire_time,
                     "create_time": current_time
                 }
-                with open(file_path, 'w', encoding='utf-8') as f:
+                # 先写临时文件再原子替换，其他进程不会读到写了一半的文件
+                temp_path = f"{file_path}.{os.getpid()}.tmp"
+                with open(temp_path, 'w', encoding='utf-8') as f:
                     json.dump(cache_data, f, ensure_ascii=False, indent=2)
+                os.replace(temp_path, file_path)
             except Exception as e:
                 self.logger.error(f"文件缓存写入失败: {e}")
         
@@ -267,8 +379,9 @@ class CacheManager:
         # 删除数据库缓存
         if self.db_cache_enabled:
             try:
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connect() as conn:
                     conn.execute("DELETE FROM cache WHERE key = ?", (cache_key,))
+                    self._publish_invalidation(conn, cache_key)
                     conn.commit()
             except Exception as e:
                 self.logger.error(f"数据库缓存删除失败: {e}")
@@ -300,8 +413,14 @@ class CacheManager:
         # 清理数据库缓存
         if self.db_cache_enabled:
             try:
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connect() as conn:
                     conn.execute("DELETE FROM cache WHERE expire_time <= ?", (current_time,))
+                    if self.shared:
+                        # 失效日志只需保留到所有进程都同步过
+                        conn.execute(
+                            "DELETE FROM invalidations WHERE time <= ?",
+                            (current_time - max(60, 10 * self.sync_interval),)
+                        )
                     conn.commit()
             except Exception as e:
                 self.logger.error(f"数据库缓存清理失败: {e}")
@@ -335,8 +454,9 @@ class CacheManager:
         # 清空数据库缓存
         if self.db_cache_enabled:
             try:
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connect() as conn:
                     conn.execute("DELETE FROM cache")
+                    self._publish_invalidation(conn, "*")
                     conn.commit()
             except Exception as e:
                 self.logger.error(f"数据库缓存清空失败: {e}")
@@ -359,7 +479,7 @@ class CacheManager:
         db_count = 0
         if self.db_cache_enabled:
             try:
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connect() as conn:
                     cursor = conn.execute("SELECT COUNT(*) FROM cache")
                     db_count = cursor.fetchone()[0]
             except Exception:
@@ -378,5 +498,10 @@ class CacheManager:
             "db_cache_count": db_count,
             "file_cache_count": file_count,
             "max_size": self.max_size,
-            "expire_time": self.expire_time
+            "expire_time": self.expire_time,
+            "shared": self.shared,
+            "hit_ratio": {
+                tier: stats["hits"] / max(stats["hits"] + stats["misses"], 1)
+                for tier, stats in self.tier_stats.items()
+            }
         }
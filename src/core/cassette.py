@@ -0,0 +1,314 @@
+"""
+录制回放 - HTTP Cassette
+
+把上游请求与响应录制到本地归档，之后不访问真实站点即可回放：
+- 录制模式：网络层每次实际发出的请求（含重试、对冲）连同响应、耗时和相对时间写入归档
+- 回放模式：按 方法 + 地址 + 请求体 匹配录制的响应，按原始耗时或缩放后的耗时返回
+- 归档为 gzip 压缩的 JSON Lines，相同的响应体只保存一份
+- replay_load 按录制时的到达时间重放整段流量，统计延迟分位数和每个请求的CPU时间
+"""
+
+import json
+import gzip
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+from urllib.parse import urlencode
+from typing import Any, Dict, List, Optional, Tuple
+
+from .response import HttpResponse
+
+
+# 录制的异常类型，回放时重新抛出
+ERROR_TIMEOUT = "timeout"
+ERROR_CLIENT = "client"
+
+
+class CassetteMissError(Exception):
+    """回放时找不到匹配的录制"""
+
+    def __init__(self, method: str, url: str):
+        self.method = method
+        self.url = url
+        super().__init__(f"回放归档中没有该请求: {method} {url}")
+
+
+def request_url(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """合并查询参数后的地址"""
+    if not params:
+        return url
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}{urlencode(sorted(params.items()))}"
+
+
+def request_body(kwargs: Dict[str, Any]) -> bytes:
+    """请求体字节（表单和JSON按编码后的内容）"""
+    data = kwargs.get("data")
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    if isinstance(data, dict):
+        return urlencode(data).encode("utf-8")
+    if kwargs.get("json") is not None:
+        return json.dumps(kwargs["json"]).encode("utf-8")
+    return b""
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+@dataclass
+class Interaction:
+    """一次录制的请求与响应"""
+    method: str
+    url: str
+    request_body: str       # 请求体摘要（空请求体为空字符串）
+    offset: float           # 相对录制开始的发出时间（秒）
+    duration: float         # 耗时（秒）
+    attempt: int = 0        # 第几次尝试（重试从1开始）
+    hedge: bool = False     # 对冲或切换镜像时发出的请求
+    status: int = 0
+    headers: Tuple[Tuple[str, str], ...] = ()
+    body: str = ""          # 响应体摘要
+    error: str = ""         # timeout / client，非空时表示请求失败
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return self.method, self.url, self.request_body
+
+
+class Cassette:
+    """录制回放归档"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.mode = self.config.get("mode", "off")  # off / record / replay
+        self.path = self.config.get("path", "data/cassettes/traffic.cassette")
+        self.time_scale = self.config.get("time_scale", 1.0)  # 回放耗时倍率，0 表示不等待
+        self.on_miss = self.config.get("on_miss", "error")  # error / network
+        self.flush_size = self.config.get("flush_size", 100)
+
+        self.interactions: List[Interaction] = []
+        self.bodies: Dict[str, bytes] = {}
+        self.lock = threading.Lock()
+
+        # 录制状态
+        self.started: Optional[float] = None
+        self.pending: List[Dict[str, Any]] = []
+        self.written_bodies = set()
+        self.truncated = False
+
+        # 回放状态
+        self.loaded = False
+        self.by_key: Dict[Tuple[str, str, str], List[Interaction]] = {}
+        self.cursors: Dict[Tuple[str, str, str], int] = {}
+
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+        self.logger = logging.getLogger("cassette")
+        if self.mode not in ("off", "record", "replay"):
+            raise ValueError(f"未知的录制回放模式: {self.mode}")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    # ---- 录制 ----
+
+    def record(self, method: str, url: str, kwargs: Dict[str, Any], started: float,
+               response: Optional[HttpResponse] = None, error: str = "", attempt: int = 0,
+               hedge: bool = False):
+        """录制一次尝试，started 为发出时的 time.monotonic()，hedge 表示向镜像对冲的请求"""
+        now = time.monotonic()
+        payload = request_body(kwargs)
+        lines = []
+        with self.lock:
+            if self.started is None:
+                self.started = started
+            entry = {
+                "method": method,
+                "url": request_url(url, kwargs.get("params")),
+                "request_body": _digest(payload) if payload else "",
+                "offset": round(started - self.started, 6),
+                "duration": round(now - started, 6),
+                "attempt": attempt,
+            }
+            if hedge:
+                entry["hedge"] = True
+            for data in ([payload] if payload else []) + ([response.body] if response is not None else []):
+                digest = _digest(data)
+                if digest not in self.written_bodies:
+                    self.written_bodies.add(digest)
+                    lines.append({"sha1": digest, "data": base64.b64encode(data).decode("ascii")})
+            if response is not None:
+                entry["status"] = response.status
+                entry["headers"] = list(response.headers.items())
+                entry["body"] = _digest(response.body)
+            else:
+                entry["error"] = error
+            lines.append(entry)
+            self.pending.extend(lines)
+            self.recorded += 1
+            full = len(self.pending) >= self.flush_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """写出缓冲的录制（首次写入时覆盖旧归档，之后追加 gzip 分段）"""
+        with self.lock:
+            lines, self.pending = self.pending, []
+            mode = "ab" if self.truncated else "wb"
+            self.truncated = True
+        if not lines:
+            return
+        try:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            with gzip.open(self.path, mode) as f:
+                for line in lines:
+                    f.write(json.dumps(line, ensure_ascii=False).encode("utf-8") + b"\n")
+        except Exception as e:
+            self.logger.error(f"写入录制归档失败: {e}")
+
+    # ---- 回放 ----
+
+    def load(self):
+        """读取归档"""
+        interactions = []
+        with gzip.open(self.path, "rb") as f:
+            for line in f:
+                item = json.loads(line)
+                if "sha1" in item:
+                    self.bodies[item["sha1"]] = base64.b64decode(item["data"])
+                    continue
+                item["headers"] = tuple(tuple(pair) for pair in item.get("headers", ()))
+                interactions.append(Interaction(**item))
+        interactions.sort(key=lambda item: item.offset)
+        # 录制时以第一个完成的请求为起点，更早发出的请求偏移为负，这里统一平移到从0开始
+        if interactions and interactions[0].offset < 0:
+            base = interactions[0].offset
+            for item in interactions:
+                item.offset -= base
+
+        self.interactions = interactions
+        self.by_key = {}
+        for item in interactions:
+            self.by_key.setdefault(item.key, []).append(item)
+        self.cursors = {}
+        self.loaded = True
+        self.logger.info(f"已加载录制归档: {self.path} ({len(interactions)} 个请求)")
+
+    def match(self, method: str, url: str, kwargs: Dict[str, Any]) -> Optional[Interaction]:
+        """按录制顺序取下一条匹配的录制，用完后从头循环"""
+        if not self.loaded:
+            self.load()
+        payload = request_body(kwargs)
+        key = (method, request_url(url, kwargs.get("params")), _digest(payload) if payload else "")
+        with self.lock:
+            candidates = self.by_key.get(key)
+            if not candidates:
+                self.misses += 1
+                return None
+            index = self.cursors.get(key, 0)
+            self.cursors[key] = index + 1
+            self.replayed += 1
+            return candidates[index % len(candidates)]
+
+    async def replay(self, interaction: Interaction) -> HttpResponse:
+        """按录制的耗时（乘以 time_scale）返回响应或抛出录制的异常"""
+        import aiohttp
+
+        if self.time_scale > 0 and interaction.duration > 0:
+            await asyncio.sleep(interaction.duration * self.time_scale)
+        if interaction.error == ERROR_TIMEOUT:
+            raise asyncio.TimeoutError()
+        if interaction.error:
+            raise aiohttp.ClientError(f"回放录制的网络错误: {interaction.url}")
+        return HttpResponse(
+            status=interaction.status,
+            headers=list(interaction.headers),
+            body=self.bodies.get(interaction.body, b""),
+            url=interaction.url,
+            method=interaction.method
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取录制回放统计"""
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "misses": self.misses,
+            "interactions": len(self.interactions),
+        }
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def replay_load(network, time_scale: Optional[float] = 1.0) -> Dict[str, Any]:
+    """按录制时的到达时间重放整段流量
+
+    network 需处于回放模式。time_scale 缩放请求之间的间隔，None 表示全部同时发出；
+    只重放每个请求的首次尝试，重试和镜像对冲由网络层按当前策略重新产生。
+    """
+    cassette = network.cassette
+    if not cassette.replaying:
+        raise ValueError("网络层未处于回放模式")
+    if not cassette.loaded:
+        cassette.load()
+
+    loop = asyncio.get_running_loop()
+    latencies: List[float] = []
+    errors = 0
+
+    async def fire(item: Interaction):
+        nonlocal errors
+        if time_scale is not None:
+            await asyncio.sleep(max(0.0, start + item.offset * time_scale - loop.time()))
+        kwargs = {}
+        if item.request_body:
+            kwargs["data"] = cassette.bodies.get(item.request_body, b"")
+        began = time.perf_counter()
+        try:
+            response = await network._request(item.method, item.url, **kwargs)
+            if response.status >= 400:
+                errors += 1
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - began)
+
+    requests = [item for item in cassette.interactions if item.attempt == 0 and not item.hedge]
+    start = loop.time()
+    cpu_start = time.process_time()
+    await asyncio.gather(*(fire(item) for item in requests))
+    cpu = time.process_time() - cpu_start
+    elapsed = loop.time() - start
+
+    return {
+        "requests": len(requests),
+        "errors": errors,
+        "misses": cassette.misses,
+        "elapsed": elapsed,
+        "requests_per_sec": len(requests) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": _percentile(latencies, 0.5) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "cpu_per_request_ms": cpu / max(len(requests), 1) * 1000,
+    }
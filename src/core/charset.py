@@ -0,0 +1,175 @@
+"""
+编码检测 - Charset Detection
+
+按代价从低到高依次判断响应编码：
+1. Content-Type 头中的 charset
+2. 前 2KB 中的 BOM、<meta charset>、XML 声明
+3. 能否按 UTF-8 严格解码
+4. 该站点之前检测出的编码
+5. 统计检测（cchardet / charset-normalizer / chardet，只看前缀）
+
+统计检测的结果按主机记住，每个站点只检测一次。
+"""
+
+import re
+import codecs
+import logging
+from typing import Dict, Optional, Any, Tuple
+
+
+SNIFF_SIZE = 2048
+
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+META_PATTERNS = (
+    re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE),
+    re.compile(rb"""<\?xml[^>]+encoding\s*=\s*["']([\w.:-]+)""", re.IGNORECASE),
+)
+
+# 国标编码统一按超集 GB18030 解码，避免生僻字解码失败
+CHARSET_ALIASES = {
+    "gb2312": "gb18030",
+    "gbk": "gb18030",
+    "x-gbk": "gb18030",
+    "utf8": "utf-8",
+    "ascii": "utf-8",
+}
+
+
+def normalize_charset(name: Optional[str]) -> Optional[str]:
+    """规范化编码名，Python不认识的编码返回None"""
+    if not name:
+        return None
+    name = name.strip().strip("\"'").lower()
+    name = CHARSET_ALIASES.get(name, name)
+    try:
+        codecs.lookup(name)
+    except LookupError:
+        return None
+    return name
+
+
+def charset_from_content_type(content_type: str) -> Optional[str]:
+    """从 Content-Type 头中取编码"""
+    if "charset=" not in (content_type or ""):
+        return None
+    return normalize_charset(content_type.split("charset=")[1].split(";")[0])
+
+
+def sniff_charset(content: bytes) -> Optional[str]:
+    """从 BOM 和前 2KB 的 meta / XML 声明中取编码"""
+    for bom, name in BOMS:
+        if content.startswith(bom):
+            return name
+    head = content[:SNIFF_SIZE]
+    for pattern in META_PATTERNS:
+        match = pattern.search(head)
+        if match:
+            charset = normalize_charset(match.group(1).decode("ascii", errors="ignore"))
+            if charset:
+                return charset
+    return None
+
+
+def _load_detector():
+    """按速度选择可用的统计检测库"""
+    try:
+        import cchardet
+        return "cchardet", cchardet.detect
+    except ImportError:
+        pass
+    try:
+        import charset_normalizer
+        return "charset_normalizer", charset_normalizer.detect
+    except ImportError:
+        pass
+    try:
+        import chardet
+        return "chardet", chardet.detect
+    except ImportError:
+        return None, None
+
+
+class CharsetDetector:
+    """带站点记忆的编码检测器"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.sample_size = self.config.get("sample_size", 16384)
+        self.min_confidence = self.config.get("min_confidence", 0.5)
+        self.default = self.config.get("default", "utf-8")
+
+        self.host_charsets: Dict[str, str] = {}
+        self.detector_name, self._detect = _load_detector()
+        self.stats = {"header": 0, "sniff": 0, "utf8": 0, "host": 0, "detector": 0, "default": 0}
+
+        self.logger = logging.getLogger("charset")
+
+    def _statistical(self, content: bytes) -> Optional[str]:
+        """统计检测（只看前缀）"""
+        if self._detect is None:
+            return None
+        try:
+            result = self._detect(content[:self.sample_size]) or {}
+        except Exception as e:
+            self.logger.debug(f"编码检测失败: {e}")
+            return None
+        charset = normalize_charset(result.get("encoding"))
+        if not charset or (result.get("confidence") or 0) >= self.min_confidence:
+            return charset
+        # 置信度不高时，能严格解码前缀也可以接受（UTF-8 已排除）
+        try:
+            codecs.getincrementaldecoder(charset)().decode(content[:self.sample_size], final=False)
+        except UnicodeDecodeError:
+            return None
+        return charset
+
+    def detect_with_source(self, content: bytes, headers: Any = None, host: str = "") -> Tuple[str, str]:
+        """检测编码，返回 (编码, 判断依据)"""
+        charset = charset_from_content_type((headers or {}).get("Content-Type", ""))
+        if charset:
+            return charset, "header"
+
+        charset = sniff_charset(content)
+        if charset:
+            return charset, "sniff"
+
+        try:
+            content.decode("utf-8")
+            return "utf-8", "utf8"
+        except UnicodeDecodeError:
+            pass
+
+        if host in self.host_charsets:
+            return self.host_charsets[host], "host"
+
+        charset = self._statistical(content)
+        if charset:
+            if host:
+                self.host_charsets[host] = charset
+                self.logger.debug(f"站点编码: {host} -> {charset}")
+            return charset, "detector"
+
+        return self.default, "default"
+
+    def detect(self, content: bytes, headers: Any = None, host: str = "") -> str:
+        """检测编码"""
+        charset, source = self.detect_with_source(content, headers, host)
+        self.stats[source] += 1
+        return charset
+
+    def decode(self, content: bytes, headers: Any = None, host: str = "") -> str:
+        """检测编码并解码，无法解码的字节替换为 U+FFFD"""
+        return content.decode(self.detect(content, headers, host), errors="replace")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取检测统计"""
+        return {
+            "detector": self.detector_name,
+            "sources": dict(self.stats),
+            "hosts": dict(self.host_charsets),
+        }
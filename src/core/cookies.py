@@ -0,0 +1,209 @@
+"""
+Cookie持久化 - Cookie Store
+
+书源配置 enabledCookieJar 为 true 时，该书源使用独立的 Cookie Jar：
+- 各书源之间的 Cookie 互不可见
+- 持久化到 SQLite，重启后无需重新登录或重复反爬预热请求
+- 首次用到某个书源时才从数据库加载
+- 只对主机有效（未设置 Domain）的 Cookie 记下该标记，重新加载后仍只对该主机有效
+- 收到 Set-Cookie 后延迟合并写入，只写入变化的 Cookie
+"""
+
+import time
+import asyncio
+import sqlite3
+import logging
+import contextvars
+from pathlib import Path
+from contextlib import contextmanager
+from http.cookies import SimpleCookie, CookieError
+from typing import Dict, Optional, Any, Tuple
+
+from yarl import URL
+
+
+_cookie_jar_name = contextvars.ContextVar("cookie_jar", default=None)
+
+
+def get_cookie_jar_name() -> Optional[str]:
+    """获取当前上下文使用的 Cookie Jar 名称，None 表示共享的默认 Jar"""
+    return _cookie_jar_name.get()
+
+
+@contextmanager
+def cookie_jar_scope(name: Optional[str]):
+    """在上下文中指定 Cookie Jar，对其中发起的所有请求生效"""
+    token = _cookie_jar_name.set(name)
+    try:
+        yield
+    finally:
+        _cookie_jar_name.reset(token)
+
+
+class CookieStore:
+    """按书源保存 Cookie 的 SQLite 存储"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.enabled = self.config.get("enabled", True)
+        self.db_path = self.config.get("db_path", "data/cookies.db")
+        self.save_delay = self.config.get("save_delay", 1.0)  # Set-Cookie 后延迟多少秒写入
+
+        self.initialized = False
+        # Jar 名称 -> 数据库中的内容 {(domain, path, name): (value, host_only)}，用于只写入变化的 Cookie
+        self.snapshots: Dict[str, Dict[Tuple[str, str, str], Tuple[str, bool]]] = {}
+        self.dirty: Dict[str, Any] = {}  # 等待写入的 Jar
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+        self.logger = logging.getLogger("cookies")
+
+    def _init_db(self):
+        """初始化数据库（首次读写时）"""
+        if self.initialized or not self.enabled:
+            return
+        self.initialized = True
+        try:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS cookies (
+                        jar TEXT,
+                        domain TEXT,
+                        path TEXT,
+                        name TEXT,
+                        value TEXT,
+                        saved_at REAL,
+                        host_only INTEGER DEFAULT 0,
+                        PRIMARY KEY (jar, domain, path, name)
+                    )
+                """)
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(cookies)")}
+                if "host_only" not in columns:
+                    conn.execute("ALTER TABLE cookies ADD COLUMN host_only INTEGER DEFAULT 0")
+        except Exception as e:
+            self.logger.error(f"Cookie数据库初始化失败: {e}")
+            self.enabled = False
+
+    def load(self, name: str, jar) -> int:
+        """把书源保存的 Cookie 载入 jar，返回载入数量"""
+        self._init_db()
+        if not self.enabled:
+            return 0
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                rows = conn.execute(
+                    "SELECT domain, path, name, value, saved_at, host_only FROM cookies WHERE jar = ?", (name,)
+                ).fetchall()
+        except Exception as e:
+            self.logger.error(f"读取Cookie失败: {e}")
+            return 0
+
+        self.snapshots[name] = {(domain, path, key): (value, bool(host_only))
+                                for domain, path, key, value, _, host_only in rows}
+        loaded = 0
+        now = time.time()
+        for domain, _, _, value, saved_at, host_only in rows:
+            cookie = SimpleCookie()
+            try:
+                cookie.load(value)
+            except CookieError:
+                continue
+            for morsel in list(cookie.values()):
+                # Max-Age 是相对时间，扣掉保存以来经过的时间
+                if morsel["max-age"]:
+                    remaining = int(morsel["max-age"]) - int(now - saved_at)
+                    if remaining <= 0:
+                        del cookie[morsel.key]
+                        continue
+                    morsel["max-age"] = str(remaining)
+                if host_only:
+                    # 不带 Domain 载入，jar 按请求地址把它记为只对该主机有效
+                    morsel["domain"] = ""
+            if cookie:
+                jar.update_cookies(cookie, URL(f"https://{domain.lstrip('.')}/"))
+                loaded += len(cookie)
+        if loaded:
+            self.logger.debug(f"载入书源Cookie: {name}, {loaded} 个")
+        return loaded
+
+    def schedule_save(self, name: str, jar):
+        """标记 jar 有变化，延迟 save_delay 秒后与其他变化合并写入"""
+        if not self.enabled:
+            return
+        self.dirty[name] = jar
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(self.save_delay, self.flush)
+
+    def flush(self):
+        """立即写入所有等待中的 Jar"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        dirty, self.dirty = self.dirty, {}
+        for name, jar in dirty.items():
+            self.save(name, jar)
+
+    @staticmethod
+    def _host_only_keys(jar) -> set:
+        """jar 中只对主机有效的 Cookie：{(domain, name)}"""
+        return {(entry[0], entry[-1]) for entry in getattr(jar, "_host_only_cookies", ())}
+
+    def save(self, name: str, jar):
+        """保存书源的 Cookie，只写入与数据库相比有变化的部分"""
+        self._init_db()
+        if not self.enabled:
+            return
+        self.dirty.pop(name, None)
+        host_only = self._host_only_keys(jar)
+        current = {
+            (morsel["domain"], morsel["path"] or "/", morsel.key):
+                (morsel.OutputString(), (morsel["domain"], morsel.key) in host_only)
+            for morsel in jar
+            if morsel["domain"]
+        }
+        previous = self.snapshots.get(name)
+        now = time.time()
+        changed = [
+            (name, domain, path, key, value, now, int(only))
+            for (domain, path, key), (value, only) in current.items()
+            if previous is None or previous.get((domain, path, key)) != (value, only)
+        ]
+        removed = [(name, *key) for key in previous if key not in current] if previous is not None else []
+        if previous is not None and not changed and not removed:
+            return
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                if previous is None:
+                    conn.execute("DELETE FROM cookies WHERE jar = ?", (name,))
+                conn.executemany(
+                    "DELETE FROM cookies WHERE jar = ? AND domain = ? AND path = ? AND name = ?", removed
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cookies (jar, domain, path, name, value, saved_at, host_only) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    changed
+                )
+        except Exception as e:
+            self.logger.error(f"保存Cookie失败: {e}")
+            return
+        self.snapshots[name] = current
+
+    def clear(self, name: str):
+        """删除书源保存的 Cookie"""
+        self._init_db()
+        if not self.enabled:
+            return
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("DELETE FROM cookies WHERE jar = ?", (name,))
+        except Exception as e:
+            self.logger.error(f"删除Cookie失败: {e}")
+            return
+        self.snapshots[name] = {}
+        self.dirty.pop(name, None)
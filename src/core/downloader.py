@@ -0,0 +1,405 @@
+"""
+整书下载器 - Book Downloader
+
+在 BaseSource.get_toc + get_full_content 之上实现整书下载：
+- 按主机限制并发的章节抓取
+- 失败章节自动重试
+- 按目录顺序流式写入 TXT / EPUB，不在内存中保存整本书
+- 断点续传（检查点文件）
+"""
+
+import os
+import json
+import contextlib
+import time
+import html
+import shutil
+import asyncio
+import logging
+import zipfile
+from typing import Dict, List, Optional, Any
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from urllib.parse import urlparse
+
+from .engine import BaseSource, ChapterInfo
+from .scheduler import Priority, request_priority
+
+
+@dataclass
+class DownloadReport:
+    """下载报告"""
+    output_path: str = ""
+    total: int = 0
+    downloaded: int = 0
+    failed: List[int] = field(default_factory=list)
+    resumed_from: int = 0
+    elapsed: float = 0
+    throughput: float = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return asdict(self)
+
+
+class TxtWriter:
+    """TXT流式写入器"""
+
+    def __init__(self, path: str, title: str = "", author: str = ""):
+        self.path = path
+        self.title = title
+        self.author = author
+        self.file = None
+
+    def open(self, offset: int = 0):
+        """打开文件，offset>0 时截断到检查点位置后继续追加"""
+        if offset > 0 and os.path.exists(self.path):
+            self.file = open(self.path, "r+b")
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        else:
+            self.file = open(self.path, "wb")
+            header = f"{self.title}\n"
+            if self.author:
+                header += f"作者：{self.author}\n"
+            self.file.write((header + "\n").encode("utf-8"))
+
+    def can_resume(self, offset: int) -> bool:
+        """已写入的文件是否还在且不短于检查点位置"""
+        return os.path.exists(self.path) and os.path.getsize(self.path) >= offset
+
+    def write_chapter(self, index: int, title: str, content: str):
+        """写入一章"""
+        self.file.write(f"{title}\n\n{content.strip()}\n\n".encode("utf-8"))
+
+    def position(self) -> int:
+        """当前偏移（不刷新）"""
+        return self.file.tell()
+
+    def checkpoint(self) -> int:
+        """刷新到磁盘并返回当前偏移"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self, complete: bool = True):
+        """完成写入（出错中止时同样只关闭文件，已写入部分留给断点续传）"""
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def cleanup(self):
+        """删除续传用的暂存数据（TXT 没有暂存数据）"""
+
+
+class EpubWriter:
+    """EPUB流式写入器
+
+    章节逐个写入暂存目录，完成时再打包为EPUB，内存中只保留章节标题。
+    """
+
+    def __init__(self, path: str, title: str = "", author: str = ""):
+        self.path = path
+        self.title = title
+        self.author = author
+        self.parts_dir = Path(path + ".parts")
+        self.titles: List[str] = []
+
+    def open(self, offset: int = 0):
+        """打开写入器，offset 为已写入的章节数"""
+        if offset > 0 and self.parts_dir.exists():
+            index_path = self.parts_dir / "titles.json"
+            if index_path.exists():
+                with open(index_path, "r", encoding="utf-8") as f:
+                    self.titles = json.load(f)[:offset]
+        else:
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            self.parts_dir.mkdir(parents=True, exist_ok=True)
+            self.titles = []
+
+    def can_resume(self, offset: int) -> bool:
+        """暂存目录和章节索引是否还在且不少于检查点的章节数"""
+        index_path = self.parts_dir / "titles.json"
+        if not index_path.exists():
+            return False
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                titles = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+        return len(titles) >= offset and all(
+            (self.parts_dir / f"chapter_{index:05d}.xhtml").exists() for index in range(offset)
+        )
+
+    def write_chapter(self, index: int, title: str, content: str):
+        """写入一章"""
+        paragraphs = "\n".join(
+            f"<p>{html.escape(line.strip())}</p>"
+            for line in content.splitlines() if line.strip()
+        )
+        xhtml = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+            f"<head><title>{html.escape(title)}</title></head>\n"
+            f"<body><h2>{html.escape(title)}</h2>\n{paragraphs}\n</body></html>\n"
+        )
+        with open(self.parts_dir / f"chapter_{index:05d}.xhtml", "w", encoding="utf-8") as f:
+            f.write(xhtml)
+        self.titles.append(title)
+
+    def position(self) -> int:
+        """已写入的章节数"""
+        return len(self.titles)
+
+    def checkpoint(self) -> int:
+        """保存章节标题索引并返回已写入章节数"""
+        index_path = self.parts_dir / "titles.json"
+        tmp_path = self.parts_dir / "titles.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.titles, f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+        return len(self.titles)
+
+    def close(self, complete: bool = True):
+        """打包EPUB，暂存目录保留到 cleanup，出错中止或有失败章节时供断点续传"""
+        if not complete:
+            return
+        manifest = []
+        spine = []
+        nav_points = []
+        for index, title in enumerate(self.titles):
+            item_id = f"chapter_{index:05d}"
+            manifest.append(f'<item id="{item_id}" href="{item_id}.xhtml" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="{item_id}"/>')
+            nav_points.append(
+                f'<navPoint id="nav{index}" playOrder="{index + 1}">'
+                f"<navLabel><text>{html.escape(title)}</text></navLabel>"
+                f'<content src="{item_id}.xhtml"/></navPoint>'
+            )
+
+        opf = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="bookid">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f"<dc:title>{html.escape(self.title)}</dc:title>\n"
+            f"<dc:creator>{html.escape(self.author)}</dc:creator>\n"
+            "<dc:language>zh-CN</dc:language>\n"
+            f'<dc:identifier id="bookid">{html.escape(self.path)}</dc:identifier>\n'
+            "</metadata>\n"
+            f'<manifest><item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>{"".join(manifest)}</manifest>\n'
+            f'<spine toc="ncx">{"".join(spine)}</spine>\n'
+            "</package>\n"
+        )
+        ncx = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">\n'
+            f"<head/><docTitle><text>{html.escape(self.title)}</text></docTitle>\n"
+            f'<navMap>{"".join(nav_points)}</navMap>\n'
+            "</ncx>\n"
+        )
+        container = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>\n'
+            "</container>\n"
+        )
+
+        with zipfile.ZipFile(self.path, "w") as epub:
+            epub.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+            epub.writestr("META-INF/container.xml", container, compress_type=zipfile.ZIP_DEFLATED)
+            epub.writestr("OEBPS/content.opf", opf, compress_type=zipfile.ZIP_DEFLATED)
+            epub.writestr("OEBPS/toc.ncx", ncx, compress_type=zipfile.ZIP_DEFLATED)
+            for index in range(len(self.titles)):
+                name = f"chapter_{index:05d}.xhtml"
+                epub.write(self.parts_dir / name, f"OEBPS/{name}", compress_type=zipfile.ZIP_DEFLATED)
+
+    def cleanup(self):
+        """删除暂存目录"""
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+
+WRITERS = {
+    "txt": TxtWriter,
+    "epub": EpubWriter,
+}
+
+
+class BookDownloader:
+    """整书下载器"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.output_dir = self.config.get("output_dir", "output/books")
+        self.concurrent_requests = self.config.get("concurrent_requests", 8)
+        self.per_host_concurrency = self.config.get("per_host_concurrency", 4)
+        self.chapter_retries = self.config.get("chapter_retries", 3)
+        self.retry_delay = self.config.get("retry_delay", 1.0)
+        self.window_size = self.config.get("window_size", 64)
+        self.checkpoint_interval = self.config.get("checkpoint_interval", 10)
+
+        self.logger = logging.getLogger("downloader")
+
+    def _checkpoint_path(self, output_path: str) -> str:
+        """检查点文件路径"""
+        return output_path + ".progress.json"
+
+    def _load_checkpoint(self, output_path: str, book_key: str, total: int, writer) -> Optional[Dict[str, Any]]:
+        """加载检查点，书籍不一致、目录变短或已写入的文件不在时忽略"""
+        path = self._checkpoint_path(output_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.warning(f"检查点文件损坏，重新下载: {e}")
+            return None
+        if checkpoint.get("book_key") != book_key or checkpoint.get("next_index", 0) > total:
+            self.logger.warning("书籍或目录已变化，忽略检查点")
+            return None
+        if not writer.can_resume(checkpoint.get("offset", 0)):
+            self.logger.warning("已下载的文件不存在或不完整，忽略检查点，重新下载")
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, output_path: str, checkpoint: Dict[str, Any]):
+        """原子写入检查点"""
+        path = self._checkpoint_path(output_path)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def _fetch_chapter(self, source: BaseSource, chapter: ChapterInfo) -> Optional[str]:
+        """抓取单章，失败时按次数重试"""
+        for attempt in range(self.chapter_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.retry_delay * attempt)
+            try:
+                content = await source.get_full_content(chapter.url)
+                if content.content:
+                    return content.content
+                self.logger.warning(f"章节内容为空: {chapter.name}")
+            except Exception as e:
+                self.logger.warning(f"章节下载失败 (第 {attempt + 1} 次): {chapter.name}, {e}")
+        return None
+
+    async def download(self, source: BaseSource, chapters: List[ChapterInfo], output_path: str,
+                       fmt: str = "txt", title: str = "", author: str = "",
+                       book_key: str = "") -> DownloadReport:
+        """下载章节列表并按目录顺序写入文件"""
+        if fmt not in WRITERS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+
+        start = time.monotonic()
+        total = len(chapters)
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+
+        writer = WRITERS[fmt](output_path, title=title, author=author)
+        checkpoint = self._load_checkpoint(output_path, book_key, total, writer)
+        next_index = checkpoint["next_index"] if checkpoint else 0
+        offset = checkpoint["offset"] if checkpoint else 0
+        failed: List[int] = []
+        failed_offset = 0  # 第一章失败章节写入前的位置
+        if checkpoint and checkpoint.get("failed"):
+            # 文件按目录顺序写入，从第一个失败的章节重新下载，失败章节得到重试
+            next_index = checkpoint["failed"][0]
+            offset = checkpoint["failed_offset"]
+            self.logger.info(f"检查点记录了 {len(checkpoint['failed'])} 个失败章节，从第 {next_index + 1} 章重新下载")
+
+        writer.open(offset)
+
+        report = DownloadReport(output_path=output_path, total=total, resumed_from=next_index)
+        if next_index:
+            self.logger.info(f"从第 {next_index + 1} 章继续下载")
+
+        global_limit = asyncio.Semaphore(max(self.concurrent_requests, 1))
+        host_limits: Dict[str, asyncio.Semaphore] = {}
+
+        async def fetch(index: int) -> Optional[str]:
+            chapter = chapters[index]
+            host = urlparse(chapter.url).netloc
+            host_limit = host_limits.setdefault(host, asyncio.Semaphore(max(self.per_host_concurrency, 1)))
+            # 先占主机名额再占全局名额，等待繁忙主机的章节不占用全局名额
+            async with host_limit:
+                async with global_limit:
+                    with request_priority(Priority.BULK):
+                        return await self._fetch_chapter(source, chapter)
+
+        # 滑动窗口：只调度 next_index 之后 window_size 章，已完成但未写入的章节最多占用一个窗口
+        pending: Dict[int, asyncio.Task] = {}
+        scheduled = next_index
+        written_since_checkpoint = 0
+        completed = False
+
+        try:
+            while next_index < total:
+                while scheduled < total and scheduled < next_index + self.window_size:
+                    pending[scheduled] = asyncio.ensure_future(fetch(scheduled))
+                    scheduled += 1
+
+                content = await pending.pop(next_index)
+                chapter = chapters[next_index]
+                if content is None:
+                    if not failed:
+                        failed_offset = writer.position()
+                    failed.append(next_index)
+                    content = "本章下载失败"
+                else:
+                    report.downloaded += 1
+                writer.write_chapter(next_index, chapter.name, content)
+                next_index += 1
+                written_since_checkpoint += 1
+
+                if written_since_checkpoint >= self.checkpoint_interval or next_index == total:
+                    self._save_checkpoint(output_path, {
+                        "book_key": book_key,
+                        "total": total,
+                        "next_index": next_index,
+                        "offset": writer.checkpoint(),
+                        "failed": failed,
+                        "failed_offset": failed_offset,
+                    })
+                    written_since_checkpoint = 0
+            completed = True
+        finally:
+            for task in pending.values():
+                task.cancel()
+            writer.close(complete=completed)
+
+        if failed:
+            # 保留检查点（含失败章节），再次运行时只从第一个失败的章节重新下载
+            self.logger.info(f"有 {len(failed)} 章下载失败，保留检查点供重试")
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._checkpoint_path(output_path))
+            writer.cleanup()
+
+        report.failed = failed
+        report.elapsed = time.monotonic() - start
+        report.throughput = report.downloaded / report.elapsed if report.elapsed > 0 else 0
+        self.logger.info(
+            f"下载完成: {output_path}, 共 {total} 章, 失败 {len(failed)} 章, "
+            f"{report.throughput:.1f} 章/秒"
+        )
+        return report
+
+    async def download_book(self, source: BaseSource, book_url: str, fmt: str = "txt",
+                            output_path: str = None) -> DownloadReport:
+        """下载整本书"""
+        book_info = await source.get_book_info(book_url)
+        if not book_info.toc_url:
+            raise Exception(f"获取书籍目录地址失败: {book_url}")
+
+        chapters = await source.get_toc(book_info.toc_url)
+        if not chapters:
+            raise Exception(f"获取目录失败: {book_info.toc_url}")
+
+        if output_path is None:
+            file_name = f"{book_info.name or 'book'}-{book_info.author or source.name}.{fmt}"
+            output_path = os.path.join(self.output_dir, file_name.replace("/", "_"))
+
+        return await self.download(
+            source, chapters, output_path, fmt=fmt,
+            title=book_info.name, author=book_info.author, book_key=book_url
+        )
@@ -6,14 +6,34 @@
 """
 
 import json
+import asyncio
 import logging
-from typing import Dict, List, Optional, Any, Union
-from dataclasses import dataclass, asdict
+from typing import AsyncIterator, Dict, List, Optional, Any, Tuple, Union
+from dataclasses import dataclass, asdict, replace
 from abc import ABC, abstractmethod
+from urllib.parse import urlparse
 
 from .network import NetworkManager
-from .rules import RuleEngine
+from .rules import RuleEngine, SourceRules
+from .rulecost import RULE_COSTS
+from .regexguard import REGEX_GUARD
 from .cache import CacheManager
+from .stitcher import ContentStitcher
+from .purifier import ContentPurifier
+from .mirrors import extract_mirror_urls
+from .warmup import SourceWarmer
+from . import tracing
+
+
+class SourceNotFoundError(KeyError):
+    """书源未注册"""
+
+    def __str__(self) -> str:
+        return str(self.args[0]) if self.args else ""
+
+
+class ChapterNotFoundError(IndexError):
+    """章节序号超出目录范围"""
 
 
 @dataclass
@@ -63,6 +83,8 @@ class BaseSource(ABC):
         self.network = NetworkManager()
         self.rules = RuleEngine()
         self.cache = CacheManager()
+        self.stitcher = ContentStitcher()
+        self.purifier = ContentPurifier((config.get("ruleContent") or {}).get("replaceRegex"))
         
         # 设置日志
         self.logger = logging.getLogger(f"source.{self.name}")
@@ -84,9 +106,17 @@ class BaseSource(ABC):
     
     @abstractmethod
     async def get_content(self, chapter_url: str) -> ContentInfo:
-        """获取正文内容"""
+        """获取正文内容（单页）"""
         pass
     
+    async def get_full_content(self, chapter_url: str) -> ContentInfo:
+        """获取完整章节正文，自动跟随 next_url 拼接分页，拼接后按 replaceRegex 净化
+
+        拼接结果可能是缓存中共享的对象，净化结果写入副本，不修改原对象。
+        """
+        content = await self.stitcher.stitch(self.get_content, chapter_url)
+        return replace(content, content=self.purifier.purify(content.content))
+    
     def to_legado_format(self) -> Dict[str, Any]:
         """转换为legado格式"""
         return {
@@ -132,11 +162,32 @@ class BookSourceEngine:
         self._setup_logging()
         self.logger = logging.getLogger("engine")
         
+        # 链路追踪（默认关闭）
+        tracing.configure(self.config.get("tracing", {}))
+        RULE_COSTS.configure(self.config.get("rules", {}))
+        REGEX_GUARD.configure(self.config.get("rules", {}))
+        
         # 初始化管理器
-        self.network = NetworkManager(self.config.get("network", {}))
+        network_config = dict(self.config.get("network", {}))
+        security_config = self.config.get("security", {})
+        performance_config = self.config.get("performance", {})
+        network_config.setdefault("max_content_length", security_config.get("max_content_length", 0))
+        network_config.setdefault("verify_ssl", security_config.get("enable_ssl_verify", True))
+        network_config.setdefault("max_connections", performance_config.get("connection_pool_size", 100))
+        network_config.setdefault("enable_compression", performance_config.get("enable_compression", True))
+        self.network = NetworkManager(network_config)
         self.rules = RuleEngine(self.config.get("rules", {}))
         self.cache = CacheManager(self.config.get("cache", {}))
         
+        self.warmup_report: Optional[Dict[str, Any]] = None
+        
+        # 章节预读（可选）
+        self.prefetcher = None
+        prefetch_config = self.config.get("prefetch", {})
+        if prefetch_config.get("enabled", False):
+            from .prefetch import ReadAheadPrefetcher
+            self.prefetcher = ReadAheadPrefetcher(self.cache, prefetch_config)
+        
         self.logger.info("书源解析引擎初始化完成")
     
     def _load_config(self) -> Dict[str, Any]:
@@ -211,6 +262,19 @@ class BookSourceEngine:
     
     def register_source(self, name: str, source: BaseSource):
         """注册书源"""
+        # 书源共用引擎的网络层，便于统一限速和统计；启用 enabledCookieJar 的书源使用独立的 Cookie Jar
+        config = getattr(source, "config", None)
+        cookie_jar = isinstance(config, dict) and bool(config.get("enabledCookieJar"))
+        source.network = self.network.bind(name, cookie_jar=cookie_jar)
+        # 书源自己的规则引擎解析耗时记在该书源名下
+        rules = getattr(source, "rules", None)
+        if isinstance(rules, (RuleEngine, SourceRules)):
+            source.rules = rules.bind(name)
+        purifier = getattr(source, "purifier", None)
+        if isinstance(purifier, ContentPurifier):
+            purifier.configure(self.config.get("rules", {}))
+        if isinstance(config, dict):
+            self.network.mirrors.register(extract_mirror_urls(config))
         self.sources[name] = source
         self.logger.info(f"注册书源: {name}")
     
@@ -222,19 +286,82 @@ class BookSourceEngine:
         """列出所有书源"""
         return list(self.sources.keys())
     
+    def get_fastest_mirror(self, name: str) -> Optional[str]:
+        """书源各镜像中历史响应最快的站点地址"""
+        source = self.sources.get(name)
+        if not source:
+            return None
+        parsed = urlparse(source.url)
+        return f"{parsed.scheme}://{self.network.mirrors.fastest(parsed.netloc)}"
+    
+    def is_source_available(self, source: BaseSource) -> bool:
+        """书源站点是否可用（未处于熔断冷却中）"""
+        host = urlparse(getattr(source, "url", "") or "").netloc
+        return not (host and self.network.breakers.is_open(host))
+    
+    async def warm_up(self) -> Dict[str, Any]:
+        """预热已注册书源的站点：预先解析域名、建立连接，记录不可用的站点"""
+        warmer = SourceWarmer(self.network, self.config.get("warmup", {}))
+        report = await warmer.warm_up(self.sources)
+        self.warmup_report = report.to_dict()
+        return self.warmup_report
+    
+    async def _search_source(self, name: str, source: BaseSource, keyword: str, page: int) -> List[BookInfo]:
+        """在单个书源中搜索，失败时返回空列表"""
+        if not self.is_source_available(source):
+            # 熔断中的书源暂时跳过，冷却结束后的第一次请求即为探测
+            self.logger.info(f"书源 {name} 站点熔断中，跳过搜索")
+            return []
+        try:
+            results = await source.search(keyword, page)
+            self.logger.info(f"书源 {name} 搜索完成，找到 {len(results)} 个结果")
+            return results
+        except Exception as e:
+            self.logger.error(f"书源 {name} 搜索失败: {e}")
+            return []
+    
+    async def search_iter(self, keyword: str, page: int = 1) -> AsyncIterator[Tuple[str, List[BookInfo]]]:
+        """并发搜索所有书源，按完成先后逐个产出 (书源名, 结果)"""
+        async def run(name: str, source: BaseSource):
+            with tracing.span("search.source", source=name) as source_span:
+                results = await self._search_source(name, source, keyword, page)
+                source_span.set_attribute("results", len(results))
+                return name, results
+        
+        tasks = [
+            asyncio.ensure_future(run(name, source))
+            for name, source in self.sources.items() if source.enabled
+        ]
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield await future
+        finally:
+            # 调用方提前退出（如客户端断开）时取消剩余的搜索
+            for task in tasks:
+                task.cancel()
+    
     async def search_all(self, keyword: str, page: int = 1) -> Dict[str, List[BookInfo]]:
         """在所有书源中搜索"""
         results = {}
-        for name, source in self.sources.items():
-            if source.enabled:
-                try:
-                    results[name] = await source.search(keyword, page)
-                    self.logger.info(f"书源 {name} 搜索完成，找到 {len(results[name])} 个结果")
-                except Exception as e:
-                    self.logger.error(f"书源 {name} 搜索失败: {e}")
-                    results[name] = []
+        with tracing.span("search_all", keyword=keyword, page=page, sources=len(self.sources)):
+            async for name, books in self.search_iter(keyword, page):
+                results[name] = books
         return results
     
+    async def read_chapter(self, name: str, toc_url: str, index: int) -> ContentInfo:
+        """阅读指定书源目录中的第 index 章，启用预读时后台预读后续章节"""
+        source = self.get_source(name)
+        if source is None:
+            raise SourceNotFoundError(f"书源不存在: {name}")
+        
+        if self.prefetcher:
+            return await self.prefetcher.get_content(source, toc_url, index)
+        
+        chapters = await source.get_toc(toc_url)
+        if not 0 <= index < len(chapters):
+            raise ChapterNotFoundError(f"章节序号超出范围: {index}")
+        return await source.get_full_content(chapters[index].url)
+    
     def generate_legado_sources(self, output_path: str = "output/legado_sources.json"):
         """生成legado格式的书源文件"""
         sources_data = []
@@ -0,0 +1,335 @@
+"""
+HTTP缓存 - HTTP Response Cache
+
+按HTTP语义缓存GET响应，减少目录页、详情页等很少变化的页面的重复下载：
+- 保存 ETag / Last-Modified，过期后发送 If-None-Match / If-Modified-Since 条件请求
+- 服务器返回 304 时用已保存的响应体作答
+- 遵守 Cache-Control 的 max-age / no-cache / no-store
+- 缓存键包含书源的 Cookie Jar 和响应 Vary 指定的请求头，不同登录状态的响应互不串用
+- 启动时把数据库中的键读入内存，没有缓存的地址（如章节页）不再逐次查询数据库
+- 数据库按条数上限淘汰最早保存的响应，启动时清理超过保存期限的响应
+"""
+
+import time
+import json
+import sqlite3
+import logging
+from pathlib import Path
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from urllib.parse import urlencode
+from typing import Dict, Optional, Any, Set, Tuple
+
+from .response import HttpResponse
+
+
+# 随缓存保存的响应头
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Expires", "Vary")
+
+# 调用方自己发条件请求时不经过缓存
+CONDITIONAL_HEADERS = ("If-None-Match", "If-Modified-Since")
+
+
+def parse_cache_control(value: str) -> Dict[str, Optional[str]]:
+    """解析 Cache-Control 头"""
+    directives = {}
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, arg = part.partition("=")
+        directives[name.strip().lower()] = arg.strip().strip('"') or None
+    return directives
+
+
+@dataclass
+class CachedResponse:
+    """已缓存的响应"""
+    url: str
+    headers: Dict[str, str]
+    body: bytes
+    stored_at: float = field(default_factory=time.time)
+
+    @property
+    def etag(self) -> str:
+        return self.headers.get("ETag", "")
+
+    @property
+    def last_modified(self) -> str:
+        return self.headers.get("Last-Modified", "")
+
+    @property
+    def max_age(self) -> Optional[float]:
+        """Cache-Control: max-age，未声明时返回None"""
+        directives = parse_cache_control(self.headers.get("Cache-Control", ""))
+        if "no-cache" in directives:
+            return 0.0
+        try:
+            return float(directives["max-age"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        """是否仍在新鲜期内，可不经请求直接使用"""
+        max_age = self.max_age
+        if not max_age:
+            return False
+        now = time.time() if now is None else now
+        return now - self.stored_at < max_age
+
+    def validators(self) -> Dict[str, str]:
+        """条件请求头"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_response(self) -> HttpResponse:
+        """转换为响应对象"""
+        return HttpResponse(200, self.headers, self.body, self.url, "GET")
+
+
+class HttpCache:
+    """HTTP响应缓存"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.enabled = self.config.get("enabled", True)
+        self.max_entries = self.config.get("max_entries", 500)
+        self.max_body_size = self.config.get("max_body_size", 2 * 1024 * 1024)
+        self.db_path = self.config.get("db_path")
+        self.max_db_entries = self.config.get("max_db_entries", 5000)  # 数据库中的响应条数上限，0 表示不限
+        self.max_age = self.config.get("max_age", 7 * 86400)  # 数据库中响应的保存期限（秒），0 表示不限
+
+        self.entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.keys: Set[str] = set()  # 数据库中已有的键
+        self.vary: Dict[str, Tuple[str, ...]] = {}  # 缓存键 -> Vary 指定的请求头（小写）
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evicted = 0
+
+        self.logger = logging.getLogger("httpcache")
+        if self.enabled and self.db_path:
+            self._init_db()
+
+    def _init_db(self):
+        """初始化数据库"""
+        try:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,
+                        url TEXT,
+                        headers TEXT,
+                        body BLOB,
+                        stored_at REAL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_stored_at ON responses (stored_at)")
+                conn.execute("CREATE TABLE IF NOT EXISTS vary (key TEXT PRIMARY KEY, names TEXT)")
+                if self.max_age:
+                    conn.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.max_age,))
+                self.keys = {row[0] for row in conn.execute("SELECT key FROM responses")}
+                self._evict(conn)
+                self.vary = {key: tuple(json.loads(names)) for key, names in conn.execute("SELECT key, names FROM vary")}
+        except Exception as e:
+            self.logger.error(f"HTTP缓存数据库初始化失败: {e}")
+            self.db_path = None
+
+    @staticmethod
+    def make_key(url: str, params: Optional[Dict[str, Any]] = None, jar: Optional[str] = None) -> str:
+        """缓存键：地址 + 排序后的查询参数 + Cookie Jar"""
+        key = url
+        if params:
+            key = f"{key}|{urlencode(sorted(params.items()))}"
+        if jar:
+            key = f"{key}|jar={jar}"
+        return key
+
+    def variant_key(self, key: str, request_headers: Optional[Dict[str, str]] = None) -> str:
+        """按该地址响应的 Vary 头，把对应的请求头值加入缓存键"""
+        names = self.vary.get(key)
+        if not names:
+            return key
+        lowered = {name.lower(): value for name, value in (request_headers or {}).items()}
+        return f"{key}|vary:{urlencode([(name, lowered.get(name, '')) for name in names])}"
+
+    def _set_vary(self, key: str, names: Tuple[str, ...]):
+        """记录（或清除）地址的 Vary 请求头"""
+        if self.vary.get(key, ()) == names:
+            return
+        if names:
+            self.vary[key] = names
+        else:
+            self.vary.pop(key, None)
+        if not self.db_path:
+            return
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                if names:
+                    conn.execute("INSERT OR REPLACE INTO vary (key, names) VALUES (?, ?)", (key, json.dumps(names)))
+                else:
+                    conn.execute("DELETE FROM vary WHERE key = ?", (key,))
+        except Exception as e:
+            self.logger.error(f"写入HTTP缓存失败: {e}")
+
+    @staticmethod
+    def is_conditional(headers: Optional[Dict[str, str]]) -> bool:
+        """调用方是否已自带条件请求头"""
+        return bool(headers) and any(name in headers for name in CONDITIONAL_HEADERS)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """读取缓存项"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+        if not self.db_path or key not in self.keys:
+            return None
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                row = conn.execute(
+                    "SELECT url, headers, body, stored_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+        except Exception as e:
+            self.logger.error(f"读取HTTP缓存失败: {e}")
+            return None
+        if row is None:
+            return None
+        entry = CachedResponse(row[0], json.loads(row[1]), row[2], row[3])
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key: str, entry: CachedResponse):
+        """写入内存并按LRU淘汰"""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _persist(self, key: str, entry: CachedResponse):
+        """写入数据库"""
+        if not self.db_path:
+            return
+        self.keys.add(key)
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, url, headers, body, stored_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, entry.url, json.dumps(entry.headers), entry.body, entry.stored_at)
+                )
+                self._evict(conn)
+        except Exception as e:
+            self.logger.error(f"写入HTTP缓存失败: {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        """数据库中的响应超过条数上限时删除最早保存的"""
+        excess = len(self.keys) - self.max_db_entries
+        if not self.max_db_entries or excess <= 0:
+            return
+        keys = [row[0] for row in conn.execute(
+            "SELECT key FROM responses ORDER BY stored_at LIMIT ?", (excess,)
+        )]
+        conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in keys])
+        for key in keys:
+            self.keys.discard(key)
+            self.entries.pop(key, None)
+        self.evicted += len(keys)
+
+    def delete(self, key: str):
+        """删除缓存项"""
+        self.entries.pop(key, None)
+        if self.db_path and key in self.keys:
+            self.keys.discard(key)
+            try:
+                with sqlite3.connect(self.db_path) as conn:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            except Exception as e:
+                self.logger.error(f"删除HTTP缓存失败: {e}")
+
+    def lookup(self, key: str, request_headers: Optional[Dict[str, str]] = None) -> Optional[CachedResponse]:
+        """查找缓存，新鲜的缓存项计为命中"""
+        if not self.enabled:
+            return None
+        entry = self.get(self.variant_key(key, request_headers))
+        if entry is not None and entry.is_fresh():
+            self.hits += 1
+            self.bytes_saved += len(entry.body)
+        return entry
+
+    def update(self, key: str, entry: Optional[CachedResponse], response: HttpResponse,
+               request_headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+        """根据上游响应更新缓存，304时返回缓存的响应体
+
+        key 为 make_key 生成的键，request_headers 为调用方的请求头（不含条件请求头），用于 Vary。
+        """
+        base_key = key
+        key = self.variant_key(base_key, request_headers)
+        if response.status == 304 and entry is not None:
+            # 304 可能带有新的缓存头
+            headers = dict(entry.headers)
+            for name in STORED_HEADERS:
+                if name in response.headers:
+                    headers[name] = response.headers[name]
+            entry = CachedResponse(entry.url, headers, entry.body)
+            self._remember(key, entry)
+            self._persist(key, entry)
+            self.revalidated += 1
+            self.bytes_saved += len(entry.body)
+            return entry.to_response()
+
+        self.misses += 1
+        if response.status != 200:
+            return response
+
+        directives = parse_cache_control(response.headers.get("Cache-Control", ""))
+        headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+        cacheable = ("ETag" in headers or "Last-Modified" in headers or
+                     (directives.get("max-age") or "0") != "0")
+        vary = tuple(sorted({name.strip().lower() for name in headers.get("Vary", "").split(",") if name.strip()}))
+        if "no-store" in directives or "*" in vary or not cacheable or len(response.body) > self.max_body_size:
+            if entry is not None:
+                self.delete(key)
+            return response
+
+        if vary != self.vary.get(base_key, ()):
+            previous = key
+            self._set_vary(base_key, vary)
+            key = self.variant_key(base_key, request_headers)
+            if previous != key:
+                self.delete(previous)
+        entry = CachedResponse(response.url, headers, response.body)
+        self._remember(key, entry)
+        self._persist(key, entry)
+        return response
+
+    def clear(self):
+        """清空缓存"""
+        self.entries.clear()
+        self.keys.clear()
+        self.vary.clear()
+        if self.db_path:
+            try:
+                with sqlite3.connect(self.db_path) as conn:
+                    conn.execute("DELETE FROM responses")
+                    conn.execute("DELETE FROM vary")
+            except Exception as e:
+                self.logger.error(f"清空HTTP缓存失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "bytes_saved": self.bytes_saved,
+            "stored": len(self.keys),
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,214 @@
+"""
+指标 - Metrics
+
+进程内的指标注册表，以 Prometheus 文本格式导出：
+- 计数器（Counter）与直方图（Histogram），均支持标签
+- 网络层：按书源/主机的请求延迟直方图、状态码计数、收发字节数
+- 缓存：按层级（内存/数据库/文件）的命中与未命中
+- 规则引擎：按规则类型的解析耗时、JavaScript 执行耗时
+- 当前书源通过上下文变量传递，书源发起的请求自动带上书源标签
+"""
+
+import math
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple, Any
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+_source_name = contextvars.ContextVar("metrics_source", default="")
+
+
+def get_source_name() -> str:
+    """当前上下文的书源名称，不在书源中时为空字符串"""
+    return _source_name.get()
+
+
+@contextmanager
+def source_scope(name: Optional[str]):
+    """在上下文中指定书源，其中记录的网络指标带上该书源标签"""
+    token = _source_name.set(name or "")
+    try:
+        yield
+    finally:
+        _source_name.reset(token)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """计数器"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+    def snapshot(self) -> Dict[str, float]:
+        with self.lock:
+            return {",".join(key): value for key, value in self.values.items()}
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """直方图（累计分桶）"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[Tuple[str, ...], _HistogramValue] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = _HistogramValue(self.buckets)
+            entry.sum += value
+            entry.count += 1
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry.counts[index] += 1
+                    break
+
+    def render(self) -> List[str]:
+        lines = []
+        with self.lock:
+            items = sorted(self.values.items())
+            for key, entry in items:
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry.counts):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {entry.count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(entry.sum)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {entry.count}")
+        return lines
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {
+                ",".join(key): {"count": entry.count, "sum": entry.sum, "avg": entry.sum / max(entry.count, 1)}
+                for key, entry in self.values.items()
+            }
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"指标已以不同的类型或标签注册: {name}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """获取或注册计数器"""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """获取或注册直方图"""
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def get_stats(self) -> Dict[str, Any]:
+        """以字典形式返回全部指标"""
+        return {name: metric.snapshot() for name, metric in sorted(self.metrics.items())}
+
+
+# 进程级默认注册表
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "book_source_http_requests_total", "上游HTTP请求数（按书源、主机、状态码；网络错误记为 error/timeout）",
+    ("source", "host", "status")
+)
+HTTP_DURATION = REGISTRY.histogram(
+    "book_source_http_request_duration_seconds", "上游HTTP请求耗时（单次尝试）", ("source", "host")
+)
+HTTP_RESPONSE_BYTES = REGISTRY.counter(
+    "book_source_http_response_bytes_total", "接收的响应体字节数", ("source", "host")
+)
+HTTP_REQUEST_BYTES = REGISTRY.counter(
+    "book_source_http_request_bytes_total", "发送的请求体字节数", ("source", "host")
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "book_source_cache_lookups_total", "缓存查询次数（按层级和命中结果）", ("tier", "result")
+)
+RULE_DURATION = REGISTRY.histogram(
+    "book_source_rule_evaluation_seconds", "规则解析耗时（按规则类型）", ("type",), buckets=FAST_BUCKETS
+)
+RULE_ERRORS = REGISTRY.counter(
+    "book_source_rule_errors_total", "规则解析失败次数（按规则类型）", ("type",)
+)
+JS_DURATION = REGISTRY.histogram(
+    "book_source_js_execution_seconds", "JavaScript 规则执行耗时", buckets=FAST_BUCKETS
+)
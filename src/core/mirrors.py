@@ -0,0 +1,167 @@
+"""
+镜像域名 - Mirror Registry
+
+很多书源在 bookSourceComment 里列出备用域名（如 "备用：https://www.23qb.net"），
+本模块负责：
+- 从书源配置中解析镜像域名
+- 按主机统计响应耗时，估计 p90 延迟
+- 为同一请求给出按历史速度排序的候选地址，供网络层对冲请求使用
+"""
+
+import re
+import math
+import logging
+from collections import deque
+from urllib.parse import urlparse, urlunparse
+from typing import Dict, List, Optional, Any
+
+
+# 注释中提到镜像的行
+MIRROR_LINE_PATTERN = re.compile(r"备用|镜像|备份|域名|mirror", re.IGNORECASE)
+URL_PATTERN = re.compile(r"https?://[\w.-]+(?::\d+)?", re.IGNORECASE)
+
+
+def extract_mirror_urls(config: Dict[str, Any]) -> List[str]:
+    """从书源配置中解析镜像站点地址（含主站）"""
+    urls = []
+    primary = config.get("bookSourceUrl", "")
+    if primary:
+        urls.append(primary)
+    urls.extend(config.get("mirrors", []))
+
+    for line in config.get("bookSourceComment", "").splitlines():
+        if MIRROR_LINE_PATTERN.search(line):
+            urls.extend(URL_PATTERN.findall(line))
+
+    hosts = []
+    result = []
+    for url in urls:
+        host = urlparse(url).netloc
+        if host and host not in hosts:
+            hosts.append(host)
+            result.append(url.rstrip("/"))
+    return result
+
+
+class _HostLatency:
+    """单主机的耗时统计"""
+
+    def __init__(self, sample_size: int):
+        self.samples = deque(maxlen=sample_size)
+        self.ewma = 0.0
+        self.failures = 0
+
+    def percentile(self, q: float) -> float:
+        """最近样本的分位数"""
+        ordered = sorted(self.samples)
+        index = min(max(math.ceil(q * len(ordered)) - 1, 0), len(ordered) - 1)
+        return ordered[index]
+
+
+class MirrorRegistry:
+    """镜像域名注册表"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.enabled = self.config.get("enabled", True)
+        self.percentile = self.config.get("percentile", 0.9)
+        self.default_delay = self.config.get("default_delay", 1.0)
+        self.min_delay = self.config.get("min_delay", 0.05)
+        self.min_samples = self.config.get("min_samples", 5)
+        self.sample_size = self.config.get("sample_size", 50)
+        self.max_hedges = self.config.get("max_hedges", 1)
+        self.smoothing = self.config.get("smoothing", 0.3)
+        self.failure_penalty = self.config.get("failure_penalty", 10.0)
+
+        self.groups: Dict[str, List[str]] = {}  # 主机 -> 同组主机（含自身）
+        self.latency: Dict[str, _HostLatency] = {}
+        self.hedged = 0
+        self.hedge_wins = 0
+
+        self.logger = logging.getLogger("mirrors")
+
+    def register(self, urls: List[str]):
+        """登记一组等价站点"""
+        hosts = []
+        for url in urls:
+            host = urlparse(url).netloc
+            if host and host not in hosts:
+                hosts.append(host)
+        if len(hosts) < 2:
+            return
+        for host in hosts:
+            # 合并已存在的分组
+            for other in self.groups.get(host, []):
+                if other not in hosts:
+                    hosts.append(other)
+        for host in hosts:
+            self.groups[host] = hosts
+        self.logger.info(f"登记镜像: {', '.join(hosts)}")
+
+    def has_mirrors(self, url: str) -> bool:
+        """该地址是否有可用镜像"""
+        return self.enabled and urlparse(url).netloc in self.groups
+
+    def _stats(self, host: str) -> _HostLatency:
+        stats = self.latency.get(host)
+        if stats is None:
+            stats = self.latency[host] = _HostLatency(self.sample_size)
+        return stats
+
+    def record(self, host: str, elapsed: float, ok: bool = True):
+        """记录一次请求耗时，失败按惩罚耗时计入排序分"""
+        stats = self._stats(host)
+        if ok:
+            stats.samples.append(elapsed)
+        else:
+            stats.failures += 1
+            elapsed = max(elapsed, self.failure_penalty)
+        if stats.ewma <= 0:
+            stats.ewma = elapsed
+        else:
+            stats.ewma += self.smoothing * (elapsed - stats.ewma)
+
+    def score(self, host: str) -> float:
+        """排序分（越小越快），没有数据的主机按默认延迟估计"""
+        stats = self.latency.get(host)
+        if stats is None or stats.ewma <= 0:
+            return self.default_delay
+        return stats.ewma
+
+    def hedge_delay(self, host: str) -> float:
+        """等待多久仍未响应时向镜像发出对冲请求（p90延迟）"""
+        stats = self.latency.get(host)
+        if stats is None or len(stats.samples) < self.min_samples:
+            return self.default_delay
+        return max(stats.percentile(self.percentile), self.min_delay)
+
+    def fastest(self, host: str) -> str:
+        """同组中历史最快的主机"""
+        group = self.groups.get(host, [host])
+        return min(group, key=lambda item: (self.score(item), item != host))
+
+    def candidates(self, url: str) -> List[str]:
+        """同一请求在各镜像上的地址，按历史速度排序，最多 max_hedges + 1 个"""
+        parsed = urlparse(url)
+        group = self.groups.get(parsed.netloc)
+        if not self.enabled or not group:
+            return [url]
+        hosts = sorted(group, key=lambda item: (self.score(item), item != parsed.netloc))
+        return [urlunparse(parsed._replace(netloc=host)) for host in hosts[:self.max_hedges + 1]]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取镜像统计"""
+        return {
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hosts": {
+                host: {
+                    "latency": stats.ewma,
+                    "p90": self.hedge_delay(host),
+                    "failures": stats.failures,
+                    "fastest": self.fastest(host) == host,
+                }
+                for host, stats in self.latency.items()
+                if host in self.groups
+            }
+        }
@@ -2,11 +2,13 @@
 网络请求管理器 - Network Manager
 
 负责处理所有HTTP请求，包括：
-- 请求重试机制
+- 请求重试机制（重试预算 + 抖动退避）
 - 反爬虫策略
-- 代理支持
+- 代理支持（代理池）
 - 请求头管理
-- 响应处理
+- 响应处理与HTTP缓存
+- 镜像站点对冲请求
+- 录制回放上游流量
 """
 
 import asyncio
@@ -15,9 +17,25 @@ import logging
 import random
 import time
 from typing import Dict, List, Optional, Any, Union
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin, urlparse, urlencode
 import json
 
+from .scheduler import RequestScheduler
+from .response import HttpResponse, ResponseTooLargeError
+from .breaker import CircuitBreakerRegistry, CircuitOpenError
+from .mirrors import MirrorRegistry
+from .retry import RetryBudget, parse_retry_after
+from .httpcache import HttpCache
+from .charset import CharsetDetector
+from .cookies import CookieStore, cookie_jar_scope, get_cookie_jar_name
+from .proxy import ProxyPool
+from .cassette import Cassette, CassetteMissError, ERROR_CLIENT, ERROR_TIMEOUT
+from .runtime import CachingResolver, build_connector, get_connector_stats
+from . import tracing
+from .metrics import (
+    HTTP_REQUESTS, HTTP_DURATION, HTTP_RESPONSE_BYTES, HTTP_REQUEST_BYTES, get_source_name, source_scope
+)
+
 
 class NetworkManager:
     """网络请求管理器"""
@@ -27,6 +45,8 @@ class NetworkManager:
         self.timeout = self.config.get("timeout", 30)
         self.retry_times = self.config.get("retry_times", 3)
         self.proxy = self.config.get("proxy")
+        self.max_content_length = self.config.get("max_content_length", 0)  # 0 表示不限制
+        self.accept_encoding = self._get_accept_encoding(self.config.get("enable_compression", True))
         
         # 用户代理池
         self.user_agents = [
@@ -39,12 +59,50 @@ class NetworkManager:
         
         # 会话管理
         self.session = None
+        self.trace_configs: List[aiohttp.TraceConfig] = []
+        self.resolver = None
         self.cookies = {}
         
+        # 代理池（配置后取代单一的 proxy）
+        self.proxy_pool = ProxyPool(self.config.get("proxy_pool", {}))
+        self._health_task = None
+        
+        # 书源独立的 Cookie Jar（enabledCookieJar），每个 Jar 一个会话，共用连接池
+        self.cookie_store = CookieStore(self.config.get("cookies", {}))
+        self.jar_sessions: Dict[str, aiohttp.ClientSession] = {}
+        self.pending_cookies: Dict[str, Dict[str, str]] = {}
+        
+        # 请求调度（优先级 + 按主机公平排队）
+        scheduler_config = {
+            "max_concurrency": self.config.get("max_connections", 100),
+            "per_host_concurrency": self.config.get("max_connections_per_host", 30),
+        }
+        scheduler_config.update(self.config.get("scheduler", {}))
+        self.scheduler = RequestScheduler(scheduler_config)
+        
+        # 按主机熔断
+        self.breakers = CircuitBreakerRegistry(self.config.get("circuit_breaker", {}))
+        
+        # 镜像站点
+        self.mirrors = MirrorRegistry(self.config.get("mirrors", {}))
+        
+        # 重试预算
+        self.retry_budget = RetryBudget(self.config.get("retry", {}))
+        
+        # HTTP条件请求缓存
+        self.http_cache = HttpCache(self.config.get("http_cache", {}))
+        
+        # 编码检测（按站点记忆）
+        self.charset = CharsetDetector(self.config.get("charset", {}))
+        
+        # 录制回放（离线压测）
+        self.cassette = Cassette(self.config.get("cassette", {}))
+        
         # 请求统计
         self.request_count = 0
         self.success_count = 0
         self.error_count = 0
+        self.oversized: Dict[str, Dict[str, int]] = {}  # 书源 -> 主机 -> 超限响应数
         
         self.logger = logging.getLogger("network")
     
@@ -59,28 +117,77 @@ class NetworkManager:
     
     async def create_session(self):
         """创建HTTP会话"""
-        connector = aiohttp.TCPConnector(
-            limit=100,
-            limit_per_host=30,
-            ttl_dns_cache=300,
-            use_dns_cache=True,
-        )
+        self.resolver = CachingResolver(self.config.get("dns_cache_ttl", 300))
+        connector = build_connector(self.config, self.resolver)
         
         timeout = aiohttp.ClientTimeout(total=self.timeout)
+        # 启用追踪时记录DNS解析、等待连接池和建立连接的耗时
+        self.trace_configs = [tracing.aiohttp_trace_config()] if tracing.get_tracer() else []
         
         self.session = aiohttp.ClientSession(
             connector=connector,
             timeout=timeout,
-            headers=self._get_default_headers()
+            headers=self._get_default_headers(),
+            trace_configs=self.trace_configs
         )
+        if self.cookies:
+            self.session.cookie_jar.update_cookies(self.cookies)
+        
+        if self.proxy_pool.enabled and self.proxy_pool.health_check_url:
+            self._health_task = asyncio.ensure_future(
+                self.proxy_pool.run_health_checks(self._probe_proxy)
+            )
         
         self.logger.info("HTTP会话创建成功")
     
+    async def _probe_proxy(self, proxy: str) -> bool:
+        """通过代理请求健康检查地址"""
+        async with self.session.get(self.proxy_pool.health_check_url, proxy=proxy) as response:
+            return response.status < 500
+    
+    def _session_for(self, jar_name: Optional[str]) -> aiohttp.ClientSession:
+        """获取 Cookie Jar 对应的会话，首次使用时从数据库加载 Cookie"""
+        if jar_name is None:
+            return self.session
+        session = self.jar_sessions.get(jar_name)
+        if session is None:
+            # 部分书源直接使用IP地址，需要允许IP主机的Cookie
+            jar = aiohttp.CookieJar(unsafe=True)
+            self.cookie_store.load(jar_name, jar)
+            if jar_name in self.pending_cookies:
+                jar.update_cookies(self.pending_cookies.pop(jar_name))
+            session = aiohttp.ClientSession(
+                connector=self.session.connector,
+                connector_owner=False,
+                timeout=self.session.timeout,
+                headers=self._get_default_headers(),
+                cookie_jar=jar,
+                trace_configs=self.trace_configs
+            )
+            self.jar_sessions[jar_name] = session
+        return session
+    
+    def bind(self, name: str, cookie_jar: bool = True) -> "SourceNetwork":
+        """返回书源的网络层视图，cookie_jar 为 True 时使用独立的 Cookie Jar"""
+        return SourceNetwork(self, name, name if cookie_jar else None)
+    
     async def close_session(self):
         """关闭HTTP会话"""
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        self.cookie_store.flush()
+        for jar_name, session in self.jar_sessions.items():
+            self.cookie_store.save(jar_name, session.cookie_jar)
+            await session.close()
+        self.jar_sessions.clear()
         if self.session:
             await self.session.close()
             self.logger.info("HTTP会话已关闭")
+        if self.resolver:
+            await self.resolver.close()
+        if self.cassette.recording:
+            self.cassette.flush()
     
     def _get_default_headers(self) -> Dict[str, str]:
         """获取默认请求头"""
@@ -88,33 +195,173 @@ class NetworkManager:
             "User-Agent": random.choice(self.user_agents),
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
             "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-            "Accept-Encoding": "gzip, deflate, br",
+            "Accept-Encoding": self.accept_encoding,
             "DNT": "1",
             "Connection": "keep-alive",
             "Upgrade-Insecure-Requests": "1",
         }
     
+    @staticmethod
+    def _get_accept_encoding(enable_compression: bool) -> str:
+        """可接受的压缩格式，只声明能解压的格式"""
+        if not enable_compression:
+            return "identity"
+        try:
+            import brotli  # noqa: F401
+            return "gzip, deflate, br"
+        except ImportError:
+            return "gzip, deflate"
+    
     def _get_random_user_agent(self) -> str:
         """获取随机用户代理"""
         return random.choice(self.user_agents)
     
     async def get(self, url: str, headers: Dict[str, str] = None, 
-                  params: Dict[str, Any] = None, **kwargs) -> aiohttp.ClientResponse:
+                  params: Dict[str, Any] = None, **kwargs) -> HttpResponse:
         """GET请求"""
         return await self._request("GET", url, headers=headers, params=params, **kwargs)
     
+    async def head(self, url: str, headers: Dict[str, str] = None, **kwargs) -> HttpResponse:
+        """HEAD请求（只取响应头，用于条件探测）"""
+        return await self._request("HEAD", url, headers=headers, **kwargs)
+    
     async def post(self, url: str, data: Any = None, json_data: Dict[str, Any] = None,
-                   headers: Dict[str, str] = None, **kwargs) -> aiohttp.ClientResponse:
+                   headers: Dict[str, str] = None, **kwargs) -> HttpResponse:
         """POST请求"""
         return await self._request("POST", url, data=data, json=json_data, headers=headers, **kwargs)
     
-    async def _request(self, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
-        """通用请求方法"""
+    async def _request(self, method: str, url: str, **kwargs) -> HttpResponse:
+        """通用请求方法
+        
+        GET请求先查HTTP缓存，新鲜的缓存直接返回，过期的带上校验值发条件请求；
+        有镜像的站点对GET请求做对冲。
+        """
+        with tracing.span("http.request", method=method, url=url) as request_span:
+            cache_key = None
+            entry = None
+            request_headers = None
+            if method == "GET" and self.http_cache.enabled and not self.http_cache.is_conditional(kwargs.get("headers")):
+                request_headers = kwargs.get("headers")
+                cache_key = self.http_cache.make_key(url, kwargs.get("params"), get_cookie_jar_name())
+                entry = self.http_cache.lookup(cache_key, request_headers)
+                if entry is not None:
+                    if entry.is_fresh():
+                        request_span.set_attribute("http_cache", "fresh")
+                        return entry.to_response()
+                    kwargs["headers"] = {**(kwargs.get("headers") or {}), **entry.validators()}
+            
+            if method == "GET" and self.mirrors.has_mirrors(url):
+                request_span.set_attribute("hedged", True)
+                response = await self._hedged_request(method, url, **kwargs)
+            else:
+                response = await self._send(method, url, **kwargs)
+            
+            if cache_key is not None:
+                response = self.http_cache.update(cache_key, entry, response, request_headers)
+            request_span.set_attribute("status", response.status)
+            return response
+    
+    async def _timed_send(self, method: str, url: str, hedge: bool = False, **kwargs) -> HttpResponse:
+        """发送请求并记录该主机的耗时"""
+        host = urlparse(url).netloc
+        start = time.monotonic()
+        try:
+            response = await self._send(method, url, hedge=hedge, **kwargs)
+        except Exception:
+            self.mirrors.record(host, time.monotonic() - start, ok=False)
+            raise
+        self.mirrors.record(host, time.monotonic() - start, ok=response.status < 400)
+        return response
+    
+    async def _hedged_request(self, method: str, url: str, **kwargs) -> HttpResponse:
+        """对冲请求
+        
+        按历史速度依次向镜像发请求：当前请求超过该主机p90延迟仍未返回、
+        或已经失败时，向下一个镜像发出同样的请求，取最先返回的正常响应，
+        其余请求取消。
+        """
+        urls = self.mirrors.candidates(url)
+        remaining = list(urls)
+        pending: Dict[asyncio.Task, str] = {}
+        fallback = None
+        last_exception = None
+        
+        def launch() -> str:
+            target = remaining.pop(0)
+            # 主站之外的请求都是对冲产生的，录制时标记出来，压测回放时不单独发出
+            task = asyncio.ensure_future(self._timed_send(method, target, hedge=target != urls[0], **dict(kwargs)))
+            pending[task] = target
+            return target
+        
+        current = launch()
+        try:
+            while pending:
+                timeout = self.mirrors.hedge_delay(urlparse(current).netloc) if remaining else None
+                done, _ = await asyncio.wait(pending, timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 超过p90延迟仍未返回，向下一个镜像对冲
+                    self.mirrors.hedged += 1
+                    self.logger.debug(f"请求较慢，向镜像对冲: {url}")
+                    current = launch()
+                    continue
+                
+                for task in done:
+                    target = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        last_exception = e
+                        continue
+                    if response.status < 400:
+                        if target != urls[0]:
+                            self.mirrors.hedge_wins += 1
+                        return response
+                    fallback = fallback or response
+                
+                # 已返回的请求都失败了，立即换下一个镜像
+                if remaining:
+                    current = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        if fallback is not None:
+            return fallback
+        raise last_exception
+    
+    @staticmethod
+    def _payload_size(kwargs: Dict[str, Any]) -> int:
+        """请求体字节数（估算表单和JSON编码后的大小）"""
+        data = kwargs.get("data")
+        if isinstance(data, (bytes, bytearray)):
+            return len(data)
+        if isinstance(data, str):
+            return len(data.encode("utf-8"))
+        if isinstance(data, dict):
+            return len(urlencode(data).encode("utf-8"))
+        if kwargs.get("json") is not None:
+            return len(json.dumps(kwargs["json"]).encode("utf-8"))
+        return 0
+    
+    def _observe(self, source: str, host: str, status: Any, started: Optional[float],
+                 sent: int, received: int = 0):
+        """记录单次尝试的指标"""
+        HTTP_REQUESTS.inc(source=source, host=host, status=status)
+        if started is not None:
+            HTTP_DURATION.observe(time.monotonic() - started, source=source, host=host)
+        if sent:
+            HTTP_REQUEST_BYTES.inc(sent, source=source, host=host)
+        if received:
+            HTTP_RESPONSE_BYTES.inc(received, source=source, host=host)
+    
+    async def _send(self, method: str, url: str, hedge: bool = False, **kwargs) -> HttpResponse:
+        """发送单个请求（含重试），hedge 表示这是向镜像对冲的请求"""
         if not self.session:
             await self.create_session()
         
         # 合并请求头
-        headers = kwargs.pop("headers", {})
+        headers = kwargs.pop("headers", None) or {}
         merged_headers = self._get_default_headers()
         merged_headers.update(headers)
         merged_headers["User-Agent"] = self._get_random_user_agent()
@@ -126,65 +373,184 @@ class NetworkManager:
         
         kwargs["headers"] = merged_headers
         
-        # 代理设置
-        if self.proxy:
-            kwargs["proxy"] = self.proxy
+        host = urlparse(url).netloc
+        source = get_source_name()
+        sent = self._payload_size(kwargs)
         
-        # 请求重试
+        # 请求重试（受按主机的重试预算限制）
         last_exception = None
+        delay = 0.0
+        attempts = 0
         for attempt in range(self.retry_times + 1):
-            try:
-                self.request_count += 1
+            retry_after = None
+            started = None
+            with tracing.span("http.attempt", host=host, attempt=attempt, source=source) as attempt_span:
+                try:
+                    self.request_count += 1
+                    attempts += 1
                 
-                # 添加随机延迟，避免请求过于频繁
-                if attempt > 0:
-                    delay = random.uniform(1, 3) * attempt
-                    await asyncio.sleep(delay)
-                    self.logger.info(f"第 {attempt + 1} 次重试请求: {url}")
+                    if attempt > 0:
+                        with tracing.span("retry.backoff", delay=delay):
+                            await asyncio.sleep(delay)
+                        self.logger.info(f"第 {attempt + 1} 次重试请求: {url}")
                 
-                async with self.session.request(method, url, **kwargs) as response:
-                    # 检查响应状态
-                    if response.status == 200:
+                    # 熔断中的主机直接失败
+                    self.breakers.before_request(host)
+                
+                    # 代理设置：启用代理池时每次尝试重新选择代理
+                    proxy = self.proxy_pool.select(host) if self.proxy_pool.enabled else self.proxy
+                    if proxy:
+                        kwargs["proxy"] = proxy
+                
+                    jar_name = get_cookie_jar_name()
+                    session = self._session_for(jar_name)
+                    wait_start = time.time_ns()
+                    async with self.scheduler.slot(host):
+                        tracing.record_span("scheduler.wait", wait_start, time.time_ns(), host=host)
+                        started = time.monotonic()
+                        interaction = self.cassette.match(method, url, kwargs) if self.cassette.replaying else None
+                        if interaction is not None:
+                            response = await self.cassette.replay(interaction)
+                        elif self.cassette.replaying and self.cassette.on_miss != "network":
+                            raise CassetteMissError(method, url)
+                        else:
+                            response = await self._fetch(session, method, url, proxy, started, attempt, kwargs, hedge)
+                    status = response.status
+                    self._observe(source, host, status, started, sent, len(response.body))
+                    attempt_span.set_attribute("status", status)
+                    attempt_span.set_attribute("bytes", len(response.body))
+                
+                    if jar_name is not None and "Set-Cookie" in response.headers:
+                        self.cookie_store.schedule_save(jar_name, session.cookie_jar)
+                
+                    if status in [403, 429] or status >= 500:
+                        self.breakers.record_failure(host)
+                    else:
+                        self.breakers.record_success(host)
+                        self.retry_budget.deposit(host)
+                
+                    # 检查响应状态（退避等待时不占用调度名额）
+                    if status == 200:
                         self.success_count += 1
                         return response
-                    elif response.status in [403, 429]:
-                        # 被限制访问，增加延迟
-                        self.logger.warning(f"请求被限制 (状态码: {response.status}): {url}")
-                        if attempt < self.retry_times:
-                            await asyncio.sleep(random.uniform(5, 10))
+                    elif status in [403, 429] or status >= 500:
+                        if status in [403, 429]:
+                            self.logger.warning(f"请求被限制 (状态码: {status}): {url}")
+                        else:
+                            self.logger.warning(f"服务器错误 (状态码: {status}): {url}")
+                        if status in [429, 503]:
+                            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                            if retry_after is not None and retry_after > self.retry_budget.max_retry_after:
+                                # 站点要求等待太久，不再重试
+                                return response
+                        if attempt < self.retry_times and self.retry_budget.withdraw(host):
+                            delay = max(self.retry_budget.next_delay(delay), retry_after or 0.0)
                             continue
-                    elif response.status >= 500:
-                        # 服务器错误，重试
-                        self.logger.warning(f"服务器错误 (状态码: {response.status}): {url}")
-                        if attempt < self.retry_times:
-                            continue
-                    
+                
                     # 其他状态码也返回响应，让调用者处理
                     return response
-                    
-            except asyncio.TimeoutError:
-                last_exception = f"请求超时: {url}"
-                self.logger.warning(last_exception)
-            except aiohttp.ClientError as e:
-                last_exception = f"网络错误: {e}"
-                self.logger.warning(last_exception)
-            except Exception as e:
-                last_exception = f"未知错误: {e}"
-                self.logger.error(last_exception)
+                
+                except (CircuitOpenError, CassetteMissError):
+                    self.error_count += 1
+                    raise
+                except ResponseTooLargeError as e:
+                    # 超限是确定性的，不重试
+                    self._observe(source, host, "too_large", started, sent)
+                    self.error_count += 1
+                    hosts = self.oversized.setdefault(source, {})
+                    hosts[host] = hosts.get(host, 0) + 1
+                    self.logger.warning(str(e))
+                    raise
+                except asyncio.TimeoutError:
+                    self._observe(source, host, "timeout", started, sent)
+                    last_exception = f"请求超时: {url}"
+                    attempt_span.set_status(last_exception)
+                    self.logger.warning(last_exception)
+                    self.breakers.record_failure(host)
+                except aiohttp.ClientError as e:
+                    self._observe(source, host, "error", started, sent)
+                    last_exception = f"网络错误: {e}"
+                    attempt_span.set_status(last_exception)
+                    self.logger.warning(last_exception)
+                    self.breakers.record_failure(host)
+                except Exception as e:
+                    self._observe(source, host, "error", started, sent)
+                    last_exception = f"未知错误: {e}"
+                    attempt_span.set_status(last_exception)
+                    self.logger.error(last_exception)
+                    self.breakers.record_failure(host)
+            
+            if attempt >= self.retry_times or not self.retry_budget.withdraw(host):
+                break
+            delay = self.retry_budget.next_delay(delay)
         
         # 所有重试都失败
         self.error_count += 1
-        raise Exception(f"请求失败，已重试 {self.retry_times} 次: {last_exception}")
+        raise Exception(f"请求失败，已重试 {attempts - 1} 次: {last_exception}")
+    
+    async def _fetch(self, session: aiohttp.ClientSession, method: str, url: str, proxy: Optional[str],
+                     started: float, attempt: int, kwargs: Dict[str, Any], hedge: bool = False) -> HttpResponse:
+        """实际发出一次请求并读完响应体，录制模式下同时写入归档"""
+        host = urlparse(url).netloc
+        proxy_ok = False
+        self.proxy_pool.acquire(proxy)
+        try:
+            async with session.request(method, url, **kwargs) as raw_response:
+                # 在释放连接和调度名额之前读完响应体
+                with tracing.span("http.download", host=host):
+                    response = await HttpResponse.from_client_response(
+                        raw_response, max_size=self.max_content_length
+                    )
+            proxy_ok = self._proxy_verdict(url, response.status)
+        except ResponseTooLargeError:
+            # 响应过大是源站的问题，与代理无关
+            proxy_ok = None
+            raise
+        except asyncio.CancelledError:
+            # 被取消（如对冲请求落败）不计入代理错误率
+            proxy_ok = None
+            raise
+        except asyncio.TimeoutError:
+            if self.cassette.recording:
+                self.cassette.record(method, url, kwargs, started, error=ERROR_TIMEOUT,
+                                     attempt=attempt, hedge=hedge)
+            raise
+        except aiohttp.ClientError:
+            if self.cassette.recording:
+                self.cassette.record(method, url, kwargs, started, error=ERROR_CLIENT,
+                                     attempt=attempt, hedge=hedge)
+            raise
+        finally:
+            self.proxy_pool.release(proxy, time.monotonic() - started, proxy_ok)
+        if self.cassette.recording:
+            self.cassette.record(method, url, kwargs, started, response=response, attempt=attempt,
+                                 hedge=hedge)
+        return response
     
-    async def get_text(self, url: str, encoding: str = "utf-8", **kwargs) -> str:
-        """获取文本内容"""
+    @staticmethod
+    def _proxy_verdict(url: str, status: int) -> Optional[bool]:
+        """按状态码判断代理是否正常，None 表示与代理无关
+
+        能拿到源站响应说明代理正常；源站自己的 403/429/5xx 不算代理的错，
+        否则一个限流或故障的站点会让所有代理都被剔除。407 是代理要求认证；
+        明文 HTTP 经代理转发时 502/504 由代理返回（HTTPS 隧道内的状态码都来自源站）。
+        """
+        if status == 407:
+            return False
+        if status in (502, 504) and url.startswith("http://"):
+            return False
+        if status < 400:
+            return True
+        return None
+    
+    async def get_text(self, url: str, encoding: str = "auto", **kwargs) -> str:
+        """获取文本内容，encoding 为 auto 时自动检测编码"""
         response = await self.get(url, **kwargs)
         try:
             content = await response.read()
-            # 尝试检测编码
             if encoding == "auto":
-                encoding = self._detect_encoding(content, response.headers)
-            return content.decode(encoding, errors="ignore")
+                return self.charset.decode(content, response.headers, urlparse(url).netloc)
+            return content.decode(encoding, errors="replace")
         finally:
             response.close()
     
@@ -204,40 +570,43 @@ class NetworkManager:
         finally:
             response.close()
     
-    def _detect_encoding(self, content: bytes, headers: Dict[str, str]) -> str:
+    def _detect_encoding(self, content: bytes, headers: Dict[str, str], host: str = "") -> str:
         """检测内容编码"""
-        # 从Content-Type头中获取编码
-        content_type = headers.get("Content-Type", "")
-        if "charset=" in content_type:
-            charset = content_type.split("charset=")[1].split(";")[0].strip()
-            return charset
-        
-        # 尝试从内容中检测编码
-        try:
-            import chardet
-            result = chardet.detect(content)
-            if result["confidence"] > 0.7:
-                return result["encoding"]
-        except ImportError:
-            pass
-        
-        # 默认使用UTF-8
-        return "utf-8"
+        return self.charset.detect(content, headers, host)
     
-    def set_cookies(self, cookies: Dict[str, str]):
-        """设置Cookie"""
+    def set_cookies(self, cookies: Dict[str, str], jar_name: Optional[str] = None):
+        """设置Cookie，jar_name 为书源独立 Cookie Jar 的名称"""
+        if jar_name is not None:
+            session = self.jar_sessions.get(jar_name)
+            if session is None:
+                self.pending_cookies.setdefault(jar_name, {}).update(cookies)
+            else:
+                session.cookie_jar.update_cookies(cookies)
+                self.cookie_store.schedule_save(jar_name, session.cookie_jar)
+            return
+        
         self.cookies.update(cookies)
         if self.session:
             for name, value in cookies.items():
                 self.session.cookie_jar.update_cookies({name: value})
     
-    def get_stats(self) -> Dict[str, int]:
+    def get_stats(self) -> Dict[str, Any]:
         """获取请求统计信息"""
         return {
             "total_requests": self.request_count,
             "successful_requests": self.success_count,
             "failed_requests": self.error_count,
-            "success_rate": self.success_count / max(self.request_count, 1) * 100
+            "success_rate": self.success_count / max(self.request_count, 1) * 100,
+            "scheduler": self.scheduler.get_stats(),
+            "circuit_breakers": self.breakers.get_stats(),
+            "mirrors": self.mirrors.get_stats(),
+            "retry": self.retry_budget.get_stats(),
+            "http_cache": self.http_cache.get_stats(),
+            "charset": self.charset.get_stats(),
+            "oversized": {source: dict(hosts) for source, hosts in self.oversized.items()},
+            "proxy_pool": self.proxy_pool.get_stats(),
+            "cassette": self.cassette.get_stats(),
+            "connector": get_connector_stats(self.session.connector if self.session else None)
         }
     
     async def test_connection(self, url: str) -> bool:
@@ -249,3 +618,48 @@ class NetworkManager:
         except Exception as e:
             self.logger.error(f"连接测试失败: {e}")
             return False
+
+
+class SourceNetwork:
+    """书源的网络层视图
+    
+    与引擎共用同一个 NetworkManager（连接池、调度、熔断、缓存），
+    请求指标带上书源标签；指定 jar_name 时请求使用书源独立的 Cookie Jar。
+    """
+    
+    def __init__(self, network: NetworkManager, source_name: str, jar_name: Optional[str] = None):
+        self.network = network
+        self.source_name = source_name
+        self.jar_name = jar_name
+    
+    def __getattr__(self, name: str):
+        return getattr(self.network, name)
+    
+    async def _call(self, method: str, *args, **kwargs):
+        with source_scope(self.source_name), cookie_jar_scope(self.jar_name):
+            return await getattr(self.network, method)(*args, **kwargs)
+    
+    async def get(self, *args, **kwargs) -> HttpResponse:
+        return await self._call("get", *args, **kwargs)
+    
+    async def head(self, *args, **kwargs) -> HttpResponse:
+        return await self._call("head", *args, **kwargs)
+    
+    async def post(self, *args, **kwargs) -> HttpResponse:
+        return await self._call("post", *args, **kwargs)
+    
+    async def get_text(self, *args, **kwargs) -> str:
+        return await self._call("get_text", *args, **kwargs)
+    
+    async def get_json(self, *args, **kwargs) -> Dict[str, Any]:
+        return await self._call("get_json", *args, **kwargs)
+    
+    async def post_json(self, *args, **kwargs) -> Dict[str, Any]:
+        return await self._call("post_json", *args, **kwargs)
+    
+    async def test_connection(self, *args, **kwargs) -> bool:
+        return await self._call("test_connection", *args, **kwargs)
+    
+    def set_cookies(self, cookies: Dict[str, str]):
+        """设置该书源的Cookie"""
+        self.network.set_cookies(cookies, self.jar_name)
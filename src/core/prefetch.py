@@ -0,0 +1,210 @@
+"""
+章节预读 - Read-ahead Prefetcher
+
+读者阅读第N章时，在后台把第N+1..N+k章预先写入缓存：
+- 章节地址来自缓存的目录
+- 预读任务低优先级运行，有前台请求时让路
+- 预读深度根据阅读速度和上游延迟自适应调整
+"""
+
+import math
+import time
+import asyncio
+import logging
+from typing import Dict, List, Any, Tuple
+from dataclasses import asdict
+
+from .engine import BaseSource, ChapterInfo, ChapterNotFoundError, ContentInfo
+from .cache import CacheManager
+from .scheduler import Priority, request_priority
+
+
+class _ReadingState:
+    """单本书的阅读状态"""
+
+    def __init__(self):
+        self.last_index = -1
+        self.last_read = 0.0
+        self.read_interval = 0.0  # 每章阅读耗时的EWMA（秒）
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.fetching = set()
+
+
+class ReadAheadPrefetcher:
+    """章节预读器"""
+
+    def __init__(self, cache: CacheManager, config: Dict[str, Any] = None):
+        self.cache = cache
+        self.config = config or {}
+        self.min_depth = self.config.get("min_depth", 1)
+        self.max_depth = self.config.get("max_depth", 10)
+        self.concurrency = self.config.get("concurrency", 2)
+        self.expire_time = self.config.get("expire_time", 3600)
+        self.smoothing = self.config.get("smoothing", 0.3)
+
+        self.states: Dict[Tuple[str, str], _ReadingState] = {}
+        self.latency = 0.0  # 上游抓取耗时的EWMA（秒）
+        self.semaphore = asyncio.Semaphore(max(self.concurrency, 1))
+        self.foreground = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+        self.logger = logging.getLogger("prefetch")
+
+    def _ewma(self, current: float, sample: float) -> float:
+        """指数加权移动平均"""
+        if current <= 0:
+            return sample
+        return current + self.smoothing * (sample - current)
+
+    def _content_key(self, source: BaseSource, chapter_url: str) -> str:
+        """正文缓存键"""
+        return f"content:{source.name}:{chapter_url}"
+
+    def _toc_key(self, source: BaseSource, toc_url: str) -> str:
+        """目录缓存键"""
+        return f"toc:{source.name}:{toc_url}"
+
+    async def get_toc(self, source: BaseSource, toc_url: str) -> List[ChapterInfo]:
+        """获取目录（优先使用缓存）"""
+        key = self._toc_key(source, toc_url)
+        cached = self.cache.get(key)
+        if cached:
+            return [ChapterInfo(**chapter) for chapter in cached]
+
+        chapters = await source.get_toc(toc_url)
+        if chapters:
+            self.cache.set(key, [asdict(chapter) for chapter in chapters], self.expire_time)
+        return chapters
+
+    def get_depth(self, state: _ReadingState) -> int:
+        """根据阅读速度和上游延迟计算预读深度
+
+        读者在一次抓取耗时内能读完 latency / read_interval 章，预读需要领先这么多章，
+        再留一倍余量。
+        """
+        if state.read_interval <= 0 or self.latency <= 0:
+            return self.min_depth
+        depth = self.min_depth + math.ceil(2 * self.latency / state.read_interval)
+        return max(self.min_depth, min(self.max_depth, depth))
+
+    async def _fetch(self, source: BaseSource, chapter_url: str) -> ContentInfo:
+        """抓取章节并写入缓存"""
+        start = time.monotonic()
+        content = await source.get_full_content(chapter_url)
+        self.latency = self._ewma(self.latency, time.monotonic() - start)
+        if content.content:
+            self.cache.set(self._content_key(source, chapter_url), asdict(content), self.expire_time)
+        return content
+
+    async def _prefetch(self, source: BaseSource, state: _ReadingState,
+                        index: int, chapter: ChapterInfo):
+        """后台预读单章，前台有请求时等待"""
+        async with self.semaphore:
+            await self.idle.wait()
+            if self.cache.get(self._content_key(source, chapter.url)) is not None:
+                return
+            state.fetching.add(index)
+            try:
+                with request_priority(Priority.PREFETCH):
+                    await self._fetch(source, chapter.url)
+                self.prefetched += 1
+            except Exception as e:
+                self.logger.debug(f"预读失败: {chapter.name}, {e}")
+            finally:
+                state.fetching.discard(index)
+
+    def _schedule(self, source: BaseSource, state: _ReadingState,
+                  chapters: List[ChapterInfo], index: int):
+        """调度预读任务，取消已不在预读窗口内的任务"""
+        depth = self.get_depth(state)
+        window = range(index + 1, min(index + 1 + depth, len(chapters)))
+
+        for task_index in list(state.tasks):
+            task = state.tasks[task_index]
+            if task.done():
+                del state.tasks[task_index]
+            elif task_index not in window:
+                task.cancel()
+                del state.tasks[task_index]
+
+        for task_index in window:
+            if task_index in state.tasks:
+                continue
+            chapter = chapters[task_index]
+            if self.cache.get(self._content_key(source, chapter.url)) is not None:
+                continue
+            state.tasks[task_index] = asyncio.ensure_future(
+                self._prefetch(source, state, task_index, chapter)
+            )
+
+    async def get_content(self, source: BaseSource, toc_url: str, index: int) -> ContentInfo:
+        """读取第 index 章，并触发后续章节预读"""
+        chapters = await self.get_toc(source, toc_url)
+        if not 0 <= index < len(chapters):
+            raise ChapterNotFoundError(f"章节序号超出范围: {index}")
+
+        state = self.states.setdefault((source.name, toc_url), _ReadingState())
+        now = time.monotonic()
+        if index == state.last_index + 1 and state.last_read:
+            state.read_interval = self._ewma(state.read_interval, now - state.last_read)
+        elif index != state.last_index:
+            # 跳读时重新估计阅读速度
+            state.read_interval = 0.0
+        state.last_index = index
+        state.last_read = now
+
+        chapter = chapters[index]
+        cached = self.cache.get(self._content_key(source, chapter.url))
+        if cached is not None:
+            self.hits += 1
+            content = ContentInfo(**cached)
+        else:
+            self.misses += 1
+            task = state.tasks.pop(index, None)
+            if task is not None and index in state.fetching:
+                # 该章正在预读，直接等待结果
+                await asyncio.shield(task)
+                cached = self.cache.get(self._content_key(source, chapter.url))
+            elif task is not None:
+                task.cancel()
+
+            if cached is not None:
+                content = ContentInfo(**cached)
+            else:
+                self.foreground += 1
+                self.idle.clear()
+                try:
+                    content = await self._fetch(source, chapter.url)
+                finally:
+                    self.foreground -= 1
+                    if self.foreground == 0:
+                        self.idle.set()
+
+        self._schedule(source, state, chapters, index)
+        return content
+
+    async def close(self):
+        """取消所有预读任务"""
+        tasks = [task for state in self.states.values() for task in state.tasks.values()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.states.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取预读统计信息"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / max(total, 1) * 100,
+            "prefetched": self.prefetched,
+            "latency": self.latency,
+            "active_tasks": sum(len(state.tasks) for state in self.states.values())
+        }
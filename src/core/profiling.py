@@ -0,0 +1,146 @@
+"""
+性能剖析 - Profiling
+
+针对单次运行（一次搜索、一次下载或一个API请求）开启性能剖析，结果保存到 debug.debug_dir：
+- cprofile：确定性剖析，保存 pstats 文件，可用 pstats / snakeviz 查看
+- sampling：后台线程按固定间隔采样目标线程的调用栈，开销低，
+  保存为火焰图工具（flamegraph.pl / speedscope）可直接读取的折叠栈格式
+- 同一时间只允许一个剖析，避免 cProfile 互相覆盖
+- 剖析的是事件循环所在线程，同一时间段内并发执行的其他任务也会计入
+"""
+
+import os
+import re
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+
+MODES = ("cprofile", "sampling")
+
+_active_lock = threading.Lock()
+
+
+class Profiler:
+    """单次运行的性能剖析器"""
+
+    def __init__(self, mode: Optional[str] = None, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.mode = mode or self.config.get("profile_mode", "sampling")
+        if self.mode not in MODES:
+            raise ValueError(f"未知的性能剖析模式: {self.mode}")
+        self.output_dir = os.path.join(self.config.get("debug_dir", "data/debug"), "profiles")
+        self.interval = self.config.get("sample_interval", 0.005)
+
+        self.name = ""
+        self.path = ""
+        self.started = 0.0
+        self.elapsed = 0.0
+        self.samples = 0
+        self.stacks: Dict[str, int] = {}
+
+        self._profile: Optional[cProfile.Profile] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target = 0
+        self._active = False
+
+        self.logger = logging.getLogger("profiling")
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    def start(self, name: str = "run") -> bool:
+        """开始剖析当前线程，已有其他剖析进行中时返回False"""
+        if not _active_lock.acquire(blocking=False):
+            self.logger.warning(f"已有正在进行的性能剖析，跳过: {name}")
+            return False
+        self._active = True
+
+        safe_name = re.sub(r"[^\w.-]+", "_", name).strip("_") or "run"
+        suffix = "pstats" if self.mode == "cprofile" else "folded"
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self.name = f"{stamp}-{safe_name}-{os.getpid()}.{suffix}"
+        self.path = os.path.join(self.output_dir, self.name)
+        self.started = time.perf_counter()
+
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._target = threading.get_ident()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self) -> str:
+        """结束剖析并写出结果，返回文件路径"""
+        if not self._active:
+            return ""
+        try:
+            if self.mode == "cprofile":
+                self._profile.disable()
+            else:
+                self._stop.set()
+                self._thread.join()
+            self.elapsed = time.perf_counter() - self.started
+
+            os.makedirs(self.output_dir, exist_ok=True)
+            if self.mode == "cprofile":
+                self._profile.dump_stats(self.path)
+            else:
+                with open(self.path, "w", encoding="utf-8") as f:
+                    for stack, count in sorted(self.stacks.items()):
+                        f.write(f"{stack} {count}\n")
+            self.logger.info(f"性能剖析已保存: {self.path} ({self.elapsed:.3f} 秒)")
+            return self.path
+        finally:
+            self._active = False
+            _active_lock.release()
+
+    def _sample_loop(self):
+        """采样线程：按间隔记录目标线程的调用栈"""
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = getattr(code, "co_qualname", code.co_name)
+                stack.append(f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def top(self, limit: int = 20) -> List[Tuple[str, float]]:
+        """耗时最多的函数：cprofile 为累计秒数，sampling 为出现在栈中的采样占比"""
+        if self.mode == "cprofile":
+            if self._profile is None:
+                return []
+            stats = pstats.Stats(self._profile).stats
+            ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+            return [(f"{func[2]} ({os.path.basename(func[0])}:{func[1]})", value[3]) for func, value in ranked]
+
+        totals: Dict[str, int] = {}
+        for stack, count in self.stacks.items():
+            for frame in set(stack.split(";")):
+                totals[frame] = totals.get(frame, 0) + count
+        ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(frame, count / max(self.samples, 1)) for frame, count in ranked]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
@@ -0,0 +1,191 @@
+"""
+代理池 - Proxy Pool
+
+高并发抓取时把请求分摊到多个出口IP：
+- 按代理统计延迟和错误率的EWMA，综合打分
+- 两次随机选择（power of two choices）挑选代理，负载随代理数量线性扩展
+- 同一站点固定使用同一代理（粘性），适合绑定Cookie的站点
+- 错误率过高的代理自动剔除，剔除时间按次数翻倍，到期后重新参与
+- 后台健康检查探测全部代理，探测成功的被剔除代理提前恢复
+"""
+
+import time
+import random
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Awaitable, Any
+
+
+class ProxyState:
+    """单个代理的统计"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latency = 0.0  # 延迟EWMA（秒）
+        self.error_rate = 0.0  # 错误率EWMA
+        self.requests = 0
+        self.failures = 0
+        self.active = 0
+        self.ejected_until = 0.0
+        self.eject_count = 0
+
+    def is_ejected(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return self.ejected_until > now
+
+
+class ProxyPool:
+    """代理池"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.smoothing = self.config.get("smoothing", 0.3)
+        self.max_error_rate = self.config.get("max_error_rate", 0.5)
+        self.min_requests = self.config.get("min_requests", 5)
+        self.eject_time = self.config.get("eject_time", 60)
+        self.max_eject_time = self.config.get("max_eject_time", 900)
+        self.affinity = self.config.get("affinity", True)
+        self.health_check_url = self.config.get("health_check_url", "")
+        self.health_check_interval = self.config.get("health_check_interval", 60)
+        self.health_check_timeout = self.config.get("health_check_timeout", 10)
+
+        self.proxies: Dict[str, ProxyState] = {
+            url: ProxyState(url) for url in self.config.get("proxies", [])
+        }
+        self.enabled = self.config.get("enabled", True) and bool(self.proxies)
+        self.host_affinity: Dict[str, str] = {}
+
+        self.logger = logging.getLogger("proxy")
+
+    def _ewma(self, current: float, sample: float, first: bool) -> float:
+        if first:
+            return sample
+        return current + self.smoothing * (sample - current)
+
+    def score(self, state: ProxyState) -> float:
+        """代理得分（越小越好）：延迟按错误率和当前负载放大，未用过的代理优先试用"""
+        if not state.latency:
+            return 0.0 if not state.failures else 4 * state.error_rate
+        return state.latency * (1 + 4 * state.error_rate) * (1 + state.active)
+
+    def healthy(self) -> List[ProxyState]:
+        """未被剔除的代理"""
+        now = time.monotonic()
+        return [state for state in self.proxies.values() if not state.is_ejected(now)]
+
+    def select(self, host: str = "") -> Optional[str]:
+        """为请求选择代理"""
+        if not self.enabled:
+            return None
+
+        if self.affinity and host in self.host_affinity:
+            state = self.proxies.get(self.host_affinity[host])
+            if state is not None and not state.is_ejected():
+                return state.url
+
+        candidates = self.healthy()
+        if not candidates:
+            # 全部被剔除时用最早恢复的代理，而不是直连暴露本机IP
+            state = min(self.proxies.values(), key=lambda item: item.ejected_until)
+        elif len(candidates) == 1:
+            state = candidates[0]
+        else:
+            first, second = random.sample(candidates, 2)
+            state = first if self.score(first) <= self.score(second) else second
+
+        if self.affinity and host:
+            self.host_affinity[host] = state.url
+        return state.url
+
+    def acquire(self, proxy: Optional[str]):
+        """请求开始"""
+        state = self.proxies.get(proxy)
+        if state is not None:
+            state.active += 1
+
+    def release(self, proxy: Optional[str], latency: float, ok: Optional[bool]):
+        """请求结束，记录结果；ok 为 None 时只归还负载不计入统计"""
+        state = self.proxies.get(proxy)
+        if state is None:
+            return
+        state.active = max(state.active - 1, 0)
+        if ok is not None:
+            self.record(proxy, latency, ok)
+
+    def record(self, proxy: str, latency: float, ok: bool):
+        """记录一次请求结果"""
+        state = self.proxies.get(proxy)
+        if state is None:
+            return
+        first = state.requests == 0
+        state.requests += 1
+        if ok:
+            state.latency = self._ewma(state.latency, latency, first)
+        else:
+            state.failures += 1
+        state.error_rate = self._ewma(state.error_rate, 0.0 if ok else 1.0, first)
+
+        if (not ok and state.requests >= self.min_requests and
+                state.error_rate > self.max_error_rate and not state.is_ejected()):
+            self.eject(proxy)
+
+    def eject(self, proxy: str):
+        """剔除代理"""
+        state = self.proxies[proxy]
+        state.eject_count += 1
+        duration = min(self.eject_time * (2 ** (state.eject_count - 1)), self.max_eject_time)
+        state.ejected_until = time.monotonic() + duration
+        # 恢复后从中等错误率重新开始，给它再次证明自己的机会
+        state.error_rate = self.max_error_rate / 2
+        for host in [host for host, url in self.host_affinity.items() if url == proxy]:
+            del self.host_affinity[host]
+        self.logger.warning(f"剔除代理: {proxy}，{duration:.0f} 秒后恢复")
+
+    def reinstate(self, proxy: str):
+        """恢复代理"""
+        state = self.proxies[proxy]
+        if state.is_ejected():
+            state.ejected_until = 0.0
+            self.logger.info(f"代理恢复: {proxy}")
+
+    async def health_check(self, probe: Callable[[str], Awaitable[bool]]):
+        """探测全部代理，probe 返回代理是否可用"""
+        async def check(state: ProxyState):
+            start = time.monotonic()
+            try:
+                ok = await asyncio.wait_for(probe(state.url), self.health_check_timeout)
+            except Exception:
+                ok = False
+            latency = time.monotonic() - start
+            if ok and state.is_ejected():
+                self.reinstate(state.url)
+                state.eject_count = max(state.eject_count - 1, 0)
+            if ok or not state.is_ejected():
+                self.record(state.url, latency, ok)
+
+        await asyncio.gather(*(check(state) for state in self.proxies.values()))
+
+    async def run_health_checks(self, probe: Callable[[str], Awaitable[bool]]):
+        """周期性健康检查，直到任务被取消"""
+        while True:
+            await self.health_check(probe)
+            await asyncio.sleep(self.health_check_interval)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取代理池统计"""
+        now = time.monotonic()
+        return {
+            "total": len(self.proxies),
+            "healthy": len(self.healthy()),
+            "proxies": {
+                url: {
+                    "latency": state.latency,
+                    "error_rate": state.error_rate,
+                    "requests": state.requests,
+                    "failures": state.failures,
+                    "active": state.active,
+                    "ejected_for": max(state.ejected_until - now, 0.0),
+                }
+                for url, state in self.proxies.items()
+            },
+        }
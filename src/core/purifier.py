@@ -0,0 +1,273 @@
+"""
+正文净化 - Content Purifier
+
+按书源的 ruleContent.replaceRegex 去除正文中的广告和水印，一章只扫描一遍：
+- replaceRegex 可写多行，每行一条 ##正则##替换 规则（末尾 ### 表示只替换第一处），另可在配置中追加全局规则
+- 可合并的规则拆成顶层分支后合并为一个交替模式：纯文本分支按长度降序放在一起，带替换文本的规则用命名分组区分
+- 含反向引用、分组引用、全局内联标志或只替换第一处的规则无法合并，按原顺序单独执行
+- 所有分支都以固定文本开头时，先用字符串查找预筛，正文里一个都没出现就跳过正则
+- 正则通过 REGEX_GUARD 执行，带超时；合并后的模式被停用时退回逐条执行，只停用出问题的那一条
+"""
+
+import re
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .regexguard import REGEX_GUARD, RegexGuard, sre_parse, sre_constants
+
+
+@dataclass
+class ReplaceRule:
+    """一条替换规则"""
+    pattern: str
+    replacement: str = ""
+    first_only: bool = False
+
+
+def parse_replace_rules(value: Union[str, List[str], None]) -> List[ReplaceRule]:
+    """解析 replaceRegex：每行（或列表中每项）一条 ##正则##替换 规则"""
+    if not value:
+        return []
+    lines = value if isinstance(value, list) else str(value).splitlines()
+    rules = []
+    for line in lines:
+        line = str(line).strip()
+        if line.startswith("##"):
+            line = line[2:]
+        if not line:
+            continue
+        first_only = line.endswith("###")
+        if first_only:
+            line = line[:-3]
+        pattern, _, replacement = line.partition("##")
+        if pattern:
+            rules.append(ReplaceRule(pattern, replacement, first_only))
+    return rules
+
+
+def split_alternatives(pattern: str) -> List[str]:
+    """按顶层的 | 拆分模式（跳过转义、字符类和分组内部的 |）"""
+    parts, depth, in_class, start, i = [], 0, False, 0, 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            i += 2
+            continue
+        if in_class:
+            if char == "]":
+                in_class = False
+        elif char == "[":
+            in_class = True
+            if pattern[i + 1:i + 2] == "]":
+                i += 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            parts.append(pattern[start:i])
+            start = i + 1
+        i += 1
+    parts.append(pattern[start:])
+    return parts
+
+
+def _parse(pattern: str) -> Optional[List[Any]]:
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return None
+    return list(parsed.data if hasattr(parsed, "data") else parsed)
+
+
+def literal_text(pattern: str) -> Optional[str]:
+    """模式只匹配固定文本时返回该文本"""
+    items = _parse(pattern)
+    if not items or any(op != sre_constants.LITERAL for op, _ in items):
+        return None
+    return "".join(chr(av) for _, av in items)
+
+
+def literal_prefix(pattern: str) -> str:
+    """模式每次匹配都必须以之开头的固定文本，没有时为空字符串"""
+    items = _parse(pattern) or []
+    prefix = []
+    for op, av in items:
+        if op != sre_constants.LITERAL:
+            break
+        prefix.append(chr(av))
+    return "".join(prefix)
+
+
+_GLOBAL_FLAGS = re.compile(r"^\(\?[aiLmsux]+\)")
+_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+_JAVA_GROUP = re.compile(r"\$(\d+)")
+
+
+def _mergeable(rule: ReplaceRule) -> bool:
+    """能否并入合并模式（替换文本按字面处理，模式不依赖分组编号和全局标志）"""
+    return not (
+        rule.first_only
+        or "\\" in rule.replacement
+        or "$" in rule.replacement
+        or _GLOBAL_FLAGS.match(rule.pattern)
+        or _BACKREFERENCE.search(rule.pattern)
+    )
+
+
+def _python_replacement(replacement: str) -> str:
+    """把 legado 的 $1 分组引用转换为 Python 的 \\g<1>"""
+    return _JAVA_GROUP.sub(r"\\g<\1>", replacement)
+
+
+@dataclass
+class PurifyPass:
+    """一次扫描：合并模式或单条规则"""
+    pattern: str
+    replacement: Union[str, Callable[[Any], str]]
+    count: int = 0                    # 0 表示替换全部
+    merged: int = 1                   # 合并的规则条数
+    prefilter: Tuple[str, ...] = ()   # 非空时正文须包含其中之一才执行
+    rules: Tuple[ReplaceRule, ...] = ()  # 本次扫描包含的规则，合并模式停用时据此拆回逐条执行
+
+
+class ContentPurifier:
+    """书源正文净化器"""
+
+    GROUP_PREFIX = "_purify"
+
+    def __init__(self, rules: Union[str, List[str], None] = None, config: Dict[str, Any] = None,
+                 guard: Optional[RegexGuard] = None):
+        self.source_rules = parse_replace_rules(rules)
+        self.guard = guard or REGEX_GUARD
+        self.stats = {"chapters": 0, "prefiltered": 0, "passes": 0, "elapsed": 0.0, "fallbacks": 0}
+        self.logger = logging.getLogger("purifier")
+        self.configure(config)
+
+    def configure(self, config: Dict[str, Any] = None):
+        """按 rules 配置设置开关和全局规则，并重新合并"""
+        self.config = config or {}
+        self.enabled = self.config.get("purify_content", True)
+        self.merge = self.config.get("purify_merge", True)
+        self.rules = self.source_rules + parse_replace_rules(self.config.get("purify_patterns", []))
+        self.passes = self._build(self.merge)
+
+    def _build(self, merge: bool) -> List[PurifyPass]:
+        """把规则编排为扫描列表：相邻的可合并规则并成一次扫描"""
+        passes: List[PurifyPass] = []
+        batch: List[ReplaceRule] = []
+        for rule in self.rules:
+            if merge and _mergeable(rule):
+                batch.append(rule)
+                continue
+            if batch:
+                passes.extend(self._merge(batch))
+                batch = []
+            passes.append(self._single(rule))
+        if batch:
+            passes.extend(self._merge(batch))
+        return passes
+
+    def _single(self, rule: ReplaceRule) -> PurifyPass:
+        """单条规则的扫描，带全局内联标志（可能忽略大小写）的规则不预筛"""
+        prefilter = () if _GLOBAL_FLAGS.match(rule.pattern) else self._prefilter(split_alternatives(rule.pattern))
+        return PurifyPass(rule.pattern, _python_replacement(rule.replacement),
+                          count=1 if rule.first_only else 0, prefilter=prefilter, rules=(rule,))
+
+    def _merge(self, rules: List[ReplaceRule]) -> List[PurifyPass]:
+        """合并一批规则，合并后的模式无法使用时逐条执行"""
+        if len(rules) == 1:
+            return [self._single(rules[0])]
+
+        kept: List[ReplaceRule] = []
+        fragments: List[str] = []
+        literals: List[str] = []
+        patterns: List[str] = []  # 非纯文本的分支，用于预筛
+        replacements: Dict[str, str] = {}
+        for rule in rules:
+            if self.guard.compile(rule.pattern) is None:
+                continue  # 单条就不可用（无法编译或已停用），不拖累其他规则
+            kept.append(rule)
+            if rule.replacement:
+                name = f"{self.GROUP_PREFIX}{len(replacements)}"
+                replacements[name] = rule.replacement
+                fragments.append(f"(?P<{name}>{rule.pattern})")
+                patterns.extend(split_alternatives(rule.pattern))
+                continue
+            for branch in split_alternatives(rule.pattern):
+                text = literal_text(branch)
+                if text is not None:
+                    literals.append(text)
+                else:
+                    fragments.append(f"(?:{branch})")
+                    patterns.append(branch)
+
+        literals = sorted(set(literals), key=len, reverse=True)
+        branches = fragments + [re.escape(text) for text in literals]
+        if not branches:
+            return []
+        pattern = "|".join(branches)
+        if self.guard.compile(pattern) is None:
+            self.logger.warning(f"净化规则无法合并，改为逐条执行: {pattern[:100]}")
+            return [self._single(rule) for rule in kept]
+
+        replacement: Union[str, Callable[[Any], str]] = ""
+        if replacements:
+            # 命名分组在外层，最后闭合，lastgroup 即为命中的规则
+            replacement = lambda match: replacements.get(match.lastgroup, "")
+        prefixes = self._prefilter(patterns)
+        prefilter = prefixes + tuple(literals) if prefixes or not patterns else ()
+        return [PurifyPass(pattern, replacement, merged=len(kept), prefilter=prefilter, rules=tuple(kept))]
+
+    @staticmethod
+    def _prefilter(branches: List[str]) -> Tuple[str, ...]:
+        """每个分支的固定开头，任一分支没有固定开头时不预筛"""
+        prefixes = []
+        for branch in branches:
+            prefix = literal_prefix(branch)
+            if not prefix:
+                return ()
+            prefixes.append(prefix)
+        return tuple(prefixes)
+
+    def purify(self, text: str) -> str:
+        """净化一章正文"""
+        if not self.enabled or not text or not self.passes:
+            return text
+        started = time.perf_counter()
+        self.stats["chapters"] += 1
+        text = self._apply(text)
+        self.stats["elapsed"] += time.perf_counter() - started
+        return text
+
+    def _apply(self, text: str) -> str:
+        index = 0
+        while index < len(self.passes):
+            item = self.passes[index]
+            if item.prefilter and not any(prefix in text for prefix in item.prefilter):
+                self.stats["prefiltered"] += 1
+                index += 1
+                continue
+            self.stats["passes"] += 1
+            text = self.guard.sub(item.pattern, item.replacement, text, item.count)
+            if item.merged > 1 and item.pattern in self.guard.disabled:
+                # 合并模式超时被停用：只把这一次扫描拆回逐条执行并从拆出的第一条继续，
+                # 前面已执行的扫描不再重复；之后只有出问题的那条会被停用
+                self.stats["fallbacks"] += 1
+                self.logger.warning("合并的净化规则已停用，改为逐条执行")
+                singles = [self._single(rule) for rule in item.rules]
+                self.passes = self.passes[:index] + singles + self.passes[index + 1:]
+                continue
+            index += 1
+        return text
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "rules": len(self.rules),
+            "scans": len(self.passes),
+        }
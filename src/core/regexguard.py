@@ -0,0 +1,334 @@
+"""
+正则防护 - Regex Guard
+
+书源规则里的正则表达式来自用户，直接在整章正文上执行可能因灾难性回溯长时间占满CPU：
+- 编译结果按模式缓存，同一模式只编译一次
+- 静态检查常见的 ReDoS 结构：嵌套的无界量词、量词作用于相互重叠的分支、相邻的 .*
+- 用 regex 模块执行，每次匹配带超时；超时的模式自动停用，之后直接跳过
+- 标准库 re 无法中断执行中的匹配，因此 regex 是必需依赖
+"""
+
+import re
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import regex
+
+from .metrics import REGISTRY, get_source_name
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+
+REGEX_TIMEOUTS = REGISTRY.counter(
+    "book_source_regex_timeouts_total", "正则规则执行超时次数（按书源）", ("source",)
+)
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+_UNBOUNDED = sre_constants.MAXREPEAT
+
+
+def _is_unbounded_repeat(op, av) -> bool:
+    return op in _REPEATS and av[1] == _UNBOUNDED
+
+
+def _subpatterns(op, av) -> List[Any]:
+    """节点包含的子模式"""
+    if op in _REPEATS:
+        return [av[2]]
+    if op == sre_constants.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_constants.BRANCH:
+        return list(av[1])
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [av[1]]
+    return []
+
+
+_SINGLE = (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY,
+           sre_constants.IN, sre_constants.CATEGORY)
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: re.compile(r"\d"),
+    sre_constants.CATEGORY_NOT_DIGIT: re.compile(r"\D"),
+    sre_constants.CATEGORY_SPACE: re.compile(r"\s"),
+    sre_constants.CATEGORY_NOT_SPACE: re.compile(r"\S"),
+    sre_constants.CATEGORY_WORD: re.compile(r"\w"),
+    sre_constants.CATEGORY_NOT_WORD: re.compile(r"\W"),
+}
+# 判断两个字符集是否相交时额外试探的字符（不换行空格、全角空格、中文和中文标点）
+_PROBES = "\xa0\u3000中。"
+
+
+def _variants(char: str) -> set:
+    """字符及其大小写形式（忽略大小写的模式里它们互相匹配）"""
+    return {char, char.lower(), char.upper()}
+
+
+def _matches(op, av, char: str) -> bool:
+    """单字符元素能否匹配 char，无法判断时按能匹配处理"""
+    if op == sre_constants.LITERAL:
+        return chr(av) in _variants(char)
+    if op == sre_constants.NOT_LITERAL:
+        return chr(av) != char
+    if op == sre_constants.CATEGORY:
+        category = _CATEGORIES.get(av)
+        return category is None or bool(category.match(char))
+    if op == sre_constants.RANGE:
+        return any(av[0] <= ord(variant) <= av[1] for variant in _variants(char))
+    if op == sre_constants.IN:
+        negate = bool(av) and av[0][0] == sre_constants.NEGATE
+        items = av[1:] if negate else av
+        return any(_matches(item_op, item_av, char) for item_op, item_av in items) != negate
+    return True
+
+
+def _chars(op, av) -> str:
+    """单字符元素里出现的字符，用于试探"""
+    if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL):
+        return chr(av)
+    if op == sre_constants.RANGE:
+        return chr(av[0]) + chr(av[1])
+    if op == sre_constants.IN:
+        return "".join(_chars(item_op, item_av) for item_op, item_av in av)
+    return ""
+
+
+def _overlaps(left, right) -> bool:
+    """两个单字符元素是否可能匹配同一个字符"""
+    probes = set(map(chr, range(128))) | set(_PROBES) | set(_chars(*left)) | set(_chars(*right))
+    return any(_matches(*left, char) and _matches(*right, char) for char in probes)
+
+
+def _first_items(pattern) -> List[Any]:
+    """分支可能匹配的第一个字符的元素（用于判断分支是否重叠），跳过锚点和可省略的元素"""
+    items = []
+    for op, av in pattern:
+        if op == sre_constants.AT:
+            continue
+        if op == sre_constants.SUBPATTERN:
+            return items + _first_items(av[-1])
+        if op == sre_constants.BRANCH:
+            return items + [item for branch in av[1] for item in _first_items(branch)]
+        if op in _REPEATS:
+            items.extend(_first_items(av[2]))
+            if av[0] == 0:
+                continue
+            return items
+        # 其他结构（反向引用、断言等）无法判断，按能匹配任意字符处理
+        return items + [(op, av) if op in _SINGLE else (sre_constants.ANY, None)]
+    return items
+
+
+def _single_items(pattern) -> List[Any]:
+    """模式中出现的全部单字符元素"""
+    items = []
+    for op, av in pattern:
+        if op in _SINGLE:
+            items.append((op, av))
+        elif op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            items.append((sre_constants.ANY, None))
+        for sub in _subpatterns(op, av):
+            items.extend(_single_items(sub))
+    return items
+
+
+def _repeated_items(pattern) -> List[Any]:
+    """无界量词所重复的单字符元素"""
+    items = []
+    for op, av in pattern:
+        if _is_unbounded_repeat(op, av):
+            items.extend(_single_items(av[2]))
+        else:
+            for sub in _subpatterns(op, av):
+                items.extend(_repeated_items(sub))
+    return items
+
+
+def _is_ambiguous_nesting(sequence) -> bool:
+    r"""外层量词的一次重复里含有无界量词，且没有内层量词吞不下的必需字符把各次重复隔开
+
+    如 (\w+\s?)+ 中的 \w+ 可以按任意方式拆给外层的各次重复；
+    <br\s*/?> 中的 < 不会被 \s* 匹配，每次重复的边界是确定的。
+    """
+    repeated = _repeated_items(sequence)
+    if not repeated:
+        return False
+    separators = [(op, av) for op, av in sequence if op in _SINGLE]
+    return not any(
+        not any(_overlaps(separator, item) for item in repeated)
+        for separator in separators
+    )
+
+
+def _sequences(pattern) -> List[Any]:
+    """外层量词作用的各个分支（没有分支时为模式本身）"""
+    items = list(pattern)
+    if len(items) == 1 and items[0][0] == sre_constants.SUBPATTERN:
+        return _sequences(items[0][1][-1])
+    if len(items) == 1 and items[0][0] == sre_constants.BRANCH:
+        return list(items[0][1][1])
+    return [items]
+
+
+def _has_empty_branch(pattern) -> bool:
+    """含有可为空的分支（解析器会把 (a|aa) 提取公共前缀为 a(?:|a)）"""
+    for op, av in pattern:
+        if op == sre_constants.BRANCH and any(not list(branch) for branch in av[1]):
+            return True
+        if op != sre_constants.BRANCH and any(_has_empty_branch(sub) for sub in _subpatterns(op, av)):
+            return True
+    return False
+
+
+def _is_dot_star(op, av) -> bool:
+    return _is_unbounded_repeat(op, av) and [item[0] for item in av[2]] == [sre_constants.ANY]
+
+
+def _find_unsafe(pattern) -> Optional[str]:
+    previous = None
+    for op, av in pattern:
+        if _is_unbounded_repeat(op, av):
+            body = av[2]
+            branches = _sequences(body)
+            if any(_is_ambiguous_nesting(branch) for branch in branches):
+                return "嵌套的无界量词"
+            if _has_empty_branch(body):
+                return "量词作用于相互重叠的分支"
+            if len(branches) > 1:
+                firsts = [_first_items(branch) for branch in branches]
+                for index, items in enumerate(firsts):
+                    for other in firsts[index + 1:]:
+                        if any(_overlaps(a, b) for a in items for b in other):
+                            return "量词作用于相互重叠的分支"
+            if previous is not None and _is_dot_star(op, av) and _is_dot_star(*previous):
+                return "相邻的 .* 重复"
+        for sub in _subpatterns(op, av):
+            reason = _find_unsafe(sub)
+            if reason:
+                return reason
+        previous = (op, av)
+    return None
+
+
+def check_pattern(pattern: str) -> Optional[str]:
+    """静态检查常见的 ReDoS 结构，返回问题描述，安全或无法解析时返回None"""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return None
+    return _find_unsafe(parsed.data if hasattr(parsed, "data") else parsed)
+
+
+class RegexGuard:
+    """带编译缓存、静态检查和执行超时的正则执行器"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.cache: "OrderedDict[str, Any]" = OrderedDict()
+        self.disabled: Dict[str, str] = {}  # 模式 -> 停用原因
+        self.unsafe: Dict[str, str] = {}  # 模式 -> 静态检查发现的问题
+        self.timeout_counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.stats = {"evaluations": 0, "timeouts": 0, "errors": 0, "skipped": 0}
+        self.logger = logging.getLogger("rules")
+        self.configure(config)
+
+    def configure(self, config: Dict[str, Any] = None):
+        """按 rules 配置设置超时和停用策略"""
+        self.config = config or {}
+        self.timeout = self.config.get("regex_timeout", 0.5)  # 单次执行的秒数上限
+        self.disable_after = self.config.get("regex_disable_after", 1)  # 超时几次后停用
+        self.reject_unsafe = self.config.get("regex_reject_unsafe", False)
+        self.cache_size = self.config.get("regex_cache_size", 512)
+
+    def compile(self, pattern: str):
+        """编译并缓存模式，已停用或无法编译时返回None"""
+        if pattern in self.disabled:
+            return None
+        with self.lock:
+            compiled = self.cache.get(pattern)
+            if compiled is not None:
+                self.cache.move_to_end(pattern)
+                return compiled
+
+        problem = check_pattern(pattern)
+        if problem:
+            self.unsafe[pattern] = problem
+            if self.reject_unsafe:
+                self._disable(pattern, f"静态检查: {problem}")
+                return None
+            self.logger.warning(f"正则规则可能存在灾难性回溯（{problem}），将限时执行: {pattern[:100]}")
+
+        try:
+            compiled = regex.compile(pattern, regex.V0)
+        except Exception as e:
+            self._disable(pattern, f"无法编译: {e}")
+            return None
+        with self.lock:
+            self.cache[pattern] = compiled
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return compiled
+
+    def _disable(self, pattern: str, reason: str):
+        with self.lock:
+            self.disabled[pattern] = reason
+            self.cache.pop(pattern, None)
+        self.logger.warning(f"停用正则规则（{reason}）: {pattern[:100]}")
+
+    def _run(self, pattern: str, method: str, *args) -> Any:
+        """执行编译后模式的方法，超时或出错时返回None"""
+        compiled = self.compile(pattern)
+        if compiled is None:
+            self.stats["skipped"] += 1
+            return None
+        self.stats["evaluations"] += 1
+        kwargs = {"timeout": self.timeout} if self.timeout else {}
+        try:
+            return getattr(compiled, method)(*args, **kwargs)
+        except TimeoutError:
+            self.stats["timeouts"] += 1
+            REGEX_TIMEOUTS.inc(source=get_source_name())
+            with self.lock:
+                count = self.timeout_counts[pattern] = self.timeout_counts.get(pattern, 0) + 1
+            self.logger.warning(f"正则规则执行超过 {self.timeout} 秒: {pattern[:100]}")
+            if count >= self.disable_after:
+                self._disable(pattern, f"执行超时 {count} 次")
+            return None
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.logger.error(f"正则表达式执行失败: {pattern[:100]}, 错误: {e}")
+            return None
+
+    def sub(self, pattern: str, replacement: Union[str, Callable[[Any], str]], text: str, count: int = 0) -> str:
+        """替换（count 为 0 时替换全部），模式不可用或超时时原样返回文本"""
+        result = self._run(pattern, "sub", replacement, text, count)
+        return text if result is None else result
+
+    def findall(self, pattern: str, text: str) -> List[Union[str, tuple]]:
+        """查找全部匹配，模式不可用或超时时返回空列表"""
+        return self._run(pattern, "findall", text) or []
+
+    def enable(self, pattern: str):
+        """重新启用被停用的模式"""
+        with self.lock:
+            self.disabled.pop(pattern, None)
+            self.timeout_counts.pop(pattern, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        return {
+            **self.stats,
+            "compiled": len(self.cache),
+            "disabled": dict(self.disabled),
+            "unsafe": dict(self.unsafe),
+        }
+
+
+# 进程级默认实例：超时停用的模式对所有书源生效
+REGEX_GUARD = RegexGuard()
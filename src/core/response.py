@@ -0,0 +1,99 @@
+"""
+响应对象 - HTTP Response
+
+网络层在释放连接之前就读完响应体，返回的是已缓冲的响应，
+接口与 aiohttp.ClientResponse 常用的部分保持一致。
+读取时可限制响应体大小，超过上限立即中止，不把整个响应读进内存。
+"""
+
+import json
+from typing import Any, Dict, Optional
+
+from multidict import CIMultiDict, CIMultiDictProxy
+
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class ResponseTooLargeError(Exception):
+    """响应体超过大小上限"""
+
+    def __init__(self, url: str, limit: int):
+        self.url = url
+        self.limit = limit
+        super().__init__(f"响应体超过 {limit} 字节上限: {url}")
+
+
+async def read_limited(response, max_size: Optional[int] = None) -> bytes:
+    """读取响应体，超过 max_size 字节时中止并抛出 ResponseTooLargeError"""
+    if not max_size:
+        return await response.read()
+
+    url = str(response.url)
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size:
+        raise ResponseTooLargeError(url, max_size)
+
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+        body.extend(chunk)
+        if len(body) > max_size:
+            raise ResponseTooLargeError(url, max_size)
+    return bytes(body)
+
+
+class HttpResponse:
+    """已缓冲的HTTP响应"""
+
+    def __init__(self, status: int, headers: Any = None, body: bytes = b"",
+                 url: str = "", method: str = "GET"):
+        self.status = status
+        self.headers = CIMultiDictProxy(CIMultiDict(headers or {}))
+        self.body = body
+        self.url = url
+        self.method = method
+
+    @classmethod
+    async def from_client_response(cls, response, body: Optional[bytes] = None,
+                                   max_size: Optional[int] = None) -> "HttpResponse":
+        """从 aiohttp.ClientResponse 构造（需在连接释放前调用）"""
+        if body is None:
+            body = await read_limited(response, max_size)
+        return cls(
+            status=response.status,
+            headers=response.headers,
+            body=body,
+            url=str(response.url),
+            method=response.method
+        )
+
+    @property
+    def charset(self) -> Optional[str]:
+        """Content-Type 中声明的编码"""
+        content_type = self.headers.get("Content-Type", "")
+        if "charset=" in content_type:
+            return content_type.split("charset=")[1].split(";")[0].strip().strip('"\'') or None
+        return None
+
+    async def read(self) -> bytes:
+        """读取响应体"""
+        return self.body
+
+    async def text(self, encoding: Optional[str] = None, errors: str = "strict") -> str:
+        """读取文本"""
+        return self.body.decode(encoding or self.charset or "utf-8", errors=errors)
+
+    async def json(self, loads=json.loads, **kwargs) -> Any:
+        """读取JSON"""
+        if not self.body.strip():
+            return None
+        return loads(self.body.decode(self.charset or "utf-8"))
+
+    def close(self):
+        """兼容 ClientResponse 接口，响应体已缓冲，无需释放"""
+
+    def release(self):
+        """兼容 ClientResponse 接口，响应体已缓冲，无需释放"""
+
+    def __repr__(self) -> str:
+        return f"<HttpResponse {self.status} {self.url} ({len(self.body)} bytes)>"
@@ -0,0 +1,100 @@
+"""
+重试预算 - Retry Budget
+
+限制网络层的重试总量，避免站点部分故障时重试把负载放大数倍：
+- 按主机的令牌桶：每次成功请求存入 ratio 个令牌，每次重试消耗一个令牌，
+  另按 min_per_second 缓慢补充，保证冷门站点也能重试
+- 去相关抖动的指数退避（decorrelated jitter）
+- 解析 429/503 响应的 Retry-After
+"""
+
+import time
+import random
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Any
+
+
+def parse_retry_after(value: Optional[str], now: Optional[datetime] = None) -> Optional[float]:
+    """解析 Retry-After（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max((when - now).total_seconds(), 0.0)
+
+
+def decorrelated_jitter(previous: float, base: float, cap: float) -> float:
+    """去相关抖动退避：在 [base, 3 * previous] 之间随机取值，不超过 cap"""
+    return min(cap, random.uniform(base, max(previous, base) * 3))
+
+
+class RetryBudget:
+    """按主机的重试预算"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.enabled = self.config.get("enabled", True)
+        self.ratio = self.config.get("budget_ratio", 0.2)
+        self.max_tokens = self.config.get("max_tokens", 10)
+        self.min_per_second = self.config.get("min_per_second", 0.5)
+        self.base_delay = self.config.get("base_delay", 1.0)
+        self.max_delay = self.config.get("max_delay", 30.0)
+        self.max_retry_after = self.config.get("max_retry_after", 60.0)
+
+        self.tokens: Dict[str, float] = {}
+        self.updated: Dict[str, float] = {}
+        self.retries = 0
+        self.denied = 0
+
+        self.logger = logging.getLogger("retry")
+
+    def _refill(self, host: str) -> float:
+        """按时间补充令牌"""
+        now = time.monotonic()
+        tokens = self.tokens.get(host, self.max_tokens)
+        elapsed = now - self.updated.get(host, now)
+        tokens = min(self.max_tokens, tokens + elapsed * self.min_per_second)
+        self.tokens[host] = tokens
+        self.updated[host] = now
+        return tokens
+
+    def deposit(self, host: str):
+        """成功请求存入令牌"""
+        if self.enabled:
+            self.tokens[host] = min(self.max_tokens, self._refill(host) + self.ratio)
+
+    def withdraw(self, host: str) -> bool:
+        """申请一次重试，预算不足时返回False"""
+        if not self.enabled:
+            self.retries += 1
+            return True
+        tokens = self._refill(host)
+        if tokens < 1:
+            self.denied += 1
+            self.logger.debug(f"重试预算不足，放弃重试: {host}")
+            return False
+        self.tokens[host] = tokens - 1
+        self.retries += 1
+        return True
+
+    def next_delay(self, previous: float) -> float:
+        """下一次重试前的等待时间"""
+        return decorrelated_jitter(previous, self.base_delay, self.max_delay)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取重试统计"""
+        return {
+            "retries": self.retries,
+            "denied": self.denied,
+            "exhausted_hosts": [host for host, tokens in self.tokens.items() if tokens < 1],
+        }
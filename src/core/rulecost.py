@@ -0,0 +1,167 @@
+"""
+规则耗时 - Rule Cost
+
+记录每次规则解析的耗时，找出拖慢解析的书源和规则：
+- 按 (书源, 规则字段, 规则) 统计次数、总耗时、最大值和 p50/p95/p99（保留最近的样本）
+- 单次耗时超过阈值的规则记为慢规则并输出警告日志（同一规则按间隔限频）
+- 报告按总耗时排出最慢的规则和书源，用于决定修复或停用哪些书源
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+from .metrics import REGISTRY
+
+
+RULE_SLOW = REGISTRY.counter(
+    "book_source_rule_slow_total", "超过慢规则阈值的解析次数（按书源和规则字段）", ("source", "field")
+)
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class RuleCost:
+    """单条规则的耗时统计"""
+
+    __slots__ = ("count", "total", "max", "slow", "errors", "samples", "last_logged")
+
+    def __init__(self, sample_size: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.errors = 0
+        self.samples: Deque[float] = deque(maxlen=sample_size)
+        self.last_logged = 0.0
+
+
+class RuleCostTracker:
+    """规则耗时统计"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.entries: Dict[Tuple[str, str, str], RuleCost] = {}
+        self.rule_types: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("rules")
+        self.configure(config)
+
+    def configure(self, config: Dict[str, Any] = None):
+        """按 rules 配置设置阈值"""
+        self.config = config or {}
+        self.enabled = self.config.get("cost_tracking", True)
+        self.slow_threshold = self.config.get("slow_rule_threshold", 0.1)  # 秒
+        self.sample_size = self.config.get("cost_sample_size", 256)
+        self.log_interval = self.config.get("slow_rule_log_interval", 60)
+        self.max_entries = self.config.get("cost_max_entries", 5000)
+
+    def record(self, source: str, field: str, rule: str, rule_type: str, seconds: float, error: bool = False):
+        """记录一次规则解析"""
+        if not self.enabled:
+            return
+        rule = rule[:200]
+        key = (source, field, rule)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if len(self.entries) >= self.max_entries:
+                    return
+                entry = self.entries[key] = RuleCost(self.sample_size)
+                self.rule_types[rule] = rule_type
+            entry.count += 1
+            entry.total += seconds
+            entry.max = max(entry.max, seconds)
+            entry.samples.append(seconds)
+            if error:
+                entry.errors += 1
+            slow = seconds >= self.slow_threshold
+            should_log = False
+            if slow:
+                entry.slow += 1
+                now = time.monotonic()
+                if now - entry.last_logged >= self.log_interval:
+                    entry.last_logged = now
+                    should_log = True
+        if slow:
+            RULE_SLOW.inc(source=source, field=field)
+        if should_log:
+            self.logger.warning(
+                f"慢规则: 书源 {source or '-'} 字段 {field or '-'} 耗时 {seconds * 1000:.0f} 毫秒"
+                f" (阈值 {self.slow_threshold * 1000:.0f} 毫秒): {rule[:100]}"
+            )
+
+    def report(self, limit: int = 20) -> Dict[str, Any]:
+        """按总耗时排序的慢规则和慢书源"""
+        with self.lock:
+            items = [(key, entry, list(entry.samples)) for key, entry in self.entries.items()]
+
+        rules = []
+        sources: Dict[str, Dict[str, Any]] = {}
+        for (source, field, rule), entry, samples in items:
+            rules.append({
+                "source": source,
+                "field": field,
+                "rule": rule,
+                "type": self.rule_types.get(rule, ""),
+                "count": entry.count,
+                "total_ms": entry.total * 1000,
+                "p50_ms": _percentile(samples, 0.5) * 1000,
+                "p95_ms": _percentile(samples, 0.95) * 1000,
+                "p99_ms": _percentile(samples, 0.99) * 1000,
+                "max_ms": entry.max * 1000,
+                "slow": entry.slow,
+                "errors": entry.errors,
+            })
+            summary = sources.setdefault(source, {
+                "source": source, "rules": 0, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "slow": 0, "errors": 0
+            })
+            summary["rules"] += 1
+            summary["count"] += entry.count
+            summary["total_ms"] += entry.total * 1000
+            summary["max_ms"] = max(summary["max_ms"], entry.max * 1000)
+            summary["slow"] += entry.slow
+            summary["errors"] += entry.errors
+
+        rules.sort(key=lambda item: item["total_ms"], reverse=True)
+        ranked_sources = sorted(sources.values(), key=lambda item: item["total_ms"], reverse=True)
+        return {
+            "slow_threshold_ms": self.slow_threshold * 1000,
+            "rules": rules[:limit],
+            "sources": ranked_sources[:limit],
+        }
+
+    def reset(self):
+        """清空统计"""
+        with self.lock:
+            self.entries.clear()
+            self.rule_types.clear()
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """报告的文本形式"""
+    lines = [f"书源规则耗时排行（慢规则阈值 {report['slow_threshold_ms']:.0f} 毫秒）:"]
+    for item in report["sources"]:
+        lines.append(
+            f"   {item['source'] or '-'}: 总计 {item['total_ms']:.1f} 毫秒, {item['count']} 次, "
+            f"最大 {item['max_ms']:.1f} 毫秒, 慢 {item['slow']} 次, 失败 {item['errors']} 次"
+        )
+    lines.append("\n最慢的规则:")
+    for item in report["rules"]:
+        lines.append(
+            f"   [{item['source'] or '-'}] {item['field'] or item['type']}: 总计 {item['total_ms']:.1f} 毫秒, "
+            f"p50 {item['p50_ms']:.2f} / p99 {item['p99_ms']:.2f} / 最大 {item['max_ms']:.2f} 毫秒, "
+            f"{item['count']} 次"
+        )
+        lines.append(f"      {item['rule'][:100]}")
+    return "\n".join(lines)
+
+
+# 进程级默认统计（引擎按配置调整阈值）
+RULE_COSTS = RuleCostTracker()
@@ -7,14 +7,22 @@
 - 正则表达式
 - JavaScript脚本
 - JSON路径
+- 每次解析计时，按书源和规则字段统计耗时
+- 正则规则预编译、静态检查并限时执行
 """
 
 import re
 import json
+import time
 import logging
 from typing import Dict, List, Optional, Any, Union
 from urllib.parse import urljoin, urlparse
 
+from . import tracing
+from .metrics import RULE_DURATION, RULE_ERRORS, JS_DURATION, get_source_name, source_scope
+from .rulecost import RULE_COSTS
+from .regexguard import REGEX_GUARD
+
 # JavaScript功能可用性检查（延迟导入）
 JS_AVAILABLE = None  # 延迟检查
 
@@ -26,6 +34,7 @@ class RuleEngine:
         self.config = config or {}
         self.js_timeout = self.config.get("js_timeout", 5000)
         self.max_depth = self.config.get("max_depth", 10)
+        self.regex = REGEX_GUARD
 
         # JavaScript执行环境（延迟初始化）
         self.js_context = None
@@ -34,6 +43,10 @@ class RuleEngine:
 
         self.logger = logging.getLogger("rules")
 
+    def bind(self, name: str) -> "SourceRules":
+        """返回书源的规则引擎视图，解析耗时记在该书源名下"""
+        return SourceRules(self, name)
+
     def _check_js_availability(self):
         """检查JavaScript功能可用性"""
         if self._js_checked:
@@ -107,38 +120,54 @@ class RuleEngine:
             };
         """)
     
-    def parse_rule(self, rule: str, content: str, base_url: str = "") -> Union[str, List[str]]:
-        """解析规则"""
+    def get_rule_type(self, rule: str) -> str:
+        """判断规则类型：js / json / css / xpath / regex / text"""
+        if rule.startswith("<js>") and rule.endswith("</js>"):
+            return "js"
+        if rule.startswith("$."):
+            return "json"
+        if rule.startswith("##"):
+            return "regex"
+        if any(selector in rule for selector in ["@css:", "class.", "tag.", "#", "."]):
+            return "css"
+        if rule.startswith("//") or rule.startswith("./"):
+            return "xpath"
+        if "##" in rule:
+            return "regex"
+        return "text"
+    
+    def parse_rule(self, rule: str, content: str, base_url: str = "", field: str = "") -> Union[str, List[str]]:
+        """解析规则，field 为规则所属字段（如 ruleSearch.name），用于耗时统计"""
         if not rule or not content:
             return ""
         
-        try:
-            # JavaScript规则
-            if rule.startswith("<js>") and rule.endswith("</js>"):
-                return self._parse_js_rule(rule[4:-5], content, base_url)
-            
-            # JSON路径规则
-            if rule.startswith("$."):
-                return self._parse_json_rule(rule, content)
-            
-            # CSS选择器规则
-            if any(selector in rule for selector in ["@css:", "class.", "tag.", "#", "."]):
-                return self._parse_css_rule(rule, content, base_url)
-            
-            # XPath规则
-            if rule.startswith("//") or rule.startswith("./"):
-                return self._parse_xpath_rule(rule, content, base_url)
-            
-            # 正则表达式规则
-            if "##" in rule:
-                return self._parse_regex_rule(rule, content)
-            
-            # 直接文本规则
-            return self._parse_text_rule(rule, content)
-            
-        except Exception as e:
-            self.logger.error(f"规则解析失败: {rule}, 错误: {e}")
-            return ""
+        rule_type = self.get_rule_type(rule)
+        start = time.perf_counter()
+        failed = False
+        with tracing.span("rule.parse", type=rule_type, rule=rule[:100], content_length=len(content)) as rule_span:
+            try:
+                if rule_type == "js":
+                    return self._parse_js_rule(rule[4:-5], content, base_url)
+                if rule_type == "json":
+                    return self._parse_json_rule(rule, content)
+                if rule_type == "css":
+                    return self._parse_css_rule(rule, content, base_url)
+                if rule_type == "xpath":
+                    return self._parse_xpath_rule(rule, content, base_url)
+                if rule_type == "regex":
+                    return self._parse_regex_rule(rule, content)
+                return self._parse_text_rule(rule, content)
+                
+            except Exception as e:
+                failed = True
+                RULE_ERRORS.inc(type=rule_type)
+                rule_span.set_status(str(e))
+                self.logger.error(f"规则解析失败: {rule}, 错误: {e}")
+                return ""
+            finally:
+                elapsed = time.perf_counter() - start
+                RULE_DURATION.observe(elapsed, type=rule_type)
+                RULE_COSTS.record(get_source_name(), field, rule, rule_type, elapsed, error=failed)
     
     def _parse_js_rule(self, js_code: str, content: str, base_url: str = "") -> Union[str, List[str]]:
         """解析JavaScript规则"""
@@ -153,7 +182,12 @@ class RuleEngine:
             self.js_context.src = content
 
             # 执行JavaScript代码
-            result = self.js_context.eval(js_code)
+            start = time.perf_counter()
+            try:
+                with tracing.span("js.eval", code_length=len(js_code)):
+                    result = self.js_context.eval(js_code)
+            finally:
+                JS_DURATION.observe(time.perf_counter() - start)
 
             # 处理返回结果
             if isinstance(result, (list, tuple)):
@@ -293,14 +327,13 @@ class RuleEngine:
             pattern = parts[1]
             replacement = parts[2] if len(parts) > 2 else ""
             
-            # 执行正则匹配
-            if replacement:
+            # 执行正则匹配（带编译缓存和超时，超时的模式会被停用）
+            if len(parts) > 2:
                 # 替换模式
-                result = re.sub(pattern, replacement, content)
-                return result
+                return self.regex.sub(pattern, replacement, content)
             else:
                 # 匹配模式
-                matches = re.findall(pattern, content)
+                matches = self.regex.findall(pattern, content)
                 if not matches:
                     return ""
                 
@@ -334,7 +367,7 @@ class RuleEngine:
         results = {}
         for key, rule in rules.items():
             if rule:
-                results[key] = self.parse_rule(rule, content, base_url)
+                results[key] = self.parse_rule(rule, content, base_url, field=key)
         return results
     
     def validate_rule(self, rule: str) -> bool:
@@ -359,3 +392,25 @@ class RuleEngine:
                 
         except Exception:
             return False
+
+
+class SourceRules:
+    """书源的规则引擎视图，解析时带上书源名称"""
+    
+    def __init__(self, rules: RuleEngine, source_name: str):
+        self.rules = rules
+        self.source_name = source_name
+    
+    def __getattr__(self, name: str):
+        return getattr(self.rules, name)
+    
+    def parse_rule(self, *args, **kwargs) -> Union[str, List[str]]:
+        with source_scope(self.source_name):
+            return self.rules.parse_rule(*args, **kwargs)
+    
+    def parse_multiple_rules(self, *args, **kwargs) -> Dict[str, Any]:
+        with source_scope(self.source_name):
+            return self.rules.parse_multiple_rules(*args, **kwargs)
+    
+    def bind(self, name: str) -> "SourceRules":
+        return SourceRules(self.rules, name)
@@ -0,0 +1,143 @@
+"""
+运行时 - Runtime Bootstrap
+
+命令行和服务入口共用的运行时设置：
+- 安装了 uvloop 时使用 uvloop 事件循环（Windows 不支持）
+- 按配置构建 aiohttp 连接器：连接池大小、keepalive、force_close、DNS缓存、happy eyeballs
+- 带缓存的DNS解析器，可在首次请求前预先解析
+- 连接器统计
+"""
+
+import sys
+import time
+import socket
+import asyncio
+import inspect
+import logging
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+from aiohttp.resolver import ThreadedResolver
+
+
+logger = logging.getLogger("runtime")
+
+
+def get_loop_factory(config: Dict[str, Any] = None) -> Optional[Callable[[], asyncio.AbstractEventLoop]]:
+    """返回 uvloop 的事件循环工厂，未启用或不可用时返回None"""
+    config = config or {}
+    if not config.get("use_uvloop", True) or sys.platform == "win32":
+        return None
+    try:
+        import uvloop
+    except ImportError:
+        return None
+    return uvloop.new_event_loop
+
+
+def get_loop_name(config: Dict[str, Any] = None) -> str:
+    """将要使用的事件循环名称"""
+    return "uvloop" if get_loop_factory(config) else "asyncio"
+
+
+def run(coro: Coroutine, config: Dict[str, Any] = None) -> Any:
+    """运行协程，可用时使用 uvloop"""
+    loop_factory = get_loop_factory(config)
+    if loop_factory is None:
+        return asyncio.run(coro)
+
+    logger.debug("使用 uvloop 事件循环")
+    if hasattr(asyncio, "Runner"):
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            return runner.run(coro)
+
+    # Python 3.11 以前没有 asyncio.Runner
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(coro)
+
+
+class CachingResolver(AbstractResolver):
+    """带TTL缓存的DNS解析器
+
+    安装了 aiodns 时使用异步解析，否则使用线程池解析。预热阶段解析过的主机，
+    首次请求时直接命中缓存。
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self.cache: Dict[Tuple[str, int, int], Tuple[float, List[Dict[str, Any]]]] = {}
+        self._resolver: Optional[AbstractResolver] = None
+
+    def _get_resolver(self) -> AbstractResolver:
+        if self._resolver is None:
+            try:
+                import aiodns  # noqa: F401
+                from aiohttp.resolver import AsyncResolver
+                self._resolver = AsyncResolver()
+            except ImportError:
+                self._resolver = ThreadedResolver()
+        return self._resolver
+
+    async def resolve(self, host: str, port: int = 0,
+                      family: socket.AddressFamily = socket.AF_UNSPEC) -> List[Dict[str, Any]]:
+        key = (host, port, int(family))
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        result = await self._get_resolver().resolve(host, port, family)
+        self.cache[key] = (time.monotonic() + self.ttl, result)
+        return result
+
+    async def close(self):
+        if self._resolver is not None:
+            await self._resolver.close()
+
+    @property
+    def backend(self) -> str:
+        return type(self._get_resolver()).__name__
+
+
+def build_connector(config: Dict[str, Any] = None,
+                    resolver: Optional[AbstractResolver] = None) -> aiohttp.TCPConnector:
+    """按网络配置构建连接器"""
+    config = config or {}
+    options = {
+        "limit": config.get("max_connections", 100),
+        "limit_per_host": config.get("max_connections_per_host", 30),
+        "use_dns_cache": config.get("enable_dns_cache", True),
+        "ttl_dns_cache": config.get("dns_cache_ttl", 300),
+        "force_close": config.get("force_close", False),
+    }
+    # force_close 与 keepalive_timeout 不能同时设置
+    if not options["force_close"]:
+        options["keepalive_timeout"] = config.get("keepalive_timeout", 30)
+    if config.get("verify_ssl") is False:
+        options["ssl"] = False
+    if resolver is not None:
+        options["resolver"] = resolver
+
+    # happy_eyeballs_delay 需要 aiohttp 3.10+
+    supported = inspect.signature(aiohttp.TCPConnector.__init__).parameters
+    if "happy_eyeballs_delay" in supported:
+        options["happy_eyeballs_delay"] = config.get("happy_eyeballs_delay", 0.25)
+
+    return aiohttp.TCPConnector(**options)
+
+
+def get_connector_stats(connector: Optional[aiohttp.BaseConnector]) -> Dict[str, Any]:
+    """连接器统计：上限、使用中和空闲的连接数"""
+    if connector is None:
+        return {}
+    idle = getattr(connector, "_conns", {})
+    acquired = getattr(connector, "_acquired", ())
+    return {
+        "limit": connector.limit,
+        "limit_per_host": connector.limit_per_host,
+        "force_close": connector.force_close,
+        "acquired": len(acquired),
+        "idle": sum(len(conns) for conns in idle.values()),
+        "idle_hosts": len(idle),
+        "closed": connector.closed,
+    }
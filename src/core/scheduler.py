@@ -0,0 +1,237 @@
+"""
+请求调度器 - Request Scheduler
+
+位于网络层前面，按优先级调度所有上游请求：
+- 优先级分类：交互（interactive）、预读（prefetch）、批量（bulk）
+- 按 (优先级, 主机) 分流的加权公平排队
+- 截止时间感知出队：已超过截止时间的请求优先
+- 为交互请求预留并发名额，后台负载再大也不会饿死前台
+"""
+
+import time
+import asyncio
+import logging
+import contextvars
+from enum import IntEnum
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any, Tuple
+
+
+class Priority(IntEnum):
+    """请求优先级"""
+    INTERACTIVE = 0
+    PREFETCH = 1
+    BULK = 2
+
+
+_request_priority = contextvars.ContextVar("request_priority", default=Priority.INTERACTIVE)
+
+
+def get_request_priority() -> Priority:
+    """获取当前上下文的请求优先级"""
+    return _request_priority.get()
+
+
+@contextmanager
+def request_priority(priority: Priority):
+    """在上下文中设置请求优先级，对其中发起的所有请求生效"""
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+class _Waiter:
+    """排队中的请求"""
+
+    __slots__ = ("host", "priority", "deadline", "tag", "future", "enqueue_time")
+
+    def __init__(self, host: str, priority: Priority, deadline: float, tag: float):
+        self.host = host
+        self.priority = priority
+        self.deadline = deadline
+        self.tag = tag
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueue_time = time.monotonic()
+
+
+class RequestScheduler:
+    """优先级请求调度器"""
+
+    DEFAULT_WEIGHTS = {
+        Priority.INTERACTIVE: 16,
+        Priority.PREFETCH: 4,
+        Priority.BULK: 1,
+    }
+
+    DEFAULT_DEADLINES = {
+        Priority.INTERACTIVE: 1.0,
+        Priority.PREFETCH: 10.0,
+        Priority.BULK: 60.0,
+    }
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.enabled = self.config.get("enabled", True)
+        self.max_concurrency = self.config.get("max_concurrency", 100)
+        self.per_host_concurrency = self.config.get("per_host_concurrency", 30)
+        self.reserved_interactive = self.config.get("reserved_interactive", 10)
+
+        self.weights = dict(self.DEFAULT_WEIGHTS)
+        for name, weight in self.config.get("weights", {}).items():
+            self.weights[Priority[name.upper()]] = weight
+        self.deadlines = dict(self.DEFAULT_DEADLINES)
+        for name, deadline in self.config.get("deadlines", {}).items():
+            self.deadlines[Priority[name.upper()]] = deadline
+
+        self.active = 0
+        self.active_per_host: Dict[str, int] = {}
+        self.waiters: List[_Waiter] = []
+        self.virtual_time = 0.0
+        self.flow_tags: Dict[Tuple[Priority, str], float] = {}
+
+        self.dispatched = {priority: 0 for priority in Priority}
+        self.wait_time = {priority: 0.0 for priority in Priority}
+        self.max_wait = {priority: 0.0 for priority in Priority}
+
+        self.logger = logging.getLogger("scheduler")
+
+    def _limit(self, priority: Priority) -> int:
+        """该优先级可占用的总并发数，后台请求不能占用交互预留名额"""
+        if priority == Priority.INTERACTIVE:
+            return self.max_concurrency
+        return max(self.max_concurrency - self.reserved_interactive, 1)
+
+    def _can_start(self, host: str, priority: Priority) -> bool:
+        """是否有空闲名额"""
+        return (self.active < self._limit(priority) and
+                self.active_per_host.get(host, 0) < self.per_host_concurrency)
+
+    def _start(self, host: str, priority: Priority, waited: float):
+        """占用名额"""
+        self.active += 1
+        self.active_per_host[host] = self.active_per_host.get(host, 0) + 1
+        self.dispatched[priority] += 1
+        self.wait_time[priority] += waited
+        self.max_wait[priority] = max(self.max_wait[priority], waited)
+
+    def _next_tag(self, host: str, priority: Priority) -> float:
+        """计算加权公平排队的完成标签"""
+        flow = (priority, host)
+        tag = max(self.virtual_time, self.flow_tags.get(flow, 0.0)) + 1.0 / self.weights[priority]
+        self.flow_tags[flow] = tag
+        return tag
+
+    def _dispatch(self):
+        """按截止时间和公平标签唤醒排队请求"""
+        now = time.monotonic()
+        while self.waiters:
+            best = None
+            for waiter in self.waiters:
+                if waiter.future.done() or not self._can_start(waiter.host, waiter.priority):
+                    continue
+                if best is None:
+                    best = waiter
+                    continue
+                waiter_due = waiter.deadline <= now
+                best_due = best.deadline <= now
+                if waiter_due != best_due:
+                    if waiter_due:
+                        best = waiter
+                elif waiter_due:
+                    if waiter.deadline < best.deadline:
+                        best = waiter
+                elif waiter.tag < best.tag:
+                    best = waiter
+
+            self.waiters = [waiter for waiter in self.waiters if not waiter.future.done()]
+            if best is None:
+                break
+
+            self.waiters.remove(best)
+            self.virtual_time = max(self.virtual_time, best.tag)
+            self._start(best.host, best.priority, now - best.enqueue_time)
+            best.future.set_result(True)
+
+        if not self.waiters:
+            # 队列排空后重置虚拟时间，避免标签无限增长
+            self.virtual_time = 0.0
+            self.flow_tags.clear()
+
+    async def acquire(self, host: str, priority: Optional[Priority] = None,
+                      deadline: Optional[float] = None):
+        """申请一个请求名额"""
+        if priority is None:
+            priority = get_request_priority()
+        if not self.enabled:
+            return
+
+        if not self.waiters and self._can_start(host, priority):
+            self._start(host, priority, 0.0)
+            return
+
+        if deadline is None:
+            deadline = time.monotonic() + self.deadlines[priority]
+        waiter = _Waiter(host, priority, deadline, self._next_tag(host, priority))
+        self.waiters.append(waiter)
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已分配名额但调用方被取消，归还名额
+                self.release(host)
+            else:
+                waiter.future.cancel()
+                self._dispatch()
+            raise
+
+    def release(self, host: str):
+        """归还请求名额"""
+        if not self.enabled:
+            return
+        self.active = max(self.active - 1, 0)
+        count = self.active_per_host.get(host, 0) - 1
+        if count > 0:
+            self.active_per_host[host] = count
+        else:
+            self.active_per_host.pop(host, None)
+        self._dispatch()
+
+    def slot(self, host: str, priority: Optional[Priority] = None):
+        """请求名额的异步上下文管理器"""
+        return _Slot(self, host, priority)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度统计信息"""
+        queued = {priority.name.lower(): 0 for priority in Priority}
+        for waiter in self.waiters:
+            queued[waiter.priority.name.lower()] += 1
+        return {
+            "active": self.active,
+            "queued": queued,
+            "dispatched": {priority.name.lower(): count for priority, count in self.dispatched.items()},
+            "avg_wait": {
+                priority.name.lower(): self.wait_time[priority] / max(self.dispatched[priority], 1)
+                for priority in Priority
+            },
+            "max_wait": {priority.name.lower(): wait for priority, wait in self.max_wait.items()},
+        }
+
+
+class _Slot:
+    """RequestScheduler.slot 返回的上下文管理器"""
+
+    def __init__(self, scheduler: RequestScheduler, host: str, priority: Optional[Priority]):
+        self.scheduler = scheduler
+        self.host = host
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.host, self.priority)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.scheduler.release(self.host)
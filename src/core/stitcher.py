@@ -0,0 +1,157 @@
+"""
+正文分页拼接 - Content Stitcher
+
+很多站点把一章拆成多页（ruleContent.nextContentUrl），本模块负责：
+- 跟随 next_url 拼接完整章节
+- 分页地址可预测时（如 _2.html、_3.html）并发预取后续页面，预取窗口从0逐页倍增，
+  避免两三页的短章节在末页之后白白多发请求
+- 去除相邻页面边界处重复的文本
+"""
+
+import re
+import asyncio
+import logging
+from typing import Callable, Dict, Optional, Awaitable, Any
+
+
+# 分页地址中变化的部分：可选的非数字前缀 + 页码 + 可选的非数字后缀
+PAGE_PART_PATTERN = re.compile(r"^(\D*?)(\d+)(\D*)$")
+
+
+def build_page_template(first_url: str, second_url: str) -> Optional[Callable[[int], str]]:
+    """根据第1页和第2页地址推断分页地址模板，无法推断时返回None"""
+    if not first_url or not second_url or first_url == second_url:
+        return None
+
+    prefix_len = 0
+    max_prefix = min(len(first_url), len(second_url))
+    while prefix_len < max_prefix and first_url[prefix_len] == second_url[prefix_len]:
+        prefix_len += 1
+
+    suffix_len = 0
+    max_suffix = min(len(first_url), len(second_url)) - prefix_len
+    while (suffix_len < max_suffix and
+           first_url[-1 - suffix_len] == second_url[-1 - suffix_len]):
+        suffix_len += 1
+
+    # 公共前缀不能吃掉页码的前几位数字，例如 p1.html 与 p12.html
+    while (prefix_len > 0 and prefix_len < len(second_url) and
+           second_url[prefix_len - 1].isdigit() and second_url[prefix_len].isdigit()):
+        prefix_len -= 1
+
+    prefix = second_url[:prefix_len]
+    suffix = second_url[len(second_url) - suffix_len:] if suffix_len else ""
+    first_part = first_url[prefix_len:len(first_url) - suffix_len]
+    second_part = second_url[prefix_len:len(second_url) - suffix_len]
+
+    match = PAGE_PART_PATTERN.match(second_part)
+    if not match or int(match.group(2)) != 2:
+        return None
+
+    head, _, tail = match.groups()
+    # 第1页要么没有页码部分，要么是同样格式的页码1
+    if first_part:
+        first_match = PAGE_PART_PATTERN.match(first_part)
+        if not first_match or first_match.group(1) != head or first_match.group(3) != tail:
+            return None
+        if int(first_match.group(2)) != 1:
+            return None
+
+    return lambda page: f"{prefix}{head}{page}{tail}{suffix}"
+
+
+def merge_overlap(previous: str, current: str, max_lines: int = 10) -> str:
+    """去掉 current 开头与 previous 结尾重复的行"""
+    if not previous:
+        return current
+    if not current:
+        return previous
+
+    prev_lines = [line.strip() for line in previous.rstrip().splitlines()]
+    curr_lines = current.lstrip().splitlines()
+    curr_stripped = [line.strip() for line in curr_lines]
+
+    for size in range(min(max_lines, len(prev_lines), len(curr_lines)), 0, -1):
+        if prev_lines[-size:] == curr_stripped[:size] and any(prev_lines[-size:]):
+            curr_lines = curr_lines[size:]
+            break
+
+    rest = "\n".join(curr_lines).lstrip("\n")
+    if not rest:
+        return previous
+    return previous.rstrip() + "\n" + rest
+
+
+class ContentStitcher:
+    """正文分页拼接器"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.max_pages = self.config.get("max_pages", 20)
+        self.speculative_pages = self.config.get("speculative_pages", 4)
+
+        self.logger = logging.getLogger("stitcher")
+
+    async def stitch(self, fetch_page: Callable[[str], Awaitable[Any]], chapter_url: str):
+        """拼接完整章节
+
+        fetch_page 为单页抓取函数（通常是 BaseSource.get_content），返回 ContentInfo。
+        """
+        first = await fetch_page(chapter_url)
+        if not first.next_url:
+            return first
+
+        pages = [first]
+        visited = {chapter_url}
+        template = build_page_template(chapter_url, first.next_url)
+        speculative: Dict[str, asyncio.Task] = {}
+        next_url = first.next_url
+        # 预取窗口：每多确认一页仍有下一页就翻倍，上限 speculative_pages
+        window = 0
+
+        try:
+            while next_url and next_url not in visited and len(pages) < self.max_pages:
+                visited.add(next_url)
+
+                # 地址可预测时，提前并发抓取后面几页
+                if template:
+                    page_number = len(pages) + 1
+                    for offset in range(window + 1):
+                        number = page_number + offset
+                        if number > self.max_pages:
+                            break
+                        url = template(number)
+                        if url not in speculative and (url == next_url or url not in visited):
+                            speculative[url] = asyncio.ensure_future(fetch_page(url))
+
+                task = speculative.pop(next_url, None)
+                if task is not None:
+                    page = await task
+                else:
+                    # 实际地址与预测不一致，退回串行跟随
+                    if template:
+                        self.logger.debug(f"分页地址与预测不一致，改为串行: {next_url}")
+                        template = None
+                    page = await fetch_page(next_url)
+
+                if not page.content:
+                    break
+                pages.append(page)
+                next_url = page.next_url
+                window = min(self.speculative_pages, window * 2 + 1)
+        finally:
+            # 丢弃没用上的预取结果
+            for task in speculative.values():
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+        content = pages[0].content
+        for page in pages[1:]:
+            content = merge_overlap(content, page.content)
+
+        first.content = content
+        first.next_url = ""
+        self.logger.debug(f"拼接章节 {first.title}: 共 {len(pages)} 页")
+        return first
@@ -0,0 +1,279 @@
+"""
+链路追踪 - Tracing
+
+热路径上的轻量结构化追踪，定位一次搜索的耗时花在哪里：
+- 默认不启用，此时 span() 返回共享的空操作对象，几乎没有开销
+- 启用后记录 span 的层级、起止时间和属性，按 OpenTelemetry 的字段命名导出为 JSON Lines
+- 安装了 opentelemetry-api 时可改为交给 OpenTelemetry SDK 处理
+- 当前 span 通过上下文变量传递，并发任务自动继承父 span
+- aiohttp 的 DNS 解析、建立连接、等待连接池以子 span 记录
+"""
+
+import json
+import time
+import atexit
+import random
+import logging
+import threading
+import contextvars
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+logger = logging.getLogger("tracing")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_tracer: Optional["Tracer"] = None
+
+
+class _NoopSpan:
+    """未启用追踪或未采样时使用的空 span"""
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_status(self, error: str):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _UnsampledSpan(_NoopSpan):
+    """未被采样的根 span，其下的子 span 同样不记录"""
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        return False
+
+
+class Span:
+    """一个计时区间"""
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id",
+                 "start_ns", "end_ns", "attributes", "error", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else ""
+        self.start_ns = 0
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error = ""
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_status(self, error: str):
+        """标记为失败"""
+        self.error = error
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        _current_span.reset(self._token)
+        if exc is not None and not self.error:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.tracer.export(self)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+
+
+class Tracer:
+    """本地追踪器，span 结束后缓冲并追加写入 JSON Lines 文件"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or {}
+        self.export_path = self.config.get("export_path", "data/traces/spans.jsonl")
+        self.sample_rate = self.config.get("sample_rate", 1.0)
+        self.flush_size = self.config.get("flush_size", 500)
+
+        self.buffer: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.exported = 0
+
+    def start_span(self, name: str, attributes: Dict[str, Any]):
+        parent = _current_span.get()
+        if isinstance(parent, _UnsampledSpan):
+            return NOOP_SPAN
+        if parent is None and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return _UnsampledSpan()
+        return Span(self, name, parent, attributes)
+
+    def record(self, name: str, start_ns: int, end_ns: int, attributes: Dict[str, Any]):
+        """记录已结束的子 span（用于回调中测得的时间段）"""
+        parent = _current_span.get()
+        if parent is None or isinstance(parent, _UnsampledSpan):
+            return
+        span = Span(self, name, parent, attributes)
+        span.start_ns = start_ns
+        span.end_ns = end_ns
+        self.export(span)
+
+    def export(self, span: Span):
+        with self.lock:
+            self.buffer.append(span.to_dict())
+            full = len(self.buffer) >= self.flush_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """写出缓冲的 span"""
+        with self.lock:
+            spans, self.buffer = self.buffer, []
+        if not spans:
+            return
+        try:
+            Path(self.export_path).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                for span in spans:
+                    f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+            self.exported += len(spans)
+        except Exception as e:
+            logger.error(f"写出追踪数据失败: {e}")
+
+
+class _OpenTelemetrySpan:
+    """把 OpenTelemetry span 包装成与本地 span 相同的接口"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.span = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.span.set_attribute(key, value)
+
+    def set_status(self, error: str):
+        from opentelemetry.trace import Status, StatusCode
+        self.span.set_status(Status(StatusCode.ERROR, error))
+
+    def __enter__(self):
+        self.span = self.manager.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self.manager.__exit__(exc_type, exc, tb)
+
+
+class OpenTelemetryTracer:
+    """交给 OpenTelemetry 处理的追踪器（导出器由 SDK 配置）"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        from opentelemetry import trace
+        self.config = config or {}
+        self.tracer = trace.get_tracer("book-source")
+        self.exported = 0
+
+    def start_span(self, name: str, attributes: Dict[str, Any]):
+        return _OpenTelemetrySpan(self.tracer.start_as_current_span(name, attributes=attributes))
+
+    def record(self, name: str, start_ns: int, end_ns: int, attributes: Dict[str, Any]):
+        self.tracer.start_span(name, attributes=attributes, start_time=start_ns).end(end_time=end_ns)
+
+    def flush(self):
+        pass
+
+
+def configure(config: Dict[str, Any] = None):
+    """按配置启用或关闭追踪，返回当前追踪器（未启用时为None）"""
+    global _tracer
+    config = config or {}
+    if _tracer is not None:
+        _tracer.flush()
+    if not config.get("enabled", False):
+        _tracer = None
+        return None
+
+    if config.get("backend", "local") == "opentelemetry":
+        try:
+            _tracer = OpenTelemetryTracer(config)
+            return _tracer
+        except ImportError:
+            logger.warning("opentelemetry-api 未安装，改用本地JSON导出")
+    _tracer = Tracer(config)
+    return _tracer
+
+
+def get_tracer():
+    """当前追踪器，未启用时为None"""
+    return _tracer
+
+
+def span(name: str, **attributes):
+    """开始一个 span，用作上下文管理器"""
+    if _tracer is None:
+        return NOOP_SPAN
+    return _tracer.start_span(name, attributes)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attributes):
+    """在当前 span 下记录一段已结束的时间"""
+    if _tracer is not None:
+        _tracer.record(name, start_ns, end_ns, attributes)
+
+
+def flush():
+    """写出缓冲的 span"""
+    if _tracer is not None:
+        _tracer.flush()
+
+
+atexit.register(flush)
+
+
+def aiohttp_trace_config():
+    """记录 DNS 解析、等待连接池和建立连接耗时的 aiohttp TraceConfig"""
+    import aiohttp
+
+    trace_config = aiohttp.TraceConfig()
+
+    def start(key: str):
+        async def handler(session, context, params):
+            setattr(context, key, time.time_ns())
+        return handler
+
+    def end(key: str, name: str):
+        async def handler(session, context, params):
+            started = getattr(context, key, None)
+            if started is not None:
+                attributes = {"host": params.host} if hasattr(params, "host") else {}
+                record_span(name, started, time.time_ns(), **attributes)
+        return handler
+
+    trace_config.on_dns_resolvehost_start.append(start("dns_start"))
+    trace_config.on_dns_resolvehost_end.append(end("dns_start", "dns.resolve"))
+    trace_config.on_connection_queued_start.append(start("queued_start"))
+    trace_config.on_connection_queued_end.append(end("queued_start", "connection.queued"))
+    trace_config.on_connection_create_start.append(start("connect_start"))
+    trace_config.on_connection_create_end.append(end("connect_start", "connection.create"))
+    return trace_config
@@ -0,0 +1,131 @@
+"""
+书源预热 - Source Warm-up
+
+全局搜索同时请求上百个书源时，每个站点的第一次请求都要在自己的协程里
+串行完成 DNS 解析、TCP 和 TLS 握手。预热阶段在启动或注册书源之后：
+- 并发预先解析每个书源 bookSourceUrl 的主机，结果进入解析器缓存
+- 可选地为每个主机建立一个 keep-alive 连接放入连接池
+- 记录解析或连接失败的主机，并直接打开其熔断器，首次查询前就知道哪些域名不可用
+- 解析或连接超时不能说明站点不可用（可能只是启动时网络拥塞），两者都只记录，不打开熔断器
+"""
+
+import time
+import asyncio
+import logging
+from urllib.parse import urlparse
+from typing import Dict, List, Any
+
+import aiohttp
+
+from .network import NetworkManager
+
+
+class WarmupReport:
+    """预热结果"""
+
+    def __init__(self):
+        self.hosts = 0
+        self.resolved = 0
+        self.connected = 0
+        self.failed: Dict[str, str] = {}  # 主机 -> 失败原因
+        self.timed_out: List[str] = []  # 解析或连接超时的主机
+        self.sources: Dict[str, str] = {}  # 书源 -> 主机
+        self.elapsed = 0.0
+
+    @property
+    def dead_sources(self) -> List[str]:
+        """站点不可用的书源"""
+        return [name for name, host in self.sources.items() if host in self.failed]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "hosts": self.hosts,
+            "resolved": self.resolved,
+            "connected": self.connected,
+            "failed": dict(self.failed),
+            "timed_out": list(self.timed_out),
+            "dead_sources": self.dead_sources,
+            "elapsed": self.elapsed,
+        }
+
+
+class SourceWarmer:
+    """书源预热器"""
+
+    def __init__(self, network: NetworkManager, config: Dict[str, Any] = None):
+        self.network = network
+        self.config = config or {}
+        self.concurrency = self.config.get("concurrency", 32)
+        self.connect = self.config.get("connect", True)
+        self.timeout = self.config.get("timeout", 10)
+
+        self.logger = logging.getLogger("warmup")
+
+    async def _warm_host(self, origin: str, report: WarmupReport, semaphore: asyncio.Semaphore):
+        """解析并连接单个主机"""
+        parsed = urlparse(origin)
+        host = parsed.netloc
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+
+        async with semaphore:
+            try:
+                await asyncio.wait_for(self.network.resolver.resolve(parsed.hostname, port), self.timeout)
+                report.resolved += 1
+            except asyncio.TimeoutError:
+                report.timed_out.append(host)
+                self.logger.debug(f"预热解析超时: {host}")
+                return
+            except Exception as e:
+                report.failed[host] = f"DNS解析失败: {e or type(e).__name__}"
+                self.network.breakers.trip(host)
+                return
+
+            # 走代理时连接建立在代理上，直连预热没有意义
+            if not self.connect or self.network.proxy or self.network.proxy_pool.enabled:
+                return
+            try:
+                # 任何HTTP响应都说明连接可用，连接随后留在连接池中复用
+                async with self.network.session.request(
+                    "HEAD", origin, allow_redirects=False,
+                    timeout=aiohttp.ClientTimeout(total=self.timeout)
+                ):
+                    pass
+                report.connected += 1
+            except asyncio.TimeoutError:
+                report.timed_out.append(host)
+                self.logger.debug(f"预热连接超时: {host}")
+            except aiohttp.ClientConnectorError as e:
+                report.failed[host] = f"连接失败: {e}"
+                self.network.breakers.trip(host)
+            except Exception as e:
+                self.logger.debug(f"预热连接未完成: {host}, {e or type(e).__name__}")
+
+    async def warm_up(self, sources: Dict[str, Any]) -> WarmupReport:
+        """预热所有已启用书源的站点"""
+        start = time.monotonic()
+        report = WarmupReport()
+        if not self.network.session:
+            await self.network.create_session()
+
+        origins = {}
+        for name, source in sources.items():
+            if not getattr(source, "enabled", True):
+                continue
+            parsed = urlparse(getattr(source, "url", "") or "")
+            if parsed.scheme not in ("http", "https") or not parsed.hostname:
+                continue
+            report.sources[name] = parsed.netloc
+            origins.setdefault(parsed.netloc, f"{parsed.scheme}://{parsed.netloc}/")
+
+        report.hosts = len(origins)
+        semaphore = asyncio.Semaphore(max(self.concurrency, 1))
+        await asyncio.gather(*(self._warm_host(origin, report, semaphore) for origin in origins.values()))
+
+        report.elapsed = time.monotonic() - start
+        self.logger.info(
+            f"预热完成: {report.resolved}/{report.hosts} 个主机解析成功，"
+            f"{report.connected} 个已建立连接，{len(report.failed)} 个不可用，耗时 {report.elapsed:.2f} 秒"
+        )
+        for host, reason in report.failed.items():
+            self.logger.warning(f"站点不可用: {host}, {reason}")
+        return report
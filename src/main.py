@@ -21,6 +21,12 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 from src.core.engine import BookSourceEngine
+from src.core.bookshelf import Bookshelf
+from src.core.downloader import BookDownloader
+from src.core import runtime, metrics, tracing
+from src.core.cassette import Cassette
+from src.core.profiling import Profiler
+from src.core.rulecost import RULE_COSTS, format_report
 from src.sources.manager import SourceManager
 
 
@@ -127,6 +133,75 @@ class BookSourceApp:
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
         return self.source_manager.get_source_stats()
+    
+    async def warm_up(self) -> Dict[str, Any]:
+        """注册所有书源并预热站点"""
+        self.source_manager.register_all_sources()
+        try:
+            return await self.engine.warm_up()
+        finally:
+            await self.engine.network.close_session()
+    
+    def get_api_config(self, host: str = None, port: int = None, workers: int = None) -> Dict[str, Any]:
+        """API服务配置，命令行参数优先"""
+        api_config = dict(self.engine.config.get("api", {}))
+        if host:
+            api_config["host"] = host
+        if port:
+            api_config["port"] = port
+        if workers:
+            api_config["workers"] = workers
+        return api_config
+    
+    async def serve(self, api_config: Dict[str, Any]):
+        """注册所有书源并启动API服务"""
+        from src.server import ApiServer
+        
+        self.source_manager.register_all_sources()
+        await ApiServer(self.engine, api_config).serve()
+    
+    def serve_workers(self, api_config: Dict[str, Any]):
+        """以多个 worker 进程启动API服务，命令行指定的录制和追踪设置同样用于各 worker"""
+        from src.server import serve_workers
+        
+        tracer = tracing.get_tracer()
+        serve_workers(
+            self.engine.config_path, api_config, api_config["workers"],
+            cassette_config=self.engine.network.cassette.config,
+            tracing_config={**tracer.config, "enabled": True} if tracer is not None else None
+        )
+    
+    def get_bookshelf(self) -> Bookshelf:
+        """获取书架"""
+        return Bookshelf(self.engine, self.engine.config.get("bookshelf", {}))
+    
+    async def check_updates(self, sources: List[str] = None) -> Dict[str, Any]:
+        """检查书架更新"""
+        self.source_manager.register_all_sources()
+        try:
+            if self.engine.config.get("warmup", {}).get("enabled", False):
+                await self.engine.warm_up()
+            report = await self.get_bookshelf().sweep(sources)
+            return report.to_dict()
+        finally:
+            await self.engine.network.close_session()
+    
+    async def download_book(self, source_name: str, book_url: str, fmt: str = None) -> Dict[str, Any]:
+        """下载整本书"""
+        if not self.source_manager.register_source(source_name):
+            raise Exception(f"注册书源失败: {source_name}")
+        
+        download_config = self.engine.config.get("download", {})
+        downloader = BookDownloader(download_config)
+        try:
+            report = await downloader.download_book(
+                self.engine.get_source(source_name),
+                book_url,
+                fmt=fmt or download_config.get("format", "txt")
+            )
+            return report.to_dict()
+        finally:
+            await self.engine.network.close_session()
 
 
 def setup_logging(level: str = "INFO"):
@@ -172,6 +247,18 @@ def main():
   %(prog)s --test fanqie                    # 测试番茄小说书源
   %(prog)s --list                           # 列出所有可用书源
   %(prog)s --stats                          # 显示统计信息
+  %(prog)s --track fanqie URL               # 添加追更书籍
+  %(prog)s --check-updates                  # 检查书架更新
+  %(prog)s --download fanqie URL            # 下载整本书
+  %(prog)s --warmup                         # 预热书源站点，检查不可用的域名
+  %(prog)s --serve --port 8080              # 启动HTTP API服务
+  %(prog)s --serve --workers 4              # 以4个 worker 进程启动API服务
+  %(prog)s --check-updates --metrics        # 检查更新并输出 Prometheus 指标
+  %(prog)s --test fanqie --trace trace.jsonl # 记录搜索到规则解析各环节的耗时
+  %(prog)s --test fanqie --record a.cassette # 录制本次访问的上游流量
+  %(prog)s --test fanqie --replay a.cassette # 用录制的流量离线回放
+  %(prog)s --download fanqie URL --profile  # 剖析本次下载，结果保存到 debug.debug_dir
+  %(prog)s --check-updates --rule-report    # 检查更新并列出最慢的书源和规则
         """
     )
     
@@ -212,6 +299,108 @@ def main():
         help="显示统计信息"
     )
     
+    parser.add_argument(
+        "--track",
+        nargs=2,
+        metavar=("SOURCE", "BOOK_URL"),
+        help="添加追更书籍"
+    )
+    
+    parser.add_argument(
+        "--check-updates",
+        action="store_true",
+        help="检查书架中所有追更书籍的更新"
+    )
+    
+    parser.add_argument(
+        "--download",
+        nargs=2,
+        metavar=("SOURCE", "BOOK_URL"),
+        help="下载整本书（中断后再次执行可断点续传）"
+    )
+    
+    parser.add_argument(
+        "--format",
+        choices=["txt", "epub"],
+        help="下载导出格式 (默认: 配置文件中的 download.format)"
+    )
+    
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="预热书源站点（预解析域名、建立连接），列出不可用的站点"
+    )
+    
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="启动HTTP API服务（配置文件 api.enable_web_api 为 true 时默认启动）"
+    )
+    
+    parser.add_argument(
+        "--host",
+        help="API服务监听地址 (默认: 配置文件中的 api.host)"
+    )
+    
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="API服务端口 (默认: 配置文件中的 api.port)"
+    )
+    
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="API服务 worker 进程数，多个 worker 共享磁盘缓存，限流按 worker 分别计数 (默认: 配置文件中的 api.workers)"
+    )
+    
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="命令执行完毕后以 Prometheus 文本格式输出指标"
+    )
+    
+    parser.add_argument(
+        "--rule-report",
+        nargs="?",
+        const="",
+        metavar="FILE",
+        help="命令执行完毕后列出解析耗时最多的书源和规则，指定文件时同时保存JSON报告"
+    )
+    
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="记录本次执行的追踪数据（JSON Lines）到指定文件"
+    )
+    
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        choices=["", "cprofile", "sampling"],
+        metavar="MODE",
+        help="剖析本次执行：cprofile 或 sampling (默认: 配置文件中的 debug.profile_mode)"
+    )
+    
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        help="把本次执行的上游请求和响应录制到归档文件"
+    )
+    
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="从归档文件回放上游响应，不访问真实站点"
+    )
+    
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        help="回放时响应耗时的倍率，0 表示不等待 (默认: 配置文件中的 network.cassette.time_scale)"
+    )
+    
     parser.add_argument(
         "--output",
         default="output",
@@ -244,6 +433,28 @@ def main():
     
     # 创建应用实例
     app = BookSourceApp()
+    performance_config = app.engine.config.get("performance", {})
+    if args.trace:
+        tracing.configure({**app.engine.config.get("tracing", {}), "enabled": True, "export_path": args.trace})
+    if args.record or args.replay:
+        cassette_config = dict(app.engine.config.get("network", {}).get("cassette", {}))
+        cassette_config.update(mode="record" if args.record else "replay", path=args.record or args.replay)
+        if args.time_scale is not None:
+            cassette_config["time_scale"] = args.time_scale
+        app.engine.network.cassette = Cassette(cassette_config)
+    any_command = any([
+        args.generate_all, args.generate, args.test, args.track, args.check_updates,
+        args.download, args.warmup, args.subscription, args.list, args.stats, args.metrics,
+        args.rule_report is not None
+    ])
+    
+    profiler = None
+    if args.profile is not None:
+        command = next((name for name in (
+            "generate_all", "generate", "test", "track", "check_updates", "download", "warmup", "serve"
+        ) if getattr(args, name)), "main")
+        profiler = Profiler(args.profile or None, app.engine.config.get("debug", {}))
+        profiler.start(command)
     
     try:
         if args.generate_all:
@@ -275,8 +486,59 @@ def main():
                     print(f"   错误信息: {result.get('error', '未知错误')}")
                     sys.exit(1)
             
-            asyncio.run(run_test())
+            runtime.run(run_test(), performance_config)
 
+        elif args.track:
+            # 添加追更书籍
+            book = app.get_bookshelf().add_book(args.track[0], args.track[1])
+            print(f"✅ 已添加追更书籍: {book.source} {book.book_url}")
+            
+        elif args.check_updates:
+            # 检查书架更新
+            report = runtime.run(app.check_updates(), performance_config)
+            print("📚 书架更新检查完成:")
+            print(f"   检查书籍: {report['checked']}/{report['total']}")
+            print(f"   有更新: {report['updated']}")
+            print(f"   未变化: {report['unchanged'] + report['not_modified']} (条件请求命中 {report['not_modified']})")
+            print(f"   失败: {report['failed']}")
+            print(f"   吞吐量: {report['throughput']:.1f} 本/秒")
+            for book in report["updated_books"]:
+                print(f"   🆕 {book['name'] or book['book_url']}: {book['last_chapter']}")
+            print(f"\n书源滞后:")
+            for source_name, lag in report["source_lag"].items():
+                print(f"   {source_name}: {'有书籍尚未检查' if lag is None else f'{lag:.0f} 秒'}")
+            
+        elif args.download:
+            # 下载整本书
+            report = runtime.run(
+                app.download_book(args.download[0], args.download[1], args.format), performance_config
+            )
+            print(f"✅ 下载完成: {report['output_path']}")
+            print(f"   章节总数: {report['total']}")
+            if report['resumed_from']:
+                print(f"   断点续传: 从第 {report['resumed_from'] + 1} 章开始")
+            print(f"   失败章节: {len(report['failed'])}")
+            print(f"   速度: {report['throughput']:.1f} 章/秒")
+            
+        elif args.warmup:
+            # 预热书源站点
+            report = runtime.run(app.warm_up(), performance_config)
+            print("🔥 书源预热完成:")
+            print(f"   站点数: {report['hosts']}")
+            print(f"   域名解析成功: {report['resolved']}")
+            print(f"   已建立连接: {report['connected']}")
+            print(f"   耗时: {report['elapsed']:.2f} 秒")
+            for host, reason in report["failed"].items():
+                print(f"   ❌ {host}: {reason}")
+            
+        elif args.serve or (not any_command and app.engine.config.get("api", {}).get("enable_web_api", False)):
+            # 启动API服务
+            api_config = app.get_api_config(args.host, args.port, args.workers)
+            if api_config.get("workers", 1) > 1 and hasattr(os, "fork"):
+                app.serve_workers(api_config)
+            else:
+                runtime.run(app.serve(api_config), performance_config)
+            
         elif args.subscription:
             # 生成订阅文件
             from src.subscription import SubscriptionManager
@@ -306,6 +568,7 @@ def main():
             print(f"   可用书源: {stats['total_available']}")
             print(f"   已注册书源: {stats['total_registered']}")
             print(f"   注册率: {stats['registration_rate']:.1f}%")
+            print(f"   事件循环: {runtime.get_loop_name(performance_config)}")
             print(f"\n类型分布:")
             for source_type, count in stats['type_distribution'].items():
                 type_name = {0: "文本", 1: "音频", 2: "图片", 3: "文件"}.get(source_type, "未知")
@@ -314,9 +577,22 @@ def main():
             for group, count in stats['group_distribution'].items():
                 print(f"   {group}: {count}")
                 
-        else:
+        elif not args.metrics and args.rule_report is None:
             # 显示帮助信息
             parser.print_help()
+        
+        if args.rule_report is not None:
+            # 输出规则耗时报告
+            report = RULE_COSTS.report()
+            print(f"\n⏱️  {format_report(report)}")
+            if args.rule_report:
+                with open(args.rule_report, "w", encoding="utf-8") as f:
+                    json.dump(report, f, ensure_ascii=False, indent=2)
+                print(f"   报告已保存: {args.rule_report}")
+        
+        if args.metrics:
+            # 输出指标
+            print(metrics.REGISTRY.render(), end="")
             
     except KeyboardInterrupt:
         print("\n⚠️  操作被用户中断")
@@ -325,6 +601,15 @@ def main():
         print(f"❌ 程序执行出错: {e}")
         logging.getLogger("app").exception("程序执行异常")
         sys.exit(1)
+    finally:
+        if args.record:
+            app.engine.network.cassette.flush()
+        if profiler is not None and profiler.active:
+            path = profiler.stop()
+            print(f"\n🔍 性能剖析 ({profiler.mode}, {profiler.elapsed:.2f} 秒): {path}")
+            for name, value in profiler.top(10):
+                share = f"{value:.3f} 秒" if profiler.mode == "cprofile" else f"{value:.1%}"
+                print(f"   {share:>10}  {name}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,555 @@
+"""
+书源API服务 - Book Source API Server
+
+基于 aiohttp.web 的异步HTTP服务，多个客户端共用一个已预热的引擎：
+- 搜索结果按书源完成先后以 NDJSON（或 SSE）流式返回
+- 书籍详情、目录、正文与章节预读共用引擎的缓存
+- 相同的并发请求只向上游抓取一次
+- 响应带 ETag / Cache-Control，客户端可用 If-None-Match 条件请求
+- 按客户端IP限流，可选令牌认证和CORS
+- /metrics 以 Prometheus 文本格式导出指标
+- 开启 allow_profiling 后，带 X-Profile 请求头的请求会被单独剖析
+- 多 worker 模式：fork 多个进程分担解析负载，共享磁盘缓存
+"""
+
+import os
+import hmac
+import json
+import time
+import signal
+import socket
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import multiprocessing.connection
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+
+from src.core.engine import BookSourceEngine, BaseSource, ChapterNotFoundError, SourceNotFoundError
+from src.core.breaker import CircuitOpenError
+from src.core.cassette import Cassette
+from src.core import runtime, tracing
+from src.core.metrics import REGISTRY
+from src.core.rulecost import RULE_COSTS
+from src.core.regexguard import REGEX_GUARD
+from src.core.profiling import Profiler
+
+
+API_REQUESTS = REGISTRY.counter(
+    "book_source_api_requests_total", "API请求数（按接口和状态码）", ("endpoint", "status")
+)
+API_DURATION = REGISTRY.histogram(
+    "book_source_api_request_duration_seconds", "API请求处理耗时（流式搜索为完整输出耗时）", ("endpoint",)
+)
+
+DEFAULT_MAX_AGE = {
+    "search": 60,
+    "book": 600,
+    "toc": 300,
+    "content": 86400,
+}
+
+
+class BadRequestError(Exception):
+    """请求参数缺失或格式错误，返回 400"""
+
+
+def check_api_config(config: Dict[str, Any]):
+    """启动前校验配置，配置无法安全运行时抛出 ValueError"""
+    if config.get("auth_required", False) and not config.get("token", ""):
+        raise ValueError("已开启 auth_required 但未配置 token")
+
+
+class ApiServer:
+    """书源API服务"""
+
+    def __init__(self, engine: BookSourceEngine, config: Dict[str, Any] = None):
+        self.engine = engine
+        self.config = config or {}
+        check_api_config(self.config)
+        self.host = self.config.get("host", "127.0.0.1")
+        self.port = self.config.get("port", 8080)
+        self.cors_enabled = self.config.get("cors_enabled", True)
+        self.rate_limit = self.config.get("rate_limit", 100)  # 每个客户端每分钟请求数，0 表示不限；多 worker 时各自计数
+        self.auth_required = self.config.get("auth_required", False)
+        self.token = self.config.get("token", "")
+        self.max_age = {**DEFAULT_MAX_AGE, **self.config.get("cache_max_age", {})}
+        self.warmup = self.config.get("warmup", True)
+        self.allow_profiling = self.config.get("allow_profiling", False)
+
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.profilers: Dict[int, Profiler] = {}  # id(request) -> 正在剖析的请求
+        self.rate_window = 0
+        self.rate_counts: Dict[str, int] = {}
+        self.stats = {"requests": 0, "not_modified": 0, "cache_hits": 0, "shared": 0, "rate_limited": 0}
+
+        self.logger = logging.getLogger("server")
+
+    # ---- 应用 ----
+
+    def create_app(self) -> web.Application:
+        """创建 aiohttp 应用"""
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/api/sources", self.handle_sources)
+        app.router.add_get("/api/search", self.handle_search)
+        app.router.add_get("/api/book", self.handle_book)
+        app.router.add_get("/api/toc", self.handle_toc)
+        app.router.add_get("/api/content", self.handle_content)
+        app.router.add_get("/api/stats", self.handle_stats)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.on_startup.append(self._on_startup)
+        app.on_response_prepare.append(self._on_response_prepare)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app: web.Application):
+        if not self.engine.network.session:
+            await self.engine.network.create_session()
+        if self.warmup and self.engine.config.get("warmup", {}).get("enabled", False):
+            await self.engine.warm_up()
+        self.logger.info(f"API服务启动: http://{self.host}:{self.port}，书源 {len(self.engine.sources)} 个")
+
+    async def _on_cleanup(self, app: web.Application):
+        if self.engine.prefetcher:
+            await self.engine.prefetcher.close()
+        await self.engine.network.close_session()
+        tracing.flush()
+
+    async def _on_response_prepare(self, request: web.Request, response: web.StreamResponse):
+        # 流式响应在处理结束前就发出了响应头，剖析文件名在开始剖析时就已确定
+        profiler = self.profilers.get(id(request))
+        if profiler is not None:
+            response.headers["X-Profile-Id"] = profiler.name
+
+    async def serve(self, sock: Optional[socket.socket] = None, reuse_port: bool = False,
+                    on_ready: Optional[Callable[[], Any]] = None):
+        """启动服务，直到任务被取消
+
+        多 worker 模式下各进程以 reuse_port 绑定同一端口由内核分发连接，
+        或使用主进程预先绑定的 sock；开始监听后调用 on_ready 通知主进程。
+        """
+        runner = web.AppRunner(self.create_app())
+        await runner.setup()
+        if sock is not None:
+            site = web.SockSite(runner, sock)
+        else:
+            site = web.TCPSite(runner, self.host, self.port, reuse_port=reuse_port or None)
+        await site.start()
+        if on_ready is not None:
+            on_ready()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    # ---- 中间件 ----
+
+    def _check_rate_limit(self, client: str) -> bool:
+        """固定窗口限流，返回是否放行"""
+        if not self.rate_limit:
+            return True
+        window = int(time.monotonic() // 60)
+        if window != self.rate_window:
+            self.rate_window = window
+            self.rate_counts.clear()
+        count = self.rate_counts.get(client, 0) + 1
+        self.rate_counts[client] = count
+        return count <= self.rate_limit
+
+    def _check_token(self, request: web.Request) -> bool:
+        """校验 Bearer 令牌，按常量时间比较"""
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        return scheme == "Bearer" and hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.stats["requests"] += 1
+        start = time.monotonic()
+        if request.method == "OPTIONS" and self.cors_enabled:
+            response = web.Response(status=204)
+        elif self.auth_required and not self._check_token(request):
+            response = web.json_response({"error": "未授权"}, status=401)
+        elif not self._check_rate_limit(request.remote or ""):
+            self.stats["rate_limited"] += 1
+            response = web.json_response(
+                {"error": "请求过于频繁"}, status=429,
+                headers={"Retry-After": str(60 - int(time.monotonic() % 60))}
+            )
+        else:
+            profiler = None
+            try:
+                profiler = self._start_profiler(request)
+                response = await handler(request)
+            except web.HTTPException:
+                raise
+            except (SourceNotFoundError, ChapterNotFoundError) as e:
+                response = web.json_response({"error": str(e)}, status=404)
+            except BadRequestError as e:
+                response = web.json_response({"error": str(e)}, status=400)
+            except CircuitOpenError as e:
+                response = web.json_response(
+                    {"error": str(e)}, status=503, headers={"Retry-After": str(int(e.retry_after) + 1)}
+                )
+            except Exception as e:
+                self.logger.error(f"请求处理失败: {request.path_qs}, {e}")
+                response = web.json_response({"error": str(e)}, status=502)
+            finally:
+                if profiler is not None:
+                    profiler.stop()
+                    del self.profilers[id(request)]
+            if profiler is not None and not response.prepared:
+                response.headers["X-Profile-Id"] = profiler.name
+
+        endpoint = request.match_info.route.resource.canonical if request.match_info.route.resource else "unknown"
+        API_REQUESTS.inc(endpoint=endpoint, status=response.status)
+        API_DURATION.observe(time.monotonic() - start, endpoint=endpoint)
+
+        if self.cors_enabled and not response.prepared:
+            response.headers["Access-Control-Allow-Origin"] = "*"
+            response.headers["Access-Control-Allow-Headers"] = "Authorization, If-None-Match, X-Profile"
+            response.headers["Access-Control-Expose-Headers"] = "ETag, X-Profile-Id"
+        return response
+
+    def _start_profiler(self, request: web.Request) -> Optional[Profiler]:
+        """X-Profile: cprofile / sampling（或 1 使用配置的默认模式）时剖析本次请求"""
+        mode = request.headers.get("X-Profile", "").strip().lower()
+        if not mode or not self.allow_profiling:
+            return None
+        try:
+            profiler = Profiler(None if mode in ("1", "true") else mode, self.engine.config.get("debug", {}))
+        except ValueError as e:
+            raise BadRequestError(str(e)) from None
+        if not profiler.start(request.path):
+            return None
+        self.profilers[id(request)] = profiler
+        return profiler
+
+    # ---- 工具 ----
+
+    def _param(self, request: web.Request, name: str) -> str:
+        value = request.query.get(name, "").strip()
+        if not value:
+            raise BadRequestError(f"缺少参数: {name}")
+        return value
+
+    def _int_param(self, request: web.Request, name: str, default: Optional[int] = None) -> int:
+        if default is not None and name not in request.query:
+            return default
+        value = self._param(request, name)
+        try:
+            return int(value)
+        except ValueError:
+            raise BadRequestError(f"参数格式错误: {name}={value}") from None
+
+    def _source(self, request: web.Request) -> BaseSource:
+        name = self._param(request, "source")
+        source = self.engine.get_source(name)
+        if source is None:
+            raise SourceNotFoundError(f"书源不存在: {name}")
+        return source
+
+    def _json_response(self, request: web.Request, data: Any, kind: str) -> web.Response:
+        """带 ETag 和 Cache-Control 的JSON响应，ETag 匹配时返回 304"""
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={self.max_age[kind]}"}
+        if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+            self.stats["not_modified"] += 1
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="application/json", charset="utf-8", headers=headers)
+
+    async def _shared(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """相同键的并发请求共用一次上游抓取"""
+        future = self.inflight.get(key)
+        if future is not None:
+            self.stats["shared"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            result = await loader()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self.inflight[key]
+
+    async def _cached(self, key: str, kind: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """先查引擎缓存，未命中时抓取并写入"""
+        cached = self.engine.cache.get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return cached
+
+        async def load():
+            value = await loader()
+            if value:
+                self.engine.cache.set(key, value, self.max_age[kind])
+            return value
+
+        return await self._shared(key, load)
+
+    # ---- 接口 ----
+
+    async def handle_sources(self, request: web.Request) -> web.Response:
+        """已注册的书源"""
+        sources = [
+            {
+                "name": name,
+                "title": source.name,
+                "url": source.url,
+                "enabled": source.enabled,
+                "available": self.engine.is_source_available(source),
+            }
+            for name, source in self.engine.sources.items()
+        ]
+        return self._json_response(request, sources, "search")
+
+    async def handle_search(self, request: web.Request) -> web.StreamResponse:
+        """搜索：每个书源完成后立即输出一行结果"""
+        keyword = self._param(request, "q")
+        page = self._int_param(request, "page", 1)
+        sse = "text/event-stream" in request.headers.get("Accept", "")
+
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream; charset=utf-8" if sse else "application/x-ndjson; charset=utf-8",
+            "Cache-Control": "no-cache",
+        })
+        if self.cors_enabled:
+            response.headers["Access-Control-Allow-Origin"] = "*"
+        await response.prepare(request)
+
+        async def write(data: Dict[str, Any]):
+            line = json.dumps(data, ensure_ascii=False)
+            await response.write((f"data: {line}\n\n" if sse else f"{line}\n").encode("utf-8"))
+
+        start = time.monotonic()
+        total = 0
+        async for name, books in self.engine.search_iter(keyword, page):
+            total += len(books)
+            await write({"source": name, "books": [asdict(book) for book in books]})
+        await write({"done": True, "total": total, "elapsed": time.monotonic() - start})
+        await response.write_eof()
+        return response
+
+    async def handle_book(self, request: web.Request) -> web.Response:
+        """书籍详情"""
+        source = self._source(request)
+        url = self._param(request, "url")
+
+        async def load():
+            return asdict(await source.get_book_info(url))
+
+        data = await self._cached(f"book:{source.name}:{url}", "book", load)
+        return self._json_response(request, data, "book")
+
+    async def handle_toc(self, request: web.Request) -> web.Response:
+        """目录，缓存键与章节预读一致"""
+        source = self._source(request)
+        url = self._param(request, "url")
+
+        async def load():
+            return [asdict(chapter) for chapter in await source.get_toc(url)]
+
+        data = await self._cached(f"toc:{source.name}:{url}", "toc", load)
+        return self._json_response(request, data, "toc")
+
+    async def handle_content(self, request: web.Request) -> web.Response:
+        """正文：按章节地址（url）或目录地址加序号（toc、index，会触发预读）获取"""
+        source = self._source(request)
+        if "toc" in request.query:
+            toc_url = self._param(request, "toc")
+            index = self._int_param(request, "index")
+            name = self._param(request, "source")
+            content = await self._shared(
+                f"chapter:{source.name}:{toc_url}:{index}",
+                lambda: self.engine.read_chapter(name, toc_url, index)
+            )
+            return self._json_response(request, asdict(content), "content")
+
+        url = self._param(request, "url")
+
+        async def load():
+            return asdict(await source.get_full_content(url))
+
+        data = await self._cached(f"content:{source.name}:{url}", "content", load)
+        return self._json_response(request, data, "content")
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """Prometheus 指标"""
+        return web.Response(
+            text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+            headers={"Cache-Control": "no-store"}
+        )
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        """服务、网络和缓存统计"""
+        data = {
+            "server": {**self.stats, "inflight": len(self.inflight)},
+            "network": self.engine.network.get_stats(),
+            "cache": self.engine.cache.get_stats(),
+            "warmup": self.engine.warmup_report,
+            "metrics": REGISTRY.get_stats(),
+            "rule_costs": RULE_COSTS.report(10),
+            "regex": REGEX_GUARD.get_stats(),
+            "purify": {name: source.purifier.get_stats() for name, source in self.engine.sources.items()
+                       if hasattr(source, "purifier")},
+        }
+        if self.engine.prefetcher:
+            data["prefetch"] = self.engine.prefetcher.get_stats()
+        return web.json_response(data, dumps=lambda obj: json.dumps(obj, ensure_ascii=False, default=str),
+                                 headers={"Cache-Control": "no-store"})
+
+
+def _worker_output_path(path: str, pid: int) -> str:
+    """在文件名后加上进程号，如 traffic.cassette -> traffic.1234.cassette"""
+    base = Path(path)
+    return str(base.with_name(f"{base.stem}.{pid}{base.suffix}"))
+
+
+def _worker_main(index: int, config_path: str, api_config: Dict[str, Any], sock: Optional[socket.socket],
+                 ready: Any, cassette_config: Optional[Dict[str, Any]] = None,
+                 tracing_config: Optional[Dict[str, Any]] = None):
+    """worker 进程入口：fork 之后各自创建引擎、会话和内存缓存
+
+    录制归档和追踪文件按进程号分开写，避免多个 worker 交错写入同一个文件。
+    """
+    from src.sources.manager import SourceManager
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    engine = BookSourceEngine(config_path)
+    engine.cache.enable_shared()
+    pid = os.getpid()
+    if tracing_config is not None:
+        tracing.configure(tracing_config)
+    tracer = tracing.get_tracer()
+    if isinstance(tracer, tracing.Tracer):
+        tracer.export_path = _worker_output_path(tracer.export_path, pid)
+    if cassette_config is not None:
+        engine.network.cassette = Cassette(cassette_config)
+    if engine.network.cassette.recording:
+        engine.network.cassette.path = _worker_output_path(engine.network.cassette.path, pid)
+    SourceManager(engine).register_all_sources()
+
+    logger = logging.getLogger("server")
+    logger.info(f"worker {index} 启动，进程号 {pid}")
+    server = ApiServer(engine, api_config)
+    try:
+        runtime.run(server.serve(sock=sock, reuse_port=sock is None, on_ready=ready.set),
+                    engine.config.get("performance", {}))
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_workers(config_path: str, api_config: Dict[str, Any], workers: int,
+                  cassette_config: Optional[Dict[str, Any]] = None,
+                  tracing_config: Optional[Dict[str, Any]] = None):
+    """多 worker 服务模式（仅支持 fork 的平台）
+
+    支持 SO_REUSEPORT 时各 worker 自行绑定端口，由内核均衡分发连接；否则主进程预先绑定
+    监听套接字，fork 后由各 worker 共同 accept。限流计数在各 worker 内独立进行，
+    一个客户端的实际上限约为 rate_limit × 命中的 worker 数。
+
+    worker 在开始监听前退出（端口被占用、配置错误等）时整个服务退出；运行中异常退出的
+    worker 按指数退避重启，连续重启超过 max_restarts 次后服务退出。
+    """
+    check_api_config(api_config)
+    logger = logging.getLogger("server")
+    host = api_config.get("host", "127.0.0.1")
+    port = api_config.get("port", 8080)
+    max_restarts = api_config.get("max_restarts", 5)
+    restart_delay = api_config.get("restart_delay", 1.0)
+    max_restart_delay = api_config.get("max_restart_delay", 60.0)
+    stable_after = api_config.get("restart_reset_after", 60.0)  # 运行超过该时长后重新计算连续重启次数
+
+    sock = None
+    if not hasattr(socket, "SO_REUSEPORT"):
+        sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(1024)
+        sock.setblocking(False)
+
+    context = multiprocessing.get_context("fork")
+    processes: Dict[int, multiprocessing.Process] = {}
+    ready: Dict[int, Any] = {}
+    started: Dict[int, float] = {}
+    restarts: Dict[int, int] = {}
+    pending: Dict[int, float] = {}  # 等待重启的 worker -> 重启时间
+
+    def spawn(index: int):
+        ready[index] = context.Event()
+        process = context.Process(
+            target=_worker_main,
+            args=(index, config_path, api_config, sock, ready[index], cassette_config, tracing_config),
+            name=f"book-source-worker-{index}", daemon=True
+        )
+        process.start()
+        processes[index] = process
+        started[index] = time.monotonic()
+
+    for index in range(workers):
+        spawn(index)
+    logger.info(f"API服务启动 {workers} 个 worker: http://{host}:{port}")
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    previous = signal.signal(signal.SIGTERM, stop)
+    try:
+        while not stopping:
+            now = time.monotonic()
+            timeout = min([1.0] + [max(due - now, 0) for due in pending.values()])
+            multiprocessing.connection.wait(
+                [process.sentinel for index, process in processes.items() if index not in pending],
+                timeout=timeout
+            )
+            if stopping:
+                break
+            now = time.monotonic()
+            for index, process in list(processes.items()):
+                if index in pending:
+                    if now >= pending[index]:
+                        del pending[index]
+                        spawn(index)
+                    continue
+                if process.is_alive():
+                    continue
+                if not ready[index].is_set():
+                    raise RuntimeError(f"worker {index} 启动失败（退出码 {process.exitcode}），服务退出")
+                if now - started[index] >= stable_after:
+                    restarts[index] = 0
+                restarts[index] = restarts.get(index, 0) + 1
+                if restarts[index] > max_restarts:
+                    raise RuntimeError(f"worker {index} 连续重启 {max_restarts} 次后仍退出，服务退出")
+                delay = min(restart_delay * 2 ** (restarts[index] - 1), max_restart_delay)
+                logger.warning(
+                    f"worker {index} 退出（退出码 {process.exitcode}），{delay:.0f} 秒后第 {restarts[index]} 次重启"
+                )
+                pending[index] = now + delay
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            process.join(timeout=10)
+        if sock is not None:
+            sock.close()
+        logger.info("API服务已停止")
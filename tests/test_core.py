@@ -23,6 +23,34 @@ from src.core.engine import BookSourceEngine, BaseSource, BookInfo, ChapterInfo,
 from src.core.network import NetworkManager
 from src.core.rules import RuleEngine
 from src.core.cache import CacheManager
+from src.core.bookshelf import Bookshelf
+from src.core.downloader import BookDownloader
+from src.core.stitcher import ContentStitcher, build_page_template, merge_overlap
+from src.core.prefetch import ReadAheadPrefetcher
+from src.core.scheduler import RequestScheduler, Priority, request_priority, get_request_priority
+from src.core.breaker import CircuitBreakerRegistry, CircuitOpenError, CircuitState
+from src.core.mirrors import MirrorRegistry, extract_mirror_urls
+from src.core.response import HttpResponse, ResponseTooLargeError, read_limited
+from src.core.retry import RetryBudget, parse_retry_after, decorrelated_jitter
+from src.core.httpcache import CachedResponse, HttpCache, parse_cache_control
+from src.core.charset import CharsetDetector, sniff_charset, normalize_charset
+from src.core.cookies import CookieStore
+from src.core.proxy import ProxyPool
+from src.core import runtime
+
+
+def isolated_config(directory: str = None) -> str:
+    """复制默认配置，把缓存、Cookie 和 HTTP 缓存数据库指向临时目录，返回配置文件路径"""
+    directory = str(directory or tempfile.mkdtemp())
+    with open(Path(__file__).parent.parent / "config" / "settings.json", encoding="utf-8") as f:
+        config = json.load(f)
+    config["cache"]["cache_dir"] = os.path.join(directory, "cache")
+    config["network"]["cookies"]["db_path"] = os.path.join(directory, "cookies.db")
+    config["network"]["http_cache"]["db_path"] = os.path.join(directory, "http_cache.db")
+    path = os.path.join(directory, "settings.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False)
+    return path
 
 
 class TestBookSourceEngine:
@@ -347,5 +375,2297 @@ class TestBaseSource:
         assert legado_format["enabled"] == True
 
 
+class TestBookshelf:
+    """书架更新检查测试"""
+    
+    def setup_method(self):
+        """测试前设置"""
+        self.temp_dir = tempfile.mkdtemp()
+        
+        self.source = Mock(spec=BaseSource)
+        self.source.enabled = True
+        self.source.network = Mock()
+        self.source.get_book_info = AsyncMock(return_value=BookInfo(
+            name="测试书籍", last_chapter="第二章", toc_url="https://test.com/toc/1"
+        ))
+        
+        self.engine = Mock()
+        self.engine.get_source.side_effect = lambda name: self.source if name == "test_source" else None
+        
+        self.shelf = Bookshelf(self.engine, {
+            "db_path": os.path.join(self.temp_dir, "bookshelf.db"),
+            "batch_size": 2,
+            "request_delay": 0
+        })
+    
+    def teardown_method(self):
+        """测试后清理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def _response(self, status, headers=None):
+        response = Mock()
+        response.status = status
+        response.headers = headers or {}
+        return response
+    
+    def test_add_and_list(self):
+        """测试添加和列出追更书籍"""
+        self.shelf.add_book("test_source", "https://test.com/book/1", last_chapter="第一章")
+        
+        books = self.shelf.list_books()
+        assert len(books) == 1
+        assert books[0].last_chapter == "第一章"
+        assert self.shelf.remove_book("test_source", "https://test.com/book/1")
+        assert self.shelf.count() == 0
+    
+    @pytest.mark.asyncio
+    async def test_sweep_detects_update(self):
+        """测试扫描检测到更新"""
+        self.source.network.head = AsyncMock(return_value=self._response(200))
+        self.shelf.add_book("test_source", "https://test.com/book/1", last_chapter="第一章")
+        self.shelf.add_book("test_source", "https://test.com/book/2", last_chapter="第二章")
+        self.shelf.add_book("missing_source", "https://test.com/book/3")
+        
+        report = await self.shelf.sweep()
+        
+        assert report.total == 3
+        assert report.checked == 2
+        assert report.updated == 1
+        assert report.unchanged == 1
+        assert report.skipped == 1
+        assert report.updated_books[0].book_url == "https://test.com/book/1"
+        assert self.shelf.get_book("test_source", "https://test.com/book/1").last_chapter == "第二章"
+        assert "test_source" in report.source_lag
+        json.dumps(report.to_dict())
+    
+    @pytest.mark.asyncio
+    async def test_conditional_request_skips_unchanged(self):
+        """测试条件请求命中时跳过书籍详情"""
+        self.source.network.head = AsyncMock(return_value=self._response(200, {"ETag": '"v1"'}))
+        self.shelf.add_book("test_source", "https://test.com/book/1", last_chapter="第二章")
+        await self.shelf.sweep()
+        
+        self.source.network.head = AsyncMock(return_value=self._response(304))
+        self.source.get_book_info.reset_mock()
+        report = await self.shelf.sweep()
+        
+        assert report.not_modified == 1
+        self.source.get_book_info.assert_not_called()
+        headers = self.source.network.head.call_args.kwargs["headers"]
+        assert headers["If-None-Match"] == '"v1"'
+    
+    @pytest.mark.asyncio
+    async def test_probe_disabled_without_validators(self):
+        """测试站点不支持校验值时不再探测"""
+        self.source.network.head = AsyncMock(return_value=self._response(200))
+        self.shelf.add_book("test_source", "https://test.com/book/1")
+        await self.shelf.sweep()
+        await self.shelf.sweep()
+        
+        assert self.source.network.head.call_count == 1
+        assert self.source.get_book_info.call_count == 2
+    
+    def test_source_lag_never_checked_is_none(self):
+        """测试从未检查过的书源滞后为None（可序列化为JSON）"""
+        self.shelf.add_book("test_source", "https://test.com/book/1")
+        
+        assert self.shelf.get_source_lag() == {"test_source": None}
+    
+    @pytest.mark.asyncio
+    async def test_global_slot_not_held_during_source_delay(self):
+        """测试等待书源请求间隔的任务不占用全局并发"""
+        self.shelf.concurrent_requests = 1
+        self.shelf.request_delay = 0.3
+        self.shelf.per_source_concurrency = 1
+        self.source.network.head = AsyncMock(return_value=self._response(200))
+        other = Mock(spec=BaseSource)
+        other.enabled = True
+        other.network = Mock()
+        other.network.head = AsyncMock(return_value=self._response(200))
+        other.get_book_info = AsyncMock(return_value=BookInfo(last_chapter="第一章"))
+        sources = {"test_source": self.source, "other": other}
+        self.engine.get_source.side_effect = sources.get
+        self.shelf.add_book("test_source", "https://test.com/book/1", priority=2)
+        self.shelf.add_book("test_source", "https://test.com/book/2", priority=1)
+        self.shelf.add_book("other", "https://other.com/book/1")
+        
+        finished = {}
+        started = asyncio.get_running_loop().time()
+        original = self.shelf.check_book
+        
+        async def check_book(book):
+            result = await original(book)
+            finished[book.book_url] = asyncio.get_running_loop().time() - started
+            return result
+        
+        self.shelf.check_book = check_book
+        self.shelf.batch_size = 10
+        await self.shelf.sweep()
+        
+        assert finished["https://other.com/book/1"] < 0.2
+        assert finished["https://test.com/book/2"] >= 0.3
+
+
+class TestBookDownloader:
+    """整书下载器测试"""
+    
+    def setup_method(self):
+        """测试前设置"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.downloader = BookDownloader({
+            "chapter_retries": 1,
+            "retry_delay": 0,
+            "window_size": 4,
+            "checkpoint_interval": 1
+        })
+        self.chapters = [
+            ChapterInfo(name=f"第{i}章", url=f"https://test.com/chapter/{i}")
+            for i in range(10)
+        ]
+    
+    def teardown_method(self):
+        """测试后清理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def _source(self, fail_urls=()):
+        async def get_content(chapter_url):
+            index = int(chapter_url.rsplit("/", 1)[1])
+            # 倒序完成，验证写入仍按目录顺序
+            await asyncio.sleep((10 - index) * 0.001)
+            if chapter_url in fail_urls:
+                raise Exception("网络错误")
+            return ContentInfo(title=f"第{index}章", content=f"内容{index}")
+        
+        source = Mock(spec=BaseSource)
+        source.name = "测试书源"
+        source.get_full_content = AsyncMock(side_effect=get_content)
+        return source
+    
+    @pytest.mark.asyncio
+    async def test_download_txt_in_order(self):
+        """测试TXT按目录顺序写入"""
+        output_path = os.path.join(self.temp_dir, "book.txt")
+        report = await self.downloader.download(self._source(), self.chapters, output_path, title="测试书籍")
+        
+        with open(output_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        
+        positions = [text.index(f"内容{i}") for i in range(10)]
+        assert positions == sorted(positions)
+        assert report.downloaded == 10
+        assert not os.path.exists(output_path + ".progress.json")
+    
+    @pytest.mark.asyncio
+    async def test_failed_chapter_retried_and_recorded(self):
+        """测试失败章节重试并记录"""
+        source = self._source(fail_urls={"https://test.com/chapter/3"})
+        output_path = os.path.join(self.temp_dir, "book.txt")
+        report = await self.downloader.download(source, self.chapters, output_path)
+        
+        assert report.failed == [3]
+        assert report.downloaded == 9
+        assert source.get_full_content.call_count == 11
+    
+    @pytest.mark.asyncio
+    async def test_resume_from_checkpoint(self):
+        """测试断点续传"""
+        output_path = os.path.join(self.temp_dir, "book.txt")
+        source = self._source()
+        
+        # 模拟写入第5章时崩溃
+        original_write = BookDownloader._save_checkpoint
+        calls = []
+        
+        def crash_after(downloader, path, checkpoint):
+            original_write(downloader, path, checkpoint)
+            calls.append(checkpoint)
+            if checkpoint["next_index"] == 5:
+                raise KeyboardInterrupt
+        
+        with patch.object(BookDownloader, "_save_checkpoint", crash_after):
+            with pytest.raises(KeyboardInterrupt):
+                await self.downloader.download(source, self.chapters, output_path, book_key="book-1")
+        
+        source.get_full_content.reset_mock()
+        report = await self.downloader.download(source, self.chapters, output_path, book_key="book-1")
+        
+        assert report.resumed_from == 5
+        assert source.get_full_content.call_count == 5
+        with open(output_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        assert all(text.count(f"内容{i}") == 1 for i in range(10))
+
+    async def _interrupt_at(self, source, output_path, next_index, fmt="txt"):
+        original_write = BookDownloader._save_checkpoint
+
+        def crash_after(downloader, path, checkpoint):
+            original_write(downloader, path, checkpoint)
+            if checkpoint["next_index"] == next_index:
+                raise KeyboardInterrupt
+
+        with patch.object(BookDownloader, "_save_checkpoint", crash_after):
+            with pytest.raises(KeyboardInterrupt):
+                await self.downloader.download(source, self.chapters, output_path, fmt=fmt, book_key="book-1")
+
+    @pytest.mark.asyncio
+    async def test_resume_ignored_when_output_deleted(self):
+        """测试已写入的文件被删除时忽略检查点，从头下载"""
+        output_path = os.path.join(self.temp_dir, "book.txt")
+        source = self._source()
+        await self._interrupt_at(source, output_path, 5)
+        os.remove(output_path)
+
+        report = await self.downloader.download(source, self.chapters, output_path, book_key="book-1")
+
+        assert report.resumed_from == 0
+        with open(output_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        assert all(text.count(f"内容{i}") == 1 for i in range(10))
+
+    @pytest.mark.asyncio
+    async def test_resume_retries_failed_chapters(self):
+        """测试续传时重新下载检查点中失败的章节"""
+        output_path = os.path.join(self.temp_dir, "book.txt")
+        await self._interrupt_at(self._source(fail_urls={"https://test.com/chapter/2"}), output_path, 5)
+
+        report = await self.downloader.download(self._source(), self.chapters, output_path, book_key="book-1")
+
+        assert report.resumed_from == 2
+        assert report.failed == []
+        with open(output_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        assert "本章下载失败" not in text
+        assert all(text.count(f"内容{i}") == 1 for i in range(10))
+
+    @pytest.mark.asyncio
+    async def test_epub_parts_kept_on_error(self):
+        """测试出错中止时保留EPUB暂存目录，续传接着写"""
+        output_path = os.path.join(self.temp_dir, "book.epub")
+        await self._interrupt_at(self._source(), output_path, 5, fmt="epub")
+        assert os.path.exists(output_path + ".parts")
+        assert not os.path.exists(output_path)
+
+        report = await self.downloader.download(self._source(), self.chapters, output_path, fmt="epub",
+                                                book_key="book-1")
+        assert report.resumed_from == 5
+
+    @pytest.mark.asyncio
+    async def test_empty_chapter_list(self):
+        """测试空目录正常完成，没有检查点可删除时不报错"""
+        output_path = os.path.join(self.temp_dir, "book.txt")
+        report = await self.downloader.download(self._source(), [], output_path)
+
+        assert report.total == 0 and report.failed == []
+
+    @pytest.mark.asyncio
+    async def test_checkpoint_kept_until_failed_chapters_succeed(self):
+        """测试有失败章节时保留检查点，再次运行只从失败章节重新下载"""
+        output_path = os.path.join(self.temp_dir, "book.epub")
+        report = await self.downloader.download(self._source(fail_urls={"https://test.com/chapter/7"}),
+                                                self.chapters, output_path, fmt="epub", book_key="book-1")
+        assert report.failed == [7]
+        assert os.path.exists(output_path + ".progress.json")
+
+        source = self._source()
+        report = await self.downloader.download(source, self.chapters, output_path, fmt="epub", book_key="book-1")
+
+        assert report.resumed_from == 7 and report.failed == []
+        assert source.get_full_content.call_count == 3
+        assert not os.path.exists(output_path + ".progress.json")
+        assert not os.path.exists(output_path + ".parts")
+
+    @pytest.mark.asyncio
+    async def test_busy_host_does_not_hold_global_slots(self):
+        """测试等待繁忙主机的章节不占用全局名额，其他主机的章节照常下载"""
+        downloader = BookDownloader({"concurrent_requests": 2, "per_host_concurrency": 1, "window_size": 4})
+        chapters = [ChapterInfo(name=f"第{i}章", url=f"https://slow.com/chapter/{i}") for i in range(3)]
+        chapters.append(ChapterInfo(name="第3章", url="https://fast.com/chapter/3"))
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        started = {}
+
+        async def get_content(chapter_url):
+            started[chapter_url] = loop.time() - start
+            await asyncio.sleep(0.1 if "slow.com" in chapter_url else 0)
+            return ContentInfo(content="内容")
+
+        source = Mock(spec=BaseSource)
+        source.get_full_content = AsyncMock(side_effect=get_content)
+        await downloader.download(source, chapters, os.path.join(self.temp_dir, "book.txt"))
+
+        assert started["https://fast.com/chapter/3"] < 0.05
+
+    @pytest.mark.asyncio
+    async def test_download_epub(self):
+        """测试EPUB导出"""
+        import zipfile
+        output_path = os.path.join(self.temp_dir, "book.epub")
+        await self.downloader.download(self._source(), self.chapters, output_path, fmt="epub", title="测试书籍")
+        
+        with zipfile.ZipFile(output_path) as epub:
+            names = epub.namelist()
+            assert names[0] == "mimetype"
+            assert "OEBPS/chapter_00009.xhtml" in names
+            assert "内容9" in epub.read("OEBPS/chapter_00009.xhtml").decode("utf-8")
+        assert not os.path.exists(output_path + ".parts")
+
+
+class TestContentStitcher:
+    """正文分页拼接测试"""
+    
+    def setup_method(self):
+        """测试前设置"""
+        self.stitcher = ContentStitcher({"speculative_pages": 3})
+    
+    def _pages(self, pages, base="https://test.com/1/100"):
+        urls = [f"{base}.html"] + [f"{base}_{i}.html" for i in range(2, len(pages) + 1)]
+        site = {
+            url: ContentInfo(title="第一章", content=text, next_url=urls[i + 1] if i + 1 < len(urls) else "")
+            for i, (url, text) in enumerate(zip(urls, pages))
+        }
+        requested = []
+        
+        async def fetch(url):
+            requested.append(url)
+            await asyncio.sleep(0)
+            return site.get(url, ContentInfo())
+        
+        return urls[0], fetch, requested
+    
+    def test_build_page_template(self):
+        """测试分页地址模板推断"""
+        template = build_page_template("https://test.com/1/100.html", "https://test.com/1/100_2.html")
+        assert template(3) == "https://test.com/1/100_3.html"
+        
+        template = build_page_template("https://test.com/read?id=1", "https://test.com/read?id=1&page=2")
+        assert template(4) == "https://test.com/read?id=1&page=4"
+        
+        assert build_page_template("https://test.com/1/100.html", "https://test.com/1/101.html") is None
+    
+    def test_merge_overlap(self):
+        """测试页面边界去重"""
+        merged = merge_overlap("第一段\n第二段", "第二段\n第三段")
+        assert merged == "第一段\n第二段\n第三段"
+        assert merge_overlap("第一段", "第二段") == "第一段\n第二段"
+    
+    @pytest.mark.asyncio
+    async def test_single_page(self):
+        """测试单页章节直接返回"""
+        url, fetch, requested = self._pages(["唯一一页"])
+        content = await self.stitcher.stitch(fetch, url)
+        assert content.content == "唯一一页"
+        assert requested == [url]
+    
+    @pytest.mark.asyncio
+    async def test_stitch_with_speculative_prefetch(self):
+        """测试可预测分页并发预取并拼接"""
+        url, fetch, requested = self._pages(["第一段\n第二段", "第二段\n第三段", "第四段"])
+        content = await self.stitcher.stitch(fetch, url)
+        
+        assert content.content == "第一段\n第二段\n第三段\n第四段"
+        assert content.next_url == ""
+        # 第2页之后的页面已被提前请求
+        assert "https://test.com/1/100_4.html" in requested
+
+    @pytest.mark.asyncio
+    async def test_short_chapter_does_not_overshoot(self):
+        """测试短章节不会在末页之后发出多余的预取请求"""
+        url, fetch, requested = self._pages(["第一段", "第二段"])
+        content = await self.stitcher.stitch(fetch, url)
+
+        assert content.content == "第一段\n第二段"
+        assert requested == [url, "https://test.com/1/100_2.html"]
+
+    @pytest.mark.asyncio
+    async def test_prefetch_window_grows(self):
+        """测试预取窗口逐页增长，末页之后最多多请求 speculative_pages 页"""
+        url, fetch, requested = self._pages([f"第{i}段" for i in range(1, 9)])
+        content = await self.stitcher.stitch(fetch, url)
+
+        assert content.content == "\n".join(f"第{i}段" for i in range(1, 9))
+        assert "https://test.com/1/100_6.html" in requested
+        assert len(set(requested)) <= 8 + 3
+
+    @pytest.mark.asyncio
+    async def test_unpredictable_urls_followed_serially(self):
+        """测试地址不可预测时串行跟随"""
+        site = {
+            "https://test.com/a": ContentInfo(content="一", next_url="https://test.com/b"),
+            "https://test.com/b": ContentInfo(content="二", next_url="https://test.com/c"),
+            "https://test.com/c": ContentInfo(content="三"),
+        }
+        
+        async def fetch(url):
+            return site[url]
+        
+        content = await self.stitcher.stitch(fetch, "https://test.com/a")
+        assert content.content == "一\n二\n三"
+
+
+class TestReadAheadPrefetcher:
+    """章节预读测试"""
+    
+    def setup_method(self):
+        """测试前设置"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = CacheManager({
+            "cache_dir": self.temp_dir,
+            "file_cache": False,
+            "db_cache": False
+        })
+        self.prefetcher = ReadAheadPrefetcher(self.cache, {"min_depth": 2, "max_depth": 5})
+        
+        chapters = [ChapterInfo(name=f"第{i}章", url=f"https://test.com/chapter/{i}") for i in range(10)]
+        
+        async def get_content(chapter_url):
+            await asyncio.sleep(0.001)
+            return ContentInfo(title=chapter_url, content=f"内容 {chapter_url}")
+        
+        self.source = Mock(spec=BaseSource)
+        self.source.name = "测试书源"
+        self.source.get_toc = AsyncMock(return_value=chapters)
+        self.source.get_full_content = AsyncMock(side_effect=get_content)
+    
+    def teardown_method(self):
+        """测试后清理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    @pytest.mark.asyncio
+    async def test_next_chapter_is_cache_hit(self):
+        """测试下一章命中预读缓存"""
+        content = await self.prefetcher.get_content(self.source, "toc", 0)
+        assert content.content == "内容 https://test.com/chapter/0"
+        
+        await asyncio.sleep(0.05)
+        content = await self.prefetcher.get_content(self.source, "toc", 1)
+        
+        assert content.content == "内容 https://test.com/chapter/1"
+        assert self.prefetcher.hits == 1
+        assert self.prefetcher.prefetched >= 2
+        # 目录只请求一次
+        assert self.source.get_toc.call_count == 1
+        await self.prefetcher.close()
+    
+    def test_depth_adapts_to_reading_rate(self):
+        """测试预读深度随阅读速度和延迟调整"""
+        from src.core.prefetch import _ReadingState
+        state = _ReadingState()
+        assert self.prefetcher.get_depth(state) == 2
+        
+        self.prefetcher.latency = 0.5
+        state.read_interval = 60
+        assert self.prefetcher.get_depth(state) == 3
+        
+        state.read_interval = 0.1
+        assert self.prefetcher.get_depth(state) == 5
+    
+    @pytest.mark.asyncio
+    async def test_out_of_range(self):
+        """测试章节序号越界"""
+        with pytest.raises(IndexError):
+            await self.prefetcher.get_content(self.source, "toc", 10)
+
+
+class TestRequestScheduler:
+    """请求调度器测试"""
+    
+    async def _run_order(self, scheduler, requests):
+        """名额耗尽后排队，逐个释放并记录出队顺序"""
+        await scheduler.acquire("hold", Priority.INTERACTIVE)
+        order = []
+        
+        async def worker(label, host, priority):
+            await scheduler.acquire(host, priority)
+            order.append(label)
+            scheduler.release(host)
+        
+        tasks = [asyncio.ensure_future(worker(*request)) for request in requests]
+        await asyncio.sleep(0)
+        scheduler.release("hold")
+        await asyncio.gather(*tasks)
+        return order
+    
+    @pytest.mark.asyncio
+    async def test_interactive_uses_reserved_slots(self):
+        """测试后台请求占满时交互请求仍可立即执行"""
+        scheduler = RequestScheduler({"max_concurrency": 3, "reserved_interactive": 1})
+        await scheduler.acquire("a.com", Priority.BULK)
+        await scheduler.acquire("a.com", Priority.BULK)
+        
+        bulk = asyncio.ensure_future(scheduler.acquire("a.com", Priority.BULK))
+        await asyncio.sleep(0)
+        assert not bulk.done()
+        
+        await asyncio.wait_for(scheduler.acquire("b.com", Priority.INTERACTIVE), 0.1)
+        assert scheduler.get_stats()["queued"]["bulk"] == 1
+        
+        # 交互请求占用的是预留名额，批量请求要等后台名额空出
+        scheduler.release("b.com")
+        await asyncio.sleep(0)
+        assert not bulk.done()
+        scheduler.release("a.com")
+        await asyncio.wait_for(bulk, 0.1)
+    
+    @pytest.mark.asyncio
+    async def test_weighted_fair_order(self):
+        """测试交互请求优先于批量请求出队"""
+        scheduler = RequestScheduler({"max_concurrency": 1, "reserved_interactive": 0})
+        requests = [(f"bulk{i}", "a.com", Priority.BULK) for i in range(3)]
+        requests += [(f"ui{i}", "b.com", Priority.INTERACTIVE) for i in range(3)]
+        
+        order = await self._run_order(scheduler, requests)
+        
+        assert order[:3] == ["ui0", "ui1", "ui2"]
+    
+    @pytest.mark.asyncio
+    async def test_fair_across_hosts(self):
+        """测试同优先级下各主机轮流出队"""
+        scheduler = RequestScheduler({"max_concurrency": 1, "reserved_interactive": 0})
+        requests = [("a0", "a.com", Priority.BULK), ("a1", "a.com", Priority.BULK),
+                    ("a2", "a.com", Priority.BULK), ("b0", "b.com", Priority.BULK)]
+        
+        order = await self._run_order(scheduler, requests)
+        
+        assert order.index("b0") <= 1
+    
+    @pytest.mark.asyncio
+    async def test_overdue_request_first(self):
+        """测试超过截止时间的请求优先出队"""
+        scheduler = RequestScheduler({
+            "max_concurrency": 1,
+            "reserved_interactive": 0,
+            "deadlines": {"bulk": 0}
+        })
+        await asyncio.sleep(0.001)
+        order = await self._run_order(scheduler, [
+            ("bulk", "a.com", Priority.BULK),
+            ("ui", "b.com", Priority.INTERACTIVE)
+        ])
+        
+        assert order == ["bulk", "ui"]
+    
+    def test_request_priority_context(self):
+        """测试上下文优先级"""
+        assert get_request_priority() == Priority.INTERACTIVE
+        with request_priority(Priority.BULK):
+            assert get_request_priority() == Priority.BULK
+        assert get_request_priority() == Priority.INTERACTIVE
+
+
+class TestCircuitBreaker:
+    """熔断器测试"""
+    
+    def setup_method(self):
+        """测试前设置"""
+        self.breakers = CircuitBreakerRegistry({
+            "min_requests": 4,
+            "error_threshold": 0.5,
+            "open_timeout": 30
+        })
+    
+    def _trip(self, host="a.com"):
+        """连续失败直到熔断"""
+        for _ in range(4):
+            self.breakers.before_request(host)
+            self.breakers.record_failure(host)
+    
+    def test_open_after_threshold(self):
+        """测试错误率超过阈值后熔断"""
+        for _ in range(2):
+            self.breakers.record_success("a.com")
+        self.breakers.record_failure("a.com")
+        assert not self.breakers.is_open("a.com")
+        
+        self.breakers.record_failure("a.com")
+        assert self.breakers.is_open("a.com")
+        assert self.breakers.open_hosts() == ["a.com"]
+        assert not self.breakers.is_open("b.com")
+    
+    def test_fail_fast_when_open(self):
+        """测试熔断期间请求直接失败"""
+        self._trip()
+        
+        with pytest.raises(CircuitOpenError) as exc_info:
+            self.breakers.before_request("a.com")
+        assert exc_info.value.host == "a.com"
+        assert exc_info.value.retry_after > 0
+    
+    def test_half_open_single_probe(self):
+        """测试冷却结束后只放行一个探测请求，探测成功后恢复"""
+        self._trip()
+        breaker = self.breakers.get("a.com")
+        breaker.opened_at -= breaker.cooldown
+        
+        self.breakers.before_request("a.com")
+        assert breaker.state == CircuitState.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            self.breakers.before_request("a.com")
+        
+        self.breakers.record_success("a.com")
+        assert breaker.state == CircuitState.CLOSED
+        self.breakers.before_request("a.com")
+    
+    def test_probe_failure_doubles_cooldown(self):
+        """测试探测失败后重新熔断且冷却时间翻倍"""
+        self._trip()
+        breaker = self.breakers.get("a.com")
+        breaker.opened_at -= breaker.cooldown
+        
+        self.breakers.before_request("a.com")
+        self.breakers.record_failure("a.com")
+        
+        assert breaker.state == CircuitState.OPEN
+        assert breaker.cooldown == 60
+
+    def test_inflight_results_ignored_while_open(self):
+        """测试打开期间陆续返回的在途请求结果不会再次熔断"""
+        self._trip()
+        breaker = self.breakers.get("a.com")
+
+        for _ in range(30):
+            self.breakers.record_failure("a.com")
+        self.breakers.record_success("a.com")
+
+        assert breaker.open_count == 1
+        assert breaker.cooldown == 30
+        assert breaker.get_stats()["requests"] == 0
+
+    @pytest.mark.asyncio
+    async def test_network_fails_fast(self):
+        """测试网络层对熔断主机不再发出请求"""
+        network = NetworkManager({"retry_times": 0, "circuit_breaker": {"min_requests": 1}})
+        with patch('aiohttp.ClientSession.request') as mock_request:
+            mock_response = AsyncMock()
+            mock_response.status = 503
+            mock_response.headers = {}
+            mock_response.url = "https://down.com/"
+            mock_response.method = "GET"
+            mock_response.read.return_value = b""
+            mock_response.__aenter__.return_value = mock_response
+            mock_request.return_value = mock_response
+            
+            async with network:
+                response = await network.get("https://down.com/")
+                assert response.status == 503
+                with pytest.raises(CircuitOpenError):
+                    await network.get("https://down.com/page")
+            
+            assert mock_request.call_count == 1
+        assert "down.com" in network.get_stats()["circuit_breakers"]
+    
+    @pytest.mark.asyncio
+    async def test_search_all_skips_open_source(self):
+        """测试全局搜索跳过熔断中的书源"""
+        engine = BookSourceEngine(isolated_config())
+        for name, url in [("down", "https://down.com"), ("up", "https://up.com")]:
+            source = Mock(spec=BaseSource)
+            source.enabled = True
+            source.url = url
+            source.search = AsyncMock(return_value=[
+                BookInfo(name="测试书籍", author="测试作者", book_url=f"{url}/book/1")
+            ])
+            engine.register_source(name, source)
+        for _ in range(5):
+            engine.network.breakers.record_failure("down.com")
+        
+        results = await engine.search_all("测试")
+        
+        assert results["down"] == []
+        assert len(results["up"]) == 1
+        engine.sources["down"].search.assert_not_called()
+
+
+class TestMirrors:
+    """镜像对冲请求测试"""
+    
+    def setup_method(self):
+        """测试前设置"""
+        self.network = NetworkManager({"mirrors": {"default_delay": 0.05}})
+        self.network.mirrors.register(["https://a.com", "https://b.com"])
+        self.calls = []
+        self.cancelled = []
+    
+    def _fake_send(self, delays, statuses=None):
+        """按主机模拟延迟和状态码"""
+        statuses = statuses or {}
+        
+        async def send(method, url, **kwargs):
+            host = url.split("/")[2]
+            self.calls.append(host)
+            try:
+                await asyncio.sleep(delays[host])
+            except asyncio.CancelledError:
+                self.cancelled.append(host)
+                raise
+            return HttpResponse(statuses.get(host, 200), body=host.encode(), url=url)
+        
+        self.network._send = send
+    
+    def test_extract_mirror_urls(self):
+        """测试从书源注释解析镜像"""
+        urls = extract_mirror_urls({
+            "bookSourceUrl": "https://www.23qb.com",
+            "bookSourceComment": "交流群：https://t.me/group\n备用：https://www.23qb.net、https://23qb.org/",
+        })
+        
+        assert urls == ["https://www.23qb.com", "https://www.23qb.net", "https://23qb.org"]
+    
+    @pytest.mark.asyncio
+    async def test_hedge_to_mirror_when_slow(self):
+        """测试主站超过延迟阈值时向镜像对冲，慢的请求被取消"""
+        self._fake_send({"a.com": 1.0, "b.com": 0.01})
+        
+        response = await self.network.get("https://a.com/book/1")
+        await asyncio.sleep(0)
+        
+        assert await response.text() == "b.com"
+        assert self.calls == ["a.com", "b.com"]
+        assert self.cancelled == ["a.com"]
+        assert self.network.mirrors.hedge_wins == 1
+    
+    @pytest.mark.asyncio
+    async def test_no_hedge_when_fast(self):
+        """测试主站及时响应时不对冲"""
+        self._fake_send({"a.com": 0.0, "b.com": 0.0})
+        
+        response = await self.network.get("https://a.com/book/1")
+        
+        assert await response.text() == "a.com"
+        assert self.calls == ["a.com"]
+    
+    @pytest.mark.asyncio
+    async def test_failed_primary_falls_back(self):
+        """测试主站返回错误时立即改用镜像"""
+        self._fake_send({"a.com": 0.0, "b.com": 0.0}, {"a.com": 503})
+        
+        response = await self.network.get("https://a.com/book/1")
+        
+        assert response.status == 200
+        assert await response.text() == "b.com"
+    
+    def test_learn_fastest_mirror(self):
+        """测试按历史耗时选出最快的镜像作为首选"""
+        mirrors = self.network.mirrors
+        for _ in range(5):
+            mirrors.record("a.com", 0.8)
+            mirrors.record("b.com", 0.1)
+        
+        assert mirrors.fastest("a.com") == "b.com"
+        assert mirrors.candidates("https://a.com/x?p=1") == ["https://b.com/x?p=1", "https://a.com/x?p=1"]
+        assert mirrors.hedge_delay("b.com") == pytest.approx(0.1)
+
+
+class TestRetryBudget:
+    """重试预算测试"""
+    
+    def test_parse_retry_after(self):
+        """测试解析 Retry-After"""
+        from datetime import datetime, timezone
+        now = datetime(2024, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+        
+        assert parse_retry_after("120") == 120
+        assert parse_retry_after("Mon, 01 Jan 2024 00:00:30 GMT", now) == 30
+        assert parse_retry_after("soon") is None
+        assert parse_retry_after(None) is None
+    
+    def test_decorrelated_jitter_bounds(self):
+        """测试退避时间在 [base, min(cap, 3 * previous)] 之间"""
+        for _ in range(100):
+            delay = decorrelated_jitter(4.0, 1.0, 10.0)
+            assert 1.0 <= delay <= 10.0
+        assert decorrelated_jitter(100.0, 1.0, 10.0) <= 10.0
+    
+    def test_budget_exhaustion_and_refill(self):
+        """测试预算耗尽后拒绝重试，成功请求存入令牌"""
+        budget = RetryBudget({"max_tokens": 2, "budget_ratio": 0.5, "min_per_second": 0})
+        
+        assert budget.withdraw("a.com")
+        assert budget.withdraw("a.com")
+        assert not budget.withdraw("a.com")
+        assert budget.withdraw("b.com")
+        
+        budget.deposit("a.com")
+        budget.deposit("a.com")
+        assert budget.withdraw("a.com")
+        assert budget.get_stats()["denied"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_network_respects_budget(self):
+        """测试网络层重试受预算限制并遵守 Retry-After"""
+        network = NetworkManager({
+            "retry_times": 3,
+            "retry": {"max_tokens": 1, "min_per_second": 0, "base_delay": 0.001, "max_delay": 0.002}
+        })
+        with patch('aiohttp.ClientSession.request') as mock_request, \
+                patch('asyncio.sleep', new=AsyncMock()) as mock_sleep:
+            mock_response = AsyncMock()
+            mock_response.status = 503
+            mock_response.headers = {"Retry-After": "2"}
+            mock_response.url = "https://busy.com/"
+            mock_response.method = "GET"
+            mock_response.read.return_value = b""
+            mock_response.__aenter__.return_value = mock_response
+            mock_request.return_value = mock_response
+            
+            async with network:
+                response = await network.get("https://busy.com/")
+            
+            assert response.status == 503
+            assert mock_request.call_count == 2
+            mock_sleep.assert_awaited_once_with(2.0)
+    
+    @pytest.mark.asyncio
+    async def test_long_retry_after_not_retried(self):
+        """测试 Retry-After 超过上限时直接返回"""
+        network = NetworkManager({"retry_times": 3, "retry": {"max_retry_after": 10}})
+        with patch('aiohttp.ClientSession.request') as mock_request:
+            mock_response = AsyncMock()
+            mock_response.status = 429
+            mock_response.headers = {"Retry-After": "3600"}
+            mock_response.url = "https://busy.com/"
+            mock_response.method = "GET"
+            mock_response.read.return_value = b""
+            mock_response.__aenter__.return_value = mock_response
+            mock_request.return_value = mock_response
+            
+            async with network:
+                response = await network.get("https://busy.com/")
+            
+            assert response.status == 429
+            assert mock_request.call_count == 1
+
+
+class TestHttpCache:
+    """HTTP缓存测试"""
+    
+    def setup_method(self):
+        """测试前设置"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.network = NetworkManager({
+            "http_cache": {"db_path": os.path.join(self.temp_dir, "http_cache.db")}
+        })
+        self.requests = []
+        self.responses = []
+    
+    def teardown_method(self):
+        """测试后清理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def _fake_send(self):
+        """依次返回预设的响应，并记录请求头"""
+        async def send(method, url, **kwargs):
+            self.requests.append(kwargs.get("headers") or {})
+            return self.responses.pop(0)
+        
+        self.network._send = send
+    
+    def test_parse_cache_control(self):
+        """测试解析 Cache-Control"""
+        directives = parse_cache_control('public, max-age=600, no-cache="Set-Cookie"')
+        
+        assert directives["max-age"] == "600"
+        assert directives["public"] is None
+        assert "no-cache" in directives
+    
+    @pytest.mark.asyncio
+    async def test_revalidate_with_etag(self):
+        """测试带校验值的条件请求，304时返回缓存的响应体"""
+        self._fake_send()
+        self.responses = [
+            HttpResponse(200, {"ETag": '"v1"'}, b"<html>toc</html>", "https://a.com/toc"),
+            HttpResponse(304, {}, b"", "https://a.com/toc"),
+        ]
+        
+        first = await self.network.get("https://a.com/toc")
+        second = await self.network.get("https://a.com/toc")
+        
+        assert self.requests[0].get("If-None-Match") is None
+        assert self.requests[1]["If-None-Match"] == '"v1"'
+        assert second.status == 200
+        assert await second.text() == await first.text()
+        assert self.network.http_cache.get_stats()["revalidated"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_fresh_response_skips_request(self):
+        """测试 max-age 内直接使用缓存"""
+        self._fake_send()
+        self.responses = [
+            HttpResponse(200, {"Cache-Control": "max-age=60"}, b"info", "https://a.com/book"),
+        ]
+        
+        await self.network.get("https://a.com/book")
+        response = await self.network.get("https://a.com/book")
+        
+        assert await response.text() == "info"
+        assert len(self.requests) == 1
+        assert self.network.http_cache.get_stats()["bytes_saved"] == 4
+    
+    @pytest.mark.asyncio
+    async def test_no_store_and_caller_conditional(self):
+        """测试 no-store 不缓存，调用方自带条件请求头时原样返回304"""
+        self._fake_send()
+        self.responses = [
+            HttpResponse(200, {"ETag": '"v1"', "Cache-Control": "no-store"}, b"a", "https://a.com/x"),
+            HttpResponse(200, {"ETag": '"v1"'}, b"b", "https://a.com/y"),
+            HttpResponse(304, {}, b"", "https://a.com/y"),
+        ]
+        
+        await self.network.get("https://a.com/x")
+        assert self.network.http_cache.get("https://a.com/x") is None
+        
+        await self.network.get("https://a.com/y")
+        response = await self.network.get("https://a.com/y", headers={"If-None-Match": '"v1"'})
+        assert response.status == 304
+    
+    def test_persisted_between_instances(self):
+        """测试缓存写入数据库后可被新实例读取"""
+        cache = self.network.http_cache
+        cache.update("https://a.com/z", None,
+                     HttpResponse(200, {"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}, b"z", "https://a.com/z"))
+        
+        reloaded = HttpCache({"db_path": cache.db_path})
+        entry = reloaded.get("https://a.com/z")
+        
+        assert entry.body == b"z"
+        assert entry.validators() == {"If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}
+
+    @pytest.mark.asyncio
+    async def test_keyed_by_cookie_jar(self):
+        """测试不同 Cookie Jar 的响应互不串用"""
+        from src.core.cookies import cookie_jar_scope
+        self._fake_send()
+        self.responses = [
+            HttpResponse(200, {"Cache-Control": "max-age=60"}, b"user-a", "https://a.com/shelf"),
+            HttpResponse(200, {"Cache-Control": "max-age=60"}, b"user-b", "https://a.com/shelf"),
+        ]
+
+        with cookie_jar_scope("a"):
+            await self.network.get("https://a.com/shelf")
+        with cookie_jar_scope("b"):
+            response = await self.network.get("https://a.com/shelf")
+        with cookie_jar_scope("a"):
+            cached = await self.network.get("https://a.com/shelf")
+
+        assert await response.text() == "user-b"
+        assert await cached.text() == "user-a"
+        assert len(self.requests) == 2
+
+    @pytest.mark.asyncio
+    async def test_vary_headers_in_key(self):
+        """测试响应 Vary 指定的请求头参与缓存键"""
+        self._fake_send()
+        self.responses = [
+            HttpResponse(200, {"Cache-Control": "max-age=60", "Vary": "Accept-Language"}, b"zh", "https://a.com/p"),
+            HttpResponse(200, {"Cache-Control": "max-age=60", "Vary": "Accept-Language"}, b"en", "https://a.com/p"),
+        ]
+
+        await self.network.get("https://a.com/p", headers={"Accept-Language": "zh"})
+        english = await self.network.get("https://a.com/p", headers={"Accept-Language": "en"})
+        chinese = await self.network.get("https://a.com/p", headers={"Accept-Language": "zh"})
+
+        assert await english.text() == "en"
+        assert await chinese.text() == "zh"
+        assert len(self.requests) == 2
+        assert HttpCache({"db_path": self.network.http_cache.db_path}).vary == {"https://a.com/p": ("accept-language",)}
+
+    def test_unknown_key_skips_database(self):
+        """测试数据库中没有的键不查询数据库"""
+        cache = self.network.http_cache
+        with patch("src.core.httpcache.sqlite3.connect") as connect:
+            assert cache.lookup("https://a.com/chapter/1") is None
+        connect.assert_not_called()
+
+    def test_database_bounded_by_count_and_age(self):
+        """测试数据库按条数上限淘汰最早的响应，启动时清理过期的响应"""
+        db_path = os.path.join(self.temp_dir, "bounded.db")
+        cache = HttpCache({"db_path": db_path, "max_db_entries": 2})
+        for index in range(3):
+            url = f"https://a.com/toc/{index}"
+            cache._persist(url, CachedResponse(url, {"ETag": f'"{index}"'}, b"toc", stored_at=1000.0 + index))
+
+        assert cache.keys == {"https://a.com/toc/1", "https://a.com/toc/2"}
+        assert cache.get("https://a.com/toc/0") is None
+        assert cache.get_stats()["evicted"] == 1
+
+        reloaded = HttpCache({"db_path": db_path, "max_age": 86400})
+        assert reloaded.keys == set()
+        assert HttpCache({"db_path": db_path}).get_stats()["stored"] == 0
+
+
+class TestCharsetDetector:
+    """编码检测测试"""
+    
+    def setup_method(self):
+        """测试前设置"""
+        self.detector = CharsetDetector()
+        self.gbk_page = ("<html><body>" + "第一章 风起云涌，少年踏上修仙之路。" * 20 + "</body></html>").encode("gbk")
+    
+    def test_header_first(self):
+        """测试优先使用响应头中的编码"""
+        headers = {"Content-Type": "text/html; charset=GBK"}
+        
+        assert self.detector.detect(b"<html></html>", headers) == "gb18030"
+    
+    def test_sniff_meta_and_bom(self):
+        """测试从 meta 和 BOM 中取编码"""
+        assert sniff_charset(b'<head><meta charset="gb2312"></head>') == "gb18030"
+        assert sniff_charset(b'<meta http-equiv="Content-Type" content="text/html; charset=big5">') == "big5"
+        assert sniff_charset(b'\xef\xbb\xbf<html>') == "utf-8-sig"
+        assert sniff_charset(b"<html>") is None
+        assert normalize_charset("no-such-charset") is None
+    
+    def test_utf8_without_declaration(self):
+        """测试未声明编码的 UTF-8 页面"""
+        assert self.detector.detect("第一章".encode("utf-8")) == "utf-8"
+    
+    def test_detector_runs_once_per_host(self):
+        """测试统计检测的结果按主机记住"""
+        if self.detector._detect is None:
+            pytest.skip("未安装编码检测库")
+        
+        text = self.detector.decode(self.gbk_page, {}, "gbk.com")
+        assert "风起云涌" in text
+        assert self.detector.detect(self.gbk_page, {}, "gbk.com") == self.detector.host_charsets["gbk.com"]
+        
+        stats = self.detector.get_stats()["sources"]
+        assert stats["detector"] == 1
+        assert stats["host"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_get_text_auto_detects(self):
+        """测试 get_text 默认自动检测编码"""
+        network = NetworkManager()
+        page = '<meta charset="gbk"><p>风起云涌</p>'.encode("gbk")
+        network.get = AsyncMock(return_value=HttpResponse(200, {}, page, "https://gbk.com/1"))
+        
+        text = await network.get_text("https://gbk.com/1")
+        
+        assert "风起云涌" in text
+
+
+class TestResponseSizeLimit:
+    """响应大小上限测试"""
+    
+    class FakeResponse:
+        """按块返回响应体的模拟响应"""
+        
+        def __init__(self, chunks, headers=None):
+            self.status = 200
+            self.url = "https://big.com/page"
+            self.method = "GET"
+            self.headers = headers or {}
+            self.chunks = chunks
+            self.consumed = 0
+            self.content = self
+        
+        async def iter_chunked(self, size):
+            for chunk in self.chunks:
+                self.consumed += 1
+                yield chunk
+        
+        async def __aenter__(self):
+            return self
+        
+        async def __aexit__(self, *args):
+            return False
+    
+    @pytest.mark.asyncio
+    async def test_read_within_limit(self):
+        """测试未超限时完整读取"""
+        response = self.FakeResponse([b"abc", b"def"])
+        
+        assert await read_limited(response, 10) == b"abcdef"
+    
+    @pytest.mark.asyncio
+    async def test_abort_when_streaming_exceeds(self):
+        """测试流式读取超限时立即中止"""
+        response = self.FakeResponse([b"x" * 6, b"x" * 6, b"x" * 6])
+        
+        with pytest.raises(ResponseTooLargeError):
+            await read_limited(response, 10)
+        assert response.consumed == 2
+    
+    @pytest.mark.asyncio
+    async def test_reject_by_content_length(self):
+        """测试 Content-Length 超限时不读取响应体"""
+        response = self.FakeResponse([b"x"], {"Content-Length": "2048"})
+        
+        with pytest.raises(ResponseTooLargeError):
+            await read_limited(response, 1024)
+        assert response.consumed == 0
+    
+    @pytest.mark.asyncio
+    async def test_network_counts_oversized(self):
+        """测试网络层按书源和主机统计超限响应且不重试"""
+        network = NetworkManager({"retry_times": 3, "max_content_length": 4,
+                                  "cookies": {"db_path": os.path.join(tempfile.mkdtemp(), "cookies.db")}})
+        with patch('aiohttp.ClientSession.request') as mock_request:
+            mock_request.return_value = self.FakeResponse([b"too large"])
+            
+            async with network:
+                with pytest.raises(ResponseTooLargeError):
+                    await network.bind("mirror_a").get("https://cdn.com/page")
+                with pytest.raises(ResponseTooLargeError):
+                    await network.bind("mirror_b").get("https://cdn.com/page")
+            
+            assert mock_request.call_count == 2
+        assert network.get_stats()["oversized"] == {"mirror_a": {"cdn.com": 1}, "mirror_b": {"cdn.com": 1}}
+
+
+class TestCookieJars:
+    """书源独立 Cookie Jar 测试"""
+    
+    def setup_method(self):
+        """测试前设置"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "cookies.db")
+    
+    def teardown_method(self):
+        """测试后清理"""
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    async def _start_server(self):
+        """本地测试站点：/login 下发Cookie，/echo 返回收到的Cookie"""
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        
+        async def login(request):
+            response = web.Response(text="ok")
+            response.set_cookie("sid", request.query.get("user", "anon"), max_age=3600)
+            return response
+        
+        async def echo(request):
+            return web.Response(text=request.cookies.get("sid", ""))
+        
+        app = web.Application()
+        app.router.add_get("/login", login)
+        app.router.add_get("/echo", echo)
+        server = TestServer(app)
+        await server.start_server()
+        return server
+    
+    @pytest.mark.asyncio
+    async def test_jars_isolated_and_persisted(self):
+        """测试各书源Cookie互不可见，且重启后仍然有效"""
+        server = await self._start_server()
+        base = str(server.make_url("/")).rstrip("/")
+        config = {"cookies": {"db_path": self.db_path}}
+        try:
+            network = NetworkManager(config)
+            source_a = network.bind("a")
+            source_b = network.bind("b")
+            async with network:
+                await source_a.get_text(f"{base}/login?user=alice")
+                assert await source_a.get_text(f"{base}/echo") == "alice"
+                assert await source_b.get_text(f"{base}/echo") == ""
+                assert await network.get_text(f"{base}/echo") == ""
+            
+            restarted = NetworkManager(config)
+            async with restarted:
+                assert await restarted.bind("a").get_text(f"{base}/echo") == "alice"
+                assert await restarted.bind("b").get_text(f"{base}/echo") == ""
+        finally:
+            await server.close()
+    
+    @pytest.mark.asyncio
+    async def test_expired_max_age_not_loaded(self):
+        """测试保存时间超过 Max-Age 的Cookie不再载入"""
+        import aiohttp
+        from http.cookies import SimpleCookie
+        from yarl import URL
+        store = CookieStore({"db_path": self.db_path})
+        jar = aiohttp.CookieJar()
+        cookie = SimpleCookie()
+        cookie.load("sid=1; Max-Age=60; Path=/")
+        cookie.load("token=2; Path=/")
+        jar.update_cookies(cookie, URL("https://a.com/"))
+        
+        with patch("src.core.cookies.time.time", return_value=1000.0):
+            store.save("a", jar)
+        with patch("src.core.cookies.time.time", return_value=1100.0):
+            reloaded = aiohttp.CookieJar()
+            assert store.load("a", reloaded) == 1
+        
+        assert [morsel.key for morsel in reloaded] == ["token"]
+
+    @pytest.mark.asyncio
+    async def test_host_only_restored(self):
+        """测试只对主机有效的Cookie重新载入后不会变成域Cookie"""
+        import aiohttp
+        from http.cookies import SimpleCookie
+        from yarl import URL
+        store = CookieStore({"db_path": self.db_path})
+        jar = aiohttp.CookieJar()
+        cookie = SimpleCookie()
+        cookie.load("host=1; Path=/")
+        jar.update_cookies(cookie, URL("https://www.a.com/"))
+        domain_cookie = SimpleCookie()
+        domain_cookie.load("shared=2; Domain=a.com; Path=/")
+        jar.update_cookies(domain_cookie, URL("https://www.a.com/"))
+        store.save("a", jar)
+
+        reloaded = aiohttp.CookieJar()
+        assert CookieStore({"db_path": self.db_path}).load("a", reloaded) == 2
+
+        assert set(reloaded.filter_cookies(URL("https://www.a.com/"))) == {"host", "shared"}
+        assert set(reloaded.filter_cookies(URL("https://img.www.a.com/"))) == {"shared"}
+
+    @pytest.mark.asyncio
+    async def test_debounced_upsert(self):
+        """测试 Set-Cookie 后合并延迟写入，且只写入变化的Cookie"""
+        import aiohttp
+        from yarl import URL
+        store = CookieStore({"db_path": self.db_path, "save_delay": 0.01})
+        jar = aiohttp.CookieJar()
+        jar.update_cookies({"a": "1", "b": "2"}, URL("https://a.com/"))
+        store.save("a", jar)
+
+        with patch.object(store, "save", wraps=store.save) as save:
+            for value in range(5):
+                jar.update_cookies({"b": str(value)}, URL("https://a.com/"))
+                store.schedule_save("a", jar)
+            await asyncio.sleep(0.05)
+        assert save.call_count == 1
+
+        with patch("src.core.cookies.sqlite3.connect") as connect:
+            store.save("a", jar)
+        connect.assert_not_called()
+
+        import sqlite3
+        with sqlite3.connect(self.db_path) as conn:
+            rows = dict(conn.execute("SELECT name, value FROM cookies WHERE jar = 'a'").fetchall())
+        assert rows["b"].startswith("b=4")
+    
+    def test_register_source_with_cookie_jar(self):
+        """测试启用 enabledCookieJar 的书源获得独立的网络层视图"""
+        engine = BookSourceEngine(isolated_config())
+        source = Mock(spec=BaseSource)
+        source.config = {"bookSourceName": "测试", "bookSourceUrl": "https://a.com", "enabledCookieJar": True}
+        
+        engine.register_source("test", source)
+        
+        assert source.network.jar_name == "test"
+        assert source.network.breakers is engine.network.breakers
+
+
+class TestProxyPool:
+    """代理池测试"""
+    
+    async def _start_proxy(self, name, status=200):
+        """本地替身代理：不转发，直接返回自己的名字"""
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        
+        async def handle(request):
+            return web.Response(text=name, status=status)
+        
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", handle)
+        server = TestServer(app)
+        await server.start_server()
+        return server
+    
+    def test_eject_and_reinstate(self):
+        """测试错误率过高的代理被剔除，不再被选中"""
+        pool = ProxyPool({"proxies": ["http://p1", "http://p2"], "min_requests": 3, "affinity": False})
+        for _ in range(3):
+            pool.record("http://p1", 0.1, ok=False)
+            pool.record("http://p2", 0.1, ok=True)
+        
+        assert pool.proxies["http://p1"].is_ejected()
+        assert {pool.select("a.com") for _ in range(20)} == {"http://p2"}
+        
+        pool.reinstate("http://p1")
+        assert len(pool.healthy()) == 2
+
+    def test_origin_status_not_blamed_on_proxy(self):
+        """测试源站自己的 403/429/5xx 不计入代理错误，只有代理错误计入"""
+        verdict = NetworkManager._proxy_verdict
+        assert verdict("https://a.com/", 200) is True
+        assert verdict("https://a.com/", 404) is None
+        assert verdict("https://a.com/", 403) is None
+        assert verdict("https://a.com/", 429) is None
+        assert verdict("https://a.com/", 503) is None
+        assert verdict("https://a.com/", 502) is None
+        assert verdict("http://a.com/", 502) is False
+        assert verdict("http://a.com/", 504) is False
+        assert verdict("https://a.com/", 407) is False
+
+    @pytest.mark.asyncio
+    async def test_rate_limited_site_keeps_proxies(self):
+        """测试一个限流的站点不会让代理被剔除"""
+        server = await self._start_proxy("limited", status=429)
+        proxy = str(server.make_url("/")).rstrip("/")
+        network = NetworkManager({
+            "retry_times": 0,
+            "circuit_breaker": {"enabled": False},
+            "proxy_pool": {"enabled": True, "proxies": [proxy], "min_requests": 1, "health_check_url": ""}
+        })
+        try:
+            async with network:
+                for _ in range(3):
+                    await network.get("http://limited.example/")
+            assert not network.proxy_pool.proxies[proxy].is_ejected()
+        finally:
+            await server.close()
+
+    def test_host_affinity(self):
+        """测试同一站点固定使用同一代理，代理剔除后重新分配"""
+        pool = ProxyPool({"proxies": ["http://p1", "http://p2", "http://p3"], "min_requests": 1})
+        proxy = pool.select("a.com")
+        
+        assert all(pool.select("a.com") == proxy for _ in range(10))
+        
+        pool.eject(proxy)
+        assert pool.select("a.com") != proxy
+    
+    def test_prefers_faster_proxy(self):
+        """测试两次随机选择偏向延迟低的代理"""
+        pool = ProxyPool({"proxies": ["http://fast", "http://slow"], "affinity": False})
+        pool.record("http://fast", 0.05, ok=True)
+        pool.record("http://slow", 2.0, ok=True)
+        
+        assert {pool.select() for _ in range(20)} == {"http://fast"}
+    
+    @pytest.mark.asyncio
+    async def test_requests_spread_over_local_proxies(self):
+        """测试请求经由本地替身代理发出，坏代理被剔除"""
+        good1 = await self._start_proxy("good1")
+        good2 = await self._start_proxy("good2")
+        bad = await self._start_proxy("bad", status=502)
+        proxies = [str(server.make_url("")).rstrip("/") for server in (good1, good2, bad)]
+        network = NetworkManager({
+            "retry_times": 0,
+            "circuit_breaker": {"enabled": False},
+            "proxy_pool": {"proxies": proxies, "min_requests": 1, "affinity": False}
+        })
+        try:
+            seen = []
+            async with network:
+                for i in range(30):
+                    response = await network.get(f"http://books.test/{i}")
+                    seen.append(await response.text())
+            
+            assert {"good1", "good2"} <= set(seen)
+            assert seen.count("bad") <= 1
+            stats = network.get_stats()["proxy_pool"]
+            assert stats["healthy"] == 2
+            assert stats["proxies"][proxies[2]]["ejected_for"] > 0
+        finally:
+            for server in (good1, good2, bad):
+                await server.close()
+    
+    @pytest.mark.asyncio
+    async def test_health_check_reinstates(self):
+        """测试健康检查探测成功后提前恢复被剔除的代理"""
+        pool = ProxyPool({"proxies": ["http://p1", "http://p2"]})
+        pool.eject("http://p1")
+        
+        async def probe(proxy):
+            return proxy == "http://p1"
+        
+        await pool.health_check(probe)
+        
+        assert not pool.proxies["http://p1"].is_ejected()
+        assert pool.proxies["http://p2"].failures == 1
+
+
+class TestRuntime:
+    """运行时设置测试"""
+    
+    @pytest.mark.asyncio
+    async def test_build_connector_from_config(self):
+        """测试按配置构建连接器"""
+        connector = runtime.build_connector({
+            "max_connections": 64,
+            "max_connections_per_host": 8,
+            "keepalive_timeout": 15
+        })
+        try:
+            stats = runtime.get_connector_stats(connector)
+            assert stats["limit"] == 64
+            assert stats["limit_per_host"] == 8
+            assert stats["force_close"] is False
+            assert stats["acquired"] == 0
+        finally:
+            await connector.close()
+    
+    @pytest.mark.asyncio
+    async def test_force_close_without_keepalive(self):
+        """测试 force_close 时不设置 keepalive_timeout"""
+        connector = runtime.build_connector({"force_close": True, "keepalive_timeout": 15})
+        try:
+            assert connector.force_close
+        finally:
+            await connector.close()
+    
+    def test_run_without_uvloop(self):
+        """测试禁用 uvloop 时使用默认事件循环"""
+        async def loop_type():
+            return type(asyncio.get_running_loop()).__module__
+        
+        assert runtime.get_loop_factory({"use_uvloop": False}) is None
+        assert runtime.get_loop_name({"use_uvloop": False}) == "asyncio"
+        assert runtime.run(loop_type(), {"use_uvloop": False}).startswith("asyncio")
+    
+    @pytest.mark.asyncio
+    async def test_network_connector_stats(self):
+        """测试网络层使用配置的连接器并报告统计"""
+        network = NetworkManager({"max_connections": 20, "enable_compression": False})
+        async with network:
+            stats = network.get_stats()["connector"]
+        
+        assert stats["limit"] == 20
+        assert network._get_default_headers()["Accept-Encoding"] == "identity"
+
+
+class TestSourceWarmup:
+    """书源预热测试"""
+    
+    def _source(self, url):
+        source = Mock(spec=BaseSource)
+        source.enabled = True
+        source.url = url
+        return source
+    
+    @pytest.mark.asyncio
+    async def test_warm_up_resolves_and_connects(self):
+        """测试预热解析域名、建立连接，无法解析的站点被熔断"""
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        
+        app = web.Application()
+        app.router.add_route("*", "/", lambda request: web.Response(text="ok"))
+        server = TestServer(app)
+        await server.start_server()
+        
+        engine = BookSourceEngine(isolated_config())
+        engine.network.breakers.enabled = True
+        engine.register_source("alive", self._source(str(server.make_url("/"))))
+        engine.register_source("dead", self._source("https://no-such-host.invalid"))
+        engine.register_source("local", self._source(""))
+        try:
+            report = await engine.warm_up()
+            
+            assert report["hosts"] == 2
+            assert report["resolved"] == 1
+            assert report["connected"] == 1
+            assert report["dead_sources"] == ["dead"]
+            assert engine.network.breakers.is_open("no-such-host.invalid")
+            assert engine.network.get_stats()["connector"]["idle"] == 1
+            
+            results = await engine.search_all("测试")
+            assert results["dead"] == []
+        finally:
+            await engine.network.close_session()
+            await server.close()
+    
+    @pytest.mark.asyncio
+    async def test_timeouts_do_not_trip(self):
+        """测试解析超时和连接超时一样只记录，不打开熔断器"""
+        from src.core.warmup import SourceWarmer
+        network = NetworkManager({"circuit_breaker": {"enabled": True}})
+        warmer = SourceWarmer(network, {"timeout": 0.01})
+
+        async def slow_resolve(host, port):
+            await asyncio.sleep(1)
+
+        try:
+            await network.create_session()
+            network.resolver = Mock()
+            network.resolver.resolve = slow_resolve
+            network.resolver.close = AsyncMock()
+            report = await warmer.warm_up({"slow": self._source("https://slow-dns.example")})
+        finally:
+            await network.close_session()
+
+        assert report.timed_out == ["slow-dns.example"]
+        assert report.failed == {}
+        assert not network.breakers.is_open("slow-dns.example")
+
+    @pytest.mark.asyncio
+    async def test_resolver_cache(self):
+        """测试预先解析的主机命中解析器缓存"""
+        from src.core.runtime import CachingResolver
+        resolver = CachingResolver(ttl=60)
+        resolver._resolver = AsyncMock()
+        resolver._resolver.resolve.return_value = [{"host": "127.0.0.1", "port": 80}]
+        
+        await resolver.resolve("a.com", 80)
+        await resolver.resolve("a.com", 80)
+        
+        assert resolver._resolver.resolve.await_count == 1
+
+
+class TestApiServer:
+    """HTTP API服务测试"""
+    
+    def _engine(self):
+        engine = BookSourceEngine(isolated_config())
+        engine.cache = CacheManager({
+            "cache_dir": tempfile.mkdtemp(),
+            "file_cache": False,
+            "db_cache": False
+        })
+        
+        async def search(keyword, page=1):
+            await asyncio.sleep(0.05)
+            return [BookInfo(name="慢书", book_url="https://slow.com/book/1")]
+        
+        async def get_toc(toc_url):
+            await asyncio.sleep(0.01)
+            return [ChapterInfo(name=f"第{i}章", url=f"https://fast.com/chapter/{i}") for i in range(3)]
+        
+        slow = Mock(spec=BaseSource)
+        slow.name = "慢书源"
+        slow.url = "https://slow.com"
+        slow.enabled = True
+        slow.search = AsyncMock(side_effect=search)
+        fast = Mock(spec=BaseSource)
+        fast.name = "快书源"
+        fast.url = "https://fast.com"
+        fast.enabled = True
+        fast.search = AsyncMock(return_value=[BookInfo(name="快书", book_url="https://fast.com/book/1")])
+        fast.get_toc = AsyncMock(side_effect=get_toc)
+        engine.register_source("slow", slow)
+        engine.register_source("fast", fast)
+        return engine
+    
+    @pytest.mark.asyncio
+    async def test_search_streams_ndjson(self):
+        """测试搜索结果按书源完成先后流式返回"""
+        from aiohttp.test_utils import TestClient, TestServer
+        from src.server import ApiServer
+        
+        server = ApiServer(self._engine(), {"warmup": False})
+        async with TestClient(TestServer(server.create_app())) as client:
+            response = await client.get("/api/search", params={"q": "测试"})
+            assert response.status == 200
+            assert response.headers["Content-Type"].startswith("application/x-ndjson")
+            lines = [json.loads(line) for line in (await response.text()).splitlines()]
+        
+        assert [line.get("source") for line in lines[:2]] == ["fast", "slow"]
+        assert lines[0]["books"][0]["name"] == "快书"
+        assert lines[-1]["done"] and lines[-1]["total"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_toc_etag_and_shared_fetch(self):
+        """测试目录接口的 ETag、304 和并发请求合并"""
+        from aiohttp.test_utils import TestClient, TestServer
+        from src.server import ApiServer
+        
+        engine = self._engine()
+        server = ApiServer(engine, {"warmup": False})
+        params = {"source": "fast", "url": "https://fast.com/toc"}
+        async with TestClient(TestServer(server.create_app())) as client:
+            responses = await asyncio.gather(*(client.get("/api/toc", params=params) for _ in range(5)))
+            assert all(response.status == 200 for response in responses)
+            etag = responses[0].headers["ETag"]
+            assert responses[0].headers["Cache-Control"] == "public, max-age=300"
+            assert len(await responses[0].json()) == 3
+            
+            response = await client.get("/api/toc", params=params, headers={"If-None-Match": etag})
+            assert response.status == 304
+            
+            response = await client.get("/api/toc", params={"source": "none", "url": "x"})
+            assert response.status == 404
+            response = await client.get("/api/toc", params={"source": "fast"})
+            assert response.status == 400
+        
+        assert engine.sources["fast"].get_toc.call_count == 1
+        assert server.stats["shared"] == 4
+        assert engine.cache.get("toc:快书源:https://fast.com/toc")[0]["name"] == "第0章"
+    
+    @pytest.mark.asyncio
+    async def test_rate_limit(self):
+        """测试按客户端限流"""
+        from aiohttp.test_utils import TestClient, TestServer
+        from src.server import ApiServer
+        
+        server = ApiServer(self._engine(), {"warmup": False, "rate_limit": 2})
+        async with TestClient(TestServer(server.create_app())) as client:
+            statuses = [(await client.get("/api/sources")).status for _ in range(3)]
+        
+        assert statuses == [200, 200, 429]
+
+    @pytest.mark.asyncio
+    async def test_auth_token(self):
+        """测试令牌认证：未配置令牌时拒绝启动，空令牌不能通过"""
+        from aiohttp.test_utils import TestClient, TestServer
+        from src.server import ApiServer
+
+        with pytest.raises(ValueError):
+            ApiServer(self._engine(), {"warmup": False, "auth_required": True})
+
+        server = ApiServer(self._engine(), {"warmup": False, "auth_required": True, "token": "secret"})
+        async with TestClient(TestServer(server.create_app())) as client:
+            statuses = [
+                (await client.get("/api/sources", headers=headers)).status
+                for headers in ({}, {"Authorization": "Bearer "}, {"Authorization": "Bearer wrong"},
+                                {"Authorization": "Bearer secret"})
+            ]
+
+        assert statuses == [401, 401, 401, 200]
+
+    @pytest.mark.asyncio
+    async def test_internal_lookup_error_is_not_404(self):
+        """测试处理过程中的 KeyError 按内部错误返回，只有书源不存在返回 404"""
+        from aiohttp.test_utils import TestClient, TestServer
+        from src.server import ApiServer
+
+        engine = self._engine()
+        engine.sources["fast"].get_toc = AsyncMock(side_effect=KeyError("bookUrl"))
+        server = ApiServer(engine, {"warmup": False})
+        async with TestClient(TestServer(server.create_app())) as client:
+            response = await client.get("/api/toc", params={"source": "fast", "url": "https://fast.com/toc"})
+            assert response.status == 502
+            response = await client.get("/api/toc", params={"source": "none", "url": "x"})
+            assert response.status == 404
+            assert (await response.json())["error"] == "书源不存在: none"
+
+    @pytest.mark.asyncio
+    async def test_upstream_value_error_is_not_400(self):
+        """测试上游解析抛出的 ValueError 按上游错误返回，只有参数错误返回 400"""
+        from aiohttp.test_utils import TestClient, TestServer
+        from src.server import ApiServer
+
+        engine = self._engine()
+        engine.sources["fast"].get_toc = AsyncMock(side_effect=json.JSONDecodeError("Expecting value", "", 0))
+        server = ApiServer(engine, {"warmup": False})
+        async with TestClient(TestServer(server.create_app())) as client:
+            response = await client.get("/api/toc", params={"source": "fast", "url": "https://fast.com/toc"})
+            assert response.status == 502
+            response = await client.get("/api/search", params={"q": "测试", "page": "x"})
+            assert response.status == 400
+            response = await client.get("/api/content", params={"source": "fast", "toc": "t", "index": "x"})
+            assert response.status == 400
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 fork")
+    def test_worker_exit_before_ready_aborts(self):
+        """测试 worker 在开始监听前退出时服务直接退出，不反复重启"""
+        from src.server import serve_workers
+
+        def fail(*args):
+            os._exit(3)
+
+        with patch("src.server._worker_main", fail):
+            with pytest.raises(RuntimeError, match="启动失败"):
+                serve_workers("", {"port": 0}, 2)
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 fork")
+    def test_worker_restarts_are_limited(self):
+        """测试运行中退出的 worker 按退避重启，超过次数上限后服务退出"""
+        from src.server import serve_workers
+
+        def crash(index, config_path, api_config, sock, ready, *args):
+            ready.set()
+            os._exit(1)
+
+        with patch("src.server._worker_main", crash):
+            with pytest.raises(RuntimeError, match="连续重启 2 次"):
+                serve_workers("", {"port": 0, "max_restarts": 2, "restart_delay": 0.01}, 1)
+
+    def test_worker_output_path(self):
+        """测试录制和追踪文件按 worker 进程号区分"""
+        from src.server import _worker_output_path
+
+        assert _worker_output_path("data/a.cassette", 42) == os.path.join("data", "a.42.cassette")
+        assert _worker_output_path("spans.jsonl", 7) == "spans.7.jsonl"
+
+
+class TestSharedCache:
+    """多进程共享缓存测试"""
+    
+    def _cache(self, cache_dir):
+        cache = CacheManager({"cache_dir": cache_dir, "file_cache": True, "sync_interval": 0})
+        cache.enable_shared()
+        return cache
+    
+    def test_cross_instance_invalidation(self):
+        """测试一个实例的写入和删除使其他实例的内存缓存失效"""
+        cache_dir = tempfile.mkdtemp()
+        first, second = self._cache(cache_dir), self._cache(cache_dir)
+        
+        first.set("content:书源:1", {"content": "旧"})
+        assert second.get("content:书源:1") == {"content": "旧"}
+        
+        first.set("content:书源:1", {"content": "新"})
+        assert second.get("content:书源:1") == {"content": "新"}
+        
+        first.delete("content:书源:1")
+        assert second.get("content:书源:1") is None
+        
+        first.set("toc:书源:1", [1])
+        assert second.get("toc:书源:1") == [1]
+        first.clear_all()
+        assert second.get("toc:书源:1") is None
+        assert not [name for name in os.listdir(cache_dir) if name.endswith(".tmp")]
+    
+    def test_fetched_in_worker_hits_in_parent(self):
+        """测试子进程写入的章节在父进程命中，且父进程内存中的旧值失效"""
+        import multiprocessing
+        
+        cache_dir = tempfile.mkdtemp()
+        cache = self._cache(cache_dir)
+        cache.set("content:书源:1", "旧")
+        
+        def worker():
+            self._cache(cache_dir).set("content:书源:1", "新")
+            self._cache(cache_dir).set("content:书源:2", "第二章")
+        
+        process = multiprocessing.get_context("fork").Process(target=worker)
+        process.start()
+        process.join(10)
+        
+        assert process.exitcode == 0
+        assert cache.get("content:书源:1") == "新"
+        assert cache.get("content:书源:2") == "第二章"
+        assert cache.get_stats()["shared"]
+
+
+class TestMetrics:
+    """指标测试"""
+    
+    def test_prometheus_text_format(self):
+        """测试计数器和直方图的文本格式"""
+        from src.core.metrics import MetricsRegistry
+        
+        registry = MetricsRegistry()
+        requests = registry.counter("test_requests_total", "请求数", ("host",))
+        latency = registry.histogram("test_latency_seconds", "延迟", ("host",), buckets=(0.1, 1.0))
+        requests.inc(host="a.com")
+        requests.inc(2, host='b"c')
+        latency.observe(0.05, host="a.com")
+        latency.observe(0.5, host="a.com")
+        
+        text = registry.render()
+        assert "# TYPE test_requests_total counter" in text
+        assert 'test_requests_total{host="a.com"} 1' in text
+        assert 'test_requests_total{host="b\\"c"} 2' in text
+        assert 'test_latency_seconds_bucket{host="a.com",le="0.1"} 1' in text
+        assert 'test_latency_seconds_bucket{host="a.com",le="1"} 2' in text
+        assert 'test_latency_seconds_bucket{host="a.com",le="+Inf"} 2' in text
+        assert 'test_latency_seconds_count{host="a.com"} 2' in text
+        assert registry.counter("test_requests_total", "请求数", ("host",)) is requests
+        with pytest.raises(ValueError):
+            registry.histogram("test_requests_total", "请求数", ("host",))
+    
+    @pytest.mark.asyncio
+    async def test_network_metrics_by_source(self):
+        """测试书源发起的请求按书源和主机记录状态码、延迟和字节数"""
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        from src.core.metrics import HTTP_REQUESTS, HTTP_DURATION, HTTP_RESPONSE_BYTES, HTTP_REQUEST_BYTES
+        
+        async def page(request):
+            await request.read()
+            return web.Response(text="x" * 100)
+        
+        app = web.Application()
+        app.router.add_route("*", "/", page)
+        server = TestServer(app)
+        await server.start_server()
+        host = f"{server.host}:{server.port}"
+        
+        network = NetworkManager({"http_cache": {"enabled": False}})
+        source_network = network.bind("指标书源", cookie_jar=False)
+        try:
+            await source_network.get(str(server.make_url("/")))
+            await source_network.post(str(server.make_url("/")), data="abc")
+        finally:
+            await network.close_session()
+            await server.close()
+        
+        assert HTTP_REQUESTS.get(source="指标书源", host=host, status=200) == 2
+        assert HTTP_RESPONSE_BYTES.get(source="指标书源", host=host) == 200
+        assert HTTP_REQUEST_BYTES.get(source="指标书源", host=host) == 3
+        assert HTTP_DURATION.snapshot()[f"指标书源,{host}"]["count"] == 2
+    
+    def test_cache_and_rule_metrics(self):
+        """测试缓存分层命中率和规则解析耗时"""
+        from src.core.metrics import RULE_DURATION
+        
+        cache = CacheManager({"cache_dir": tempfile.mkdtemp(), "file_cache": False})
+        cache.set("key", {"value": 1})
+        cache.memory_cache.clear()
+        assert cache.get("key") == {"value": 1}
+        assert cache.get("key") == {"value": 1}
+        assert cache.get("missing") is None
+        
+        ratio = cache.get_stats()["hit_ratio"]
+        assert ratio["memory"] == pytest.approx(1 / 3)
+        assert ratio["db"] == pytest.approx(1 / 2)
+        
+        before = RULE_DURATION.snapshot().get("json", {"count": 0})["count"]
+        RuleEngine().parse_rule("$.name", '{"name": "书名"}')
+        assert RULE_DURATION.snapshot()["json"]["count"] == before + 1
+
+
+class TestTracing:
+    """链路追踪测试"""
+    
+    def teardown_method(self):
+        from src.core import tracing
+        tracing.configure({})
+    
+    def test_noop_by_default(self):
+        """测试未启用时返回空操作 span"""
+        from src.core import tracing
+        
+        tracing.configure({})
+        with tracing.span("anything", key="value") as span:
+            span.set_attribute("more", 1)
+        assert span is tracing.NOOP_SPAN
+        assert tracing.get_tracer() is None
+    
+    @pytest.mark.asyncio
+    async def test_search_spans_to_json(self):
+        """测试从全局搜索到网络请求、规则解析的 span 层级导出为 JSON"""
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        from src.core import tracing
+        
+        async def search_api(request):
+            return web.json_response({"name": "书名"})
+        
+        app = web.Application()
+        app.router.add_get("/search", search_api)
+        server = TestServer(app)
+        await server.start_server()
+        
+        export_path = os.path.join(tempfile.mkdtemp(), "spans.jsonl")
+        engine = BookSourceEngine(isolated_config())
+        tracing.configure({"enabled": True, "export_path": export_path})
+        
+        source = Mock(spec=BaseSource)
+        source.enabled = True
+        source.url = str(server.make_url("/"))
+        source.config = {}
+        
+        async def search(keyword, page=1):
+            text = await source.network.get_text(str(server.make_url("/search")))
+            return [BookInfo(name=engine.rules.parse_rule("$.name", text))]
+        
+        source.search = AsyncMock(side_effect=search)
+        engine.register_source("traced", source)
+        try:
+            results = await engine.search_all("测试")
+        finally:
+            await engine.network.close_session()
+            await server.close()
+        tracing.flush()
+        
+        assert results["traced"][0].name == "书名"
+        with open(export_path, encoding="utf-8") as f:
+            spans = {span["name"]: span for span in map(json.loads, f)}
+        
+        def parent(name):
+            return next(span for span in spans.values() if span["spanId"] == spans[name]["parentSpanId"])["name"]
+        
+        assert parent("search.source") == "search_all"
+        assert parent("http.request") == "search.source"
+        assert parent("http.attempt") == "http.request"
+        assert parent("scheduler.wait") == "http.attempt"
+        assert parent("connection.create") == "http.attempt"
+        assert parent("http.download") == "http.attempt"
+        assert parent("rule.parse") == "search.source"
+        assert spans["rule.parse"]["attributes"]["type"] == "json"
+        assert spans["http.attempt"]["attributes"]["status"] == 200
+        assert len({span["traceId"] for span in spans.values()}) == 1
+        assert spans["search_all"]["endTimeUnixNano"] >= spans["http.request"]["endTimeUnixNano"]
+
+
+class TestCassette:
+    """录制回放测试"""
+    
+    @pytest.mark.asyncio
+    async def test_record_then_replay_offline(self):
+        """测试录制的响应在服务器关闭后仍可按请求体和参数回放"""
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        from src.core.cassette import CassetteMissError
+        
+        async def search(request):
+            return web.json_response({"q": request.query["q"]})
+        
+        async def login(request):
+            return web.Response(text=f"hello {(await request.post())['user']}", headers={"X-Token": "abc"})
+        
+        app = web.Application()
+        app.router.add_get("/search", search)
+        app.router.add_post("/login", login)
+        server = TestServer(app)
+        await server.start_server()
+        
+        search_url = str(server.make_url("/search"))
+        login_url = str(server.make_url("/login"))
+        path = os.path.join(tempfile.mkdtemp(), "traffic.cassette")
+        config = {"http_cache": {"enabled": False}, "retry_times": 0}
+        recorder = NetworkManager({**config, "cassette": {"mode": "record", "path": path, "flush_size": 1}})
+        try:
+            for keyword in ("甲", "乙", "甲"):
+                await recorder.get_json(search_url, params={"q": keyword})
+            await recorder.post(login_url, data={"user": "tom"})
+        finally:
+            await recorder.close_session()
+            await server.close()
+        assert recorder.cassette.recorded == 4
+        
+        player = NetworkManager({**config, "cassette": {"mode": "replay", "path": path, "time_scale": 0}})
+        try:
+            assert await player.get_json(search_url, params={"q": "乙"}) == {"q": "乙"}
+            assert await player.get_json(search_url, params={"q": "甲"}) == {"q": "甲"}
+            response = await player.post(login_url, data={"user": "tom"})
+            assert await response.text() == "hello tom"
+            assert response.headers["X-Token"] == "abc"
+            with pytest.raises(CassetteMissError):
+                await player.post(login_url, data={"user": "jerry"})
+        finally:
+            await player.close_session()
+        
+        stats = player.get_stats()["cassette"]
+        assert stats["replayed"] == 3
+        assert stats["misses"] == 1
+        # 相同的响应体只保存一份
+        assert len(player.cassette.bodies) == 4
+    
+    @pytest.mark.asyncio
+    async def test_replay_load_scaled_timing(self):
+        """测试按缩放后的耗时回放整段流量并统计延迟"""
+        from src.core.cassette import Cassette, replay_load
+        from src.core.response import HttpResponse
+        
+        path = os.path.join(tempfile.mkdtemp(), "traffic.cassette")
+        cassette = Cassette({"mode": "record", "path": path})
+        for index in range(4):
+            url = f"http://bench.test/chapter/{index}"
+            cassette.record("GET", url, {}, 100.0 + index * 0.2, response=HttpResponse(200, body=b"text", url=url))
+            # 录制耗时固定为 0.2 秒
+            cassette.pending[-1]["duration"] = 0.2
+        cassette.flush()
+        
+        network = NetworkManager({
+            "http_cache": {"enabled": False},
+            "cassette": {"mode": "replay", "path": path, "time_scale": 0.1}
+        })
+        try:
+            report = await replay_load(network, time_scale=0.1)
+        finally:
+            await network.close_session()
+        
+        assert report["requests"] == 4
+        assert report["errors"] == 0
+        assert report["misses"] == 0
+        # 到达间隔 0.2*0.1 秒，耗时 0.2*0.1 秒
+        assert 0.015 <= report["p50_ms"] / 1000 < 0.5
+        assert 0.07 <= report["elapsed"] < 1.0
+        assert report["cpu_per_request_ms"] > 0
+
+    @pytest.mark.asyncio
+    async def test_hedged_requests_not_replayed_as_load(self):
+        """测试向镜像对冲的请求录制时带标记，压测回放时不单独发出"""
+        from src.core.cassette import replay_load
+
+        path = os.path.join(tempfile.mkdtemp(), "traffic.cassette")
+        config = {"http_cache": {"enabled": False}, "retry_times": 0}
+        recorder = NetworkManager({**config, "mirrors": {"default_delay": 0.05},
+                                   "cassette": {"mode": "record", "path": path}})
+        recorder.mirrors.register(["https://a.com", "https://b.com"])
+
+        async def fetch(session, method, url, proxy, started, attempt, kwargs, hedge=False):
+            await asyncio.sleep(1.0 if "a.com" in url else 0.01)
+            response = HttpResponse(200, body=url.encode(), url=url)
+            recorder.cassette.record(method, url, kwargs, started, response=response, attempt=attempt, hedge=hedge)
+            return response
+
+        recorder._fetch = fetch
+        try:
+            await recorder.get("https://b.com/warm")
+            recorder.mirrors.record("a.com", 0.01)
+            # 慢的主站被取消，不产生录制
+            await recorder.get("https://a.com/book/1")
+        finally:
+            await recorder.close_session()
+
+        player = NetworkManager({**config, "cassette": {"mode": "replay", "path": path, "time_scale": 0}})
+        try:
+            report = await replay_load(player, time_scale=None)
+            assert [(item.url, item.hedge) for item in player.cassette.interactions] == [
+                ("https://b.com/warm", False), ("https://b.com/book/1", True)
+            ]
+        finally:
+            await player.close_session()
+
+        assert report["requests"] == 1
+
+
+class TestProfiling:
+    """性能剖析测试"""
+    
+    def test_sampling_writes_folded_stacks(self):
+        """测试采样剖析输出折叠栈，且同一时间只允许一个剖析"""
+        import time
+        from src.core.profiling import Profiler
+        
+        def spin(seconds):
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                pass
+        
+        debug_dir = tempfile.mkdtemp()
+        profiler = Profiler("sampling", {"debug_dir": debug_dir, "sample_interval": 0.001})
+        assert profiler.start("search 测试")
+        try:
+            assert not Profiler("cprofile", {"debug_dir": debug_dir}).start("other")
+            spin(0.1)
+        finally:
+            path = profiler.stop()
+        
+        assert path.endswith(".folded") and os.path.dirname(path) == os.path.join(debug_dir, "profiles")
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == profiler.samples > 10
+        assert any("spin" in line for line in lines)
+        assert any(".spin (" in name and share > 0.5 for name, share in profiler.top(200))
+    
+    @pytest.mark.asyncio
+    async def test_api_profile_header(self):
+        """测试带 X-Profile 请求头的API请求生成 pstats 文件"""
+        import pstats
+        from aiohttp.test_utils import TestClient, TestServer
+        from src.server import ApiServer
+        
+        engine = TestApiServer()._engine()
+        debug_dir = tempfile.mkdtemp()
+        engine.config["debug"] = {"debug_dir": debug_dir}
+        server = ApiServer(engine, {"warmup": False, "allow_profiling": True})
+        async with TestClient(TestServer(server.create_app())) as client:
+            response = await client.get("/api/search", params={"q": "测试"}, headers={"X-Profile": "cprofile"})
+            assert response.status == 200
+            await response.text()
+            profile_id = response.headers["X-Profile-Id"]
+            
+            response = await client.get("/api/search", params={"q": "测试"})
+            assert "X-Profile-Id" not in response.headers
+            
+            response = await client.get("/api/search", params={"q": "测试"}, headers={"X-Profile": "bogus"})
+            assert response.status == 400
+        
+        stats = pstats.Stats(os.path.join(debug_dir, "profiles", profile_id))
+        assert any(func[2] == "search_iter" for func in stats.stats)
+
+
+class TestRuleCost:
+    """规则耗时统计测试"""
+    
+    def setup_method(self):
+        from src.core.rulecost import RULE_COSTS
+        RULE_COSTS.reset()
+    
+    def test_report_ranks_and_logs_slow_rules(self, caplog):
+        """测试按总耗时排序、分位数和慢规则限频日志"""
+        import logging
+        from src.core.rulecost import RuleCostTracker
+        
+        tracker = RuleCostTracker({"slow_rule_threshold": 0.05, "slow_rule_log_interval": 60})
+        for _ in range(10):
+            tracker.record("fast", "ruleSearch.name", "$.name", "json", 0.001)
+        with caplog.at_level(logging.WARNING, logger="rules"):
+            for seconds in (0.01, 0.2, 0.3):
+                tracker.record("slow", "ruleContent.content", "##(a+)+b##", "regex", seconds)
+        
+        report = tracker.report()
+        assert [item["source"] for item in report["sources"]] == ["slow", "fast"]
+        worst = report["rules"][0]
+        assert worst["field"] == "ruleContent.content"
+        assert worst["slow"] == 2 and worst["count"] == 3
+        assert worst["max_ms"] == pytest.approx(300)
+        assert report["rules"][1]["p50_ms"] == pytest.approx(1)
+        assert len([r for r in caplog.records if "慢规则" in r.getMessage()]) == 1
+    
+    def test_registered_source_rules_are_attributed(self):
+        """测试注册后书源的规则解析记在书源和字段名下"""
+        from src.core.rulecost import RULE_COSTS
+        from src.core.rules import SourceRules
+        
+        class FieldSource(BaseSource):
+            async def search(self, keyword, page=1):
+                return []
+            
+            async def get_book_info(self, book_url):
+                return BookInfo()
+            
+            async def get_toc(self, toc_url):
+                return []
+            
+            async def get_content(self, chapter_url):
+                return ContentInfo()
+        
+        engine = BookSourceEngine(isolated_config())
+        source = FieldSource({"bookSourceName": "字段书源"})
+        engine.register_source("field", source)
+        assert isinstance(source.rules, SourceRules)
+        
+        result = source.rules.parse_multiple_rules({"name": "$.name", "author": "$.author"},
+                                                   '{"name": "书名", "author": "作者"}')
+        assert result == {"name": "书名", "author": "作者"}
+        engine.rules.parse_rule("$.name", '{"name": "x"}')
+        
+        rules = {(item["source"], item["field"]): item for item in RULE_COSTS.report()["rules"]}
+        assert set(rules) == {("field", "name"), ("field", "author"), ("", "")}
+        assert rules[("field", "name")]["type"] == "json"
+
+
+class TestRegexGuard:
+    """正则防护测试"""
+    
+    def test_static_check(self):
+        """测试静态检查识别常见的 ReDoS 结构"""
+        from src.core.regexguard import check_pattern
+        
+        assert check_pattern(r"(\w+\s?)+$") == "嵌套的无界量词"
+        assert check_pattern(r"^(a|aa)+$") == "量词作用于相互重叠的分支"
+        assert check_pattern(r".*.*=.*") == "相邻的 .* 重复"
+        assert check_pattern(r"番茄小说.*?最新章节|www\.fanqienovel\.com") is None
+        assert check_pattern(r"书名：《(.+?)》") is None
+        assert check_pattern(r"(?:\s*\n)+") == "嵌套的无界量词"
+        assert check_pattern(r"(\d\w|\w\d)+$") == "量词作用于相互重叠的分支"
+    
+    def test_static_check_negatives(self):
+        """测试每次重复边界确定、或分支开头互不相交的模式不被误报"""
+        from src.core.regexguard import check_pattern
+        
+        assert check_pattern(r"(?:<br\s*/?>|\n)+") is None
+        assert check_pattern(r"(\s|&nbsp;)+") is None
+        assert check_pattern(r"([a-z]+\.)+com") is None
+        assert check_pattern(r"(\d+,)+") is None
+        assert check_pattern(r"(x\d|y\w)+$") is None
+    
+    def test_timeout_disables_pattern(self):
+        """测试超时的模式被停用，之后直接跳过"""
+        from src.core.regexguard import RegexGuard
+        
+        guard = RegexGuard({"regex_timeout": 0.05, "regex_disable_after": 1})
+        text = "a" * 40 + "b"
+        assert guard.sub(r"^(a|aa)+$", "", text) == text
+        assert "^(a|aa)+$" in guard.disabled
+        assert guard.findall(r"^(a|aa)+$", "aa") == []
+        assert guard.sub(r"(\d+)", r"<\1>", "第12章") == "第<12>章"
+        
+        stats = guard.get_stats()
+        assert stats["timeouts"] == 1 and stats["skipped"] == 1
+        assert stats["unsafe"]["^(a|aa)+$"] == "量词作用于相互重叠的分支"
+    
+    def test_regex_rule_uses_guard(self):
+        """测试 ## 开头的规则按正则解析"""
+        rules = RuleEngine()
+        assert rules.get_rule_type("##书名：《(.+?)》") == "regex"
+        assert rules.parse_rule("##广告\\d+##", "正文广告123正文") == "正文正文"
+
+
+class TestContentPurifier:
+    """正文净化测试"""
+
+    def test_rules_merged_into_one_scan(self):
+        """测试可合并的规则合并为一次扫描，纯文本分支参与预筛"""
+        from src.core.purifier import ContentPurifier
+        from src.core.regexguard import RegexGuard
+
+        purifier = ContentPurifier(
+            "##番茄小说.*?最新章节|www\\.fanqienovel\\.com|字节跳动.*?版权所有\n##广告\\d+\n##求月票##[求票]",
+            guard=RegexGuard()
+        )
+        assert len(purifier.passes) == 1
+        assert purifier.passes[0].merged == 3
+        assert "www.fanqienovel.com" in purifier.passes[0].prefilter
+
+        text = "番茄小说看最新章节正文www.fanqienovel.com广告12求月票"
+        assert purifier.purify(text) == "正文[求票]"
+        assert purifier.purify("干净的正文") == "干净的正文"
+
+        stats = purifier.get_stats()
+        assert stats["chapters"] == 2 and stats["passes"] == 1 and stats["prefiltered"] == 1
+
+    def test_unmergeable_rules_keep_order(self):
+        """测试分组引用和只替换第一处的规则单独执行"""
+        from src.core.purifier import ContentPurifier, parse_replace_rules
+        from src.core.regexguard import RegexGuard
+
+        rules = parse_replace_rules("##第(\\d+)章##Chapter $1\n##abc###\n##广告")
+        assert [rule.first_only for rule in rules] == [False, True, False]
+
+        purifier = ContentPurifier(rules=[f"##{rule}" for rule in ("第(\\d+)章##Chapter $1", "abc###", "广告")],
+                                   guard=RegexGuard())
+        assert len(purifier.passes) == 3
+        assert purifier.purify("第3章abcabc广告") == "Chapter 3abc"
+
+        purifier.configure({"purify_content": False})
+        assert purifier.purify("广告") == "广告"
+
+    def test_disabled_merged_pattern_falls_back(self):
+        """测试合并模式被停用后拆回逐条执行，其余规则仍然生效"""
+        from src.core.purifier import ContentPurifier
+        from src.core.regexguard import RegexGuard
+
+        guard = RegexGuard()
+        purifier = ContentPurifier("##广告\\d+\n##求月票", {"purify_patterns": ["##本章未完"]}, guard=guard)
+        assert len(purifier.passes) == 1
+        guard._disable(purifier.passes[0].pattern, "测试")
+
+        assert purifier.purify("广告1求月票正文本章未完") == "正文"
+        assert purifier.get_stats()["fallbacks"] == 1
+        assert len(purifier.passes) == 3
+        assert [item.prefilter for item in purifier.passes] == [("广告",), ("求月票",), ("本章未完",)]
+
+    def test_fallback_resumes_at_failed_pass(self):
+        """测试合并模式停用后从该次扫描继续，前面已执行的规则不重复执行"""
+        from src.core.purifier import ContentPurifier
+        from src.core.regexguard import RegexGuard
+
+        guard = RegexGuard()
+        purifier = ContentPurifier("##第(\\d+)章##第$1$1章\n##广告\\d+\n##求月票", guard=guard)
+        assert [item.merged for item in purifier.passes] == [1, 2]
+        guard._disable(purifier.passes[1].pattern, "测试")
+
+        assert purifier.purify("第1章广告1求月票") == "第11章"
+        assert len(purifier.passes) == 3
+
+    @pytest.mark.asyncio
+    async def test_purify_does_not_touch_shared_content(self):
+        """测试净化写入副本，拼接器返回的共享对象保持原样"""
+        class PlainSource(BaseSource):
+            async def search(self, keyword, page=1):
+                return []
+
+            async def get_book_info(self, book_url):
+                return BookInfo()
+
+            async def get_toc(self, toc_url):
+                return []
+
+            async def get_content(self, chapter_url):
+                return ContentInfo()
+
+        source = PlainSource({
+            "bookSourceName": "测试书源",
+            "bookSourceUrl": "https://test.com",
+            "ruleContent": {"replaceRegex": "##正文##内容"},
+        })
+        shared = ContentInfo(title="第一章", content="正文正文")
+        source.stitcher.stitch = AsyncMock(return_value=shared)
+
+        first = await source.get_full_content("https://test.com/1")
+        second = await source.get_full_content("https://test.com/1")
+
+        assert first.content == second.content == "内容内容"
+        assert shared.content == "正文正文"
+        assert source.purifier.get_stats()["chapters"] == 2
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])